@@ -8,6 +8,7 @@ from mininet.log import setLogLevel
 
 from ryu.lib import hub
 import argparse
+import topolib
 
 #Link parameter
 linkopts1 = dict(bw=100,  delay='1ms') #Host link
@@ -53,15 +54,29 @@ def main(*args):
     parser = argparse.ArgumentParser()
     parser.add_argument('--NumOFS',  type=int, action="store", default=1)
     parser.add_argument('--NumHost', type=int, action="store", default=2)
+    #Sharded controllers: s<dpid> connects to c<(dpid-1) % N> on port base+i
+    parser.add_argument('--controllers', type=int, action="store", default=1)
+    parser.add_argument('--controller-port', type=int, action="store", default=6653)
+    topolib.add_arguments(parser)
     args = parser.parse_args()
 
     NumOFS = args.NumOFS
     NumHost= args.NumHost
 
-    mytopo = MyTopo(NumOFS,NumHost)
-    net  = Mininet(topo=mytopo, switch=OVSKernelSwitch, 
-                   controller=RemoteController("c0", ip="127.0.0.1"), 
-                   autoSetMacs=True, link=TCLink)
+    if args.topo == 'ring' and not args.load and not args.save:
+        mytopo = MyTopo(NumOFS,NumHost)
+    else:
+        mytopo = topolib.from_args(args).to_mininet(NumHost)
+    if args.controllers > 1:
+        net  = Mininet(topo=mytopo, switch=OVSKernelSwitch, controller=None,
+                       autoSetMacs=True, link=TCLink)
+        ctrls = [net.addController(RemoteController("c{}".format(i), ip="127.0.0.1",
+                                                    port=args.controller_port+i))
+                 for i in range(args.controllers)]
+    else:
+        net  = Mininet(topo=mytopo, switch=OVSKernelSwitch, 
+                       controller=RemoteController("c0", ip="127.0.0.1"), 
+                       autoSetMacs=True, link=TCLink)
     
 
     #Run default command from hosts. E.g., Disable IPv6:
@@ -71,7 +86,13 @@ def main(*args):
         h.cmd("sysctl -w net.ipv6.conf.lo.disable_ipv6=1")
 
     #Start simulation --------------------------
-    net.start()
+    if args.controllers > 1:
+        for c in ctrls:
+            c.start()
+        for s in net.switches:
+            s.start([ctrls[(int(s.dpid, 16) - 1) % args.controllers]])
+    else:
+        net.start()
 
     
 
@@ -0,0 +1,295 @@
+# Parametric switch topologies for customtopo.py, emunet.py and the graph
+# simulations (assign1.py): ring, fat-tree(k), 2D/3D torus, leaf-spine and
+# random geometric graphs, each built as a numpy edge list so 10^4+ switch
+# networks take milliseconds, not one Python loop iteration per link.
+#
+#   python topolib.py --topo fattree --k 8 --save fattree8.json
+#   sudo python customtopo.py --topo torus --dims 8x8 --NumHost 1
+#   python emunet.py --load fattree8.json --NumHost 1
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+#Link parameter, as in customtopo.py
+linkopts1 = dict(bw=100,  delay='1ms') #Host link
+linkopts2 = dict(bw=1000, delay='3ms') #Switch Link
+
+TOPOLOGIES = ('ring', 'fattree', 'torus', 'leafspine', 'rgg')
+
+
+##########################################################################################
+#Switch graph
+class SwitchGraph(object):
+    ''' Switch-level topology. Switch i (0-based) is named s{i+1};
+    `edges` is an int array of shape (E, 2) with u < v and no duplicates;
+    `edge_switches` are the switches hosts attach to (all by default) and
+    `pos` is an (N, 2) array of node locations in [0, 1) for drawing. '''
+
+    def __init__(self, name, num_switches, edges, edge_switches=None, pos=None, params=None):
+        self.name = name
+        self.num_switches = int(num_switches)
+        self.edges = normalize_edges(edges)
+        if edge_switches is None:
+            edge_switches = np.arange(self.num_switches)
+        self.edge_switches = np.asarray(edge_switches, dtype=np.int64)
+        self.pos = None if pos is None else np.asarray(pos, dtype=float)
+        self.params = params or {}
+
+    def __repr__(self):
+        return '<SwitchGraph {} {}: {} switches, {} links, {} edge switches>'.format(
+            self.name, self.params, self.num_switches, len(self.edges), len(self.edge_switches))
+
+    def degree(self):
+        return np.bincount(self.edges.ravel(), minlength=self.num_switches)
+
+    def build(self, topo, noHost=1, host_opts=linkopts1, switch_opts=linkopts2):
+        ''' Add the switches, noHost hosts per edge switch and all links to
+        topo, anything with the mininet.topo.Topo API (addHost/addSwitch/
+        addLink). Nodes are added in the same order as MyTopo: hosts, then
+        switches, host links, switch links. '''
+        Host = []
+        OFS  = []
+        for i in range(len(self.edge_switches) * noHost):
+            Host.append(topo.addHost("h{}".format(i+1), ip=host_ip(i+1)))
+        for i in range(self.num_switches):
+            OFS.append(topo.addSwitch("s{}".format(i+1)))
+        for i, s in enumerate(self.edge_switches.tolist()):
+            for j in range(noHost):
+                topo.addLink(Host[i*noHost+j], OFS[s], **host_opts)
+        for u, v in self.edges.tolist():
+            topo.addLink(OFS[u], OFS[v], **switch_opts)
+        return topo
+
+    def to_mininet(self, noHost=1, **opts):
+        from mininet.topo import Topo
+        return self.build(Topo(), noHost, **opts)
+
+    def to_networkx(self, M=None):
+        ''' Undirected networkx graph of the switches with the pos attribute;
+        with M given, also the wrk attribute generate_graph() in assign1.py
+        sets ('s' for the first M nodes, 'd' for the rest). '''
+        import networkx as nx
+        G = nx.Graph()
+        G.add_nodes_from(range(self.num_switches))
+        G.add_edges_from(self.edges.tolist())
+        pos = self.pos if self.pos is not None else layout_circle(self.num_switches)
+        nx.set_node_attributes(G, dict(enumerate(map(tuple, pos.tolist()))), 'pos')
+        if M is not None:
+            nx.set_node_attributes(G, dict((i, 's' if i < M else 'd') for i in range(self.num_switches)), 'wrk')
+        return G
+
+    def to_dict(self):
+        d = {'name': self.name, 'params': self.params, 'num_switches': self.num_switches,
+             'edges': self.edges.tolist(), 'edge_switches': self.edge_switches.tolist()}
+        if self.pos is not None:
+            d['pos'] = self.pos.round(6).tolist()
+        return d
+
+    def save_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    def save_edgelist(self, path):
+        ''' One "s<u> s<v>" line per switch link; the edge switches are kept
+        in a comment line so load() can read the file back. '''
+        with open(path, 'w') as f:
+            f.write('# {} {} switches={} edge_switches={}\n'.format(
+                self.name, json.dumps(self.params, sort_keys=True).replace(' ', ''), self.num_switches,
+                ','.join(str(s + 1) for s in self.edge_switches.tolist())))
+            np.savetxt(f, self.edges + 1, fmt='s%d s%d')
+
+    def save(self, path):
+        if path.endswith('.json'):
+            self.save_json(path)
+        else:
+            self.save_edgelist(path)
+
+
+def load(path):
+    ''' Read a file written by SwitchGraph.save_json() or save_edgelist() '''
+    if path.endswith('.json'):
+        with open(path) as f:
+            d = json.load(f)
+        return SwitchGraph(d['name'], d['num_switches'], np.array(d['edges'], dtype=np.int64).reshape(-1, 2),
+                           d.get('edge_switches'), d.get('pos'), d.get('params'))
+
+    name, params, num_switches, edge_switches = 'edgelist', {}, None, None
+    rows = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('#'):
+                fields = line[1:].split()
+                if len(fields) >= 2 and fields[1].startswith('{'):
+                    name, params = fields[0], json.loads(fields[1])
+                for field in fields:
+                    if field.startswith('switches='):
+                        num_switches = int(field.split('=')[1])
+                    elif field.startswith('edge_switches=') and field.split('=')[1]:
+                        edge_switches = [int(s) - 1 for s in field.split('=')[1].split(',')]
+                continue
+            u, v = line.split()[:2]
+            rows.append((int(u.lstrip('s')) - 1, int(v.lstrip('s')) - 1))
+    edges = np.array(rows, dtype=np.int64).reshape(-1, 2)
+    if num_switches is None:
+        num_switches = int(edges.max()) + 1 if len(edges) else 0
+    return SwitchGraph(name, num_switches, edges, edge_switches, None, params)
+
+
+def normalize_edges(edges):
+    ''' (E, 2) int64 array, u < v, self-loops and duplicates removed, sorted '''
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    edges = np.sort(edges, axis=1)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    if len(edges) == 0:
+        return edges
+    return np.unique(edges, axis=0)
+
+
+def host_ip(h):
+    ''' 10.0.0.h for the first 254 hosts, as in customtopo.py, then 10.x.y.z '''
+    return "10.{}.{}.{}".format((h >> 16) & 0xff, (h >> 8) & 0xff, h & 0xff)
+
+
+def layout_circle(n):
+    t = 2 * np.pi * np.arange(n) / max(n, 1)
+    return np.column_stack((0.5 + 0.45 * np.cos(t), 0.5 + 0.45 * np.sin(t)))
+
+
+def layout_layers(sizes):
+    ''' Rows of evenly spaced nodes, first layer on top '''
+    pos = []
+    for row, size in enumerate(sizes):
+        x = (np.arange(size) + 0.5) / size
+        y = np.full(size, 1.0 - (row + 0.5) / len(sizes))
+        pos.append(np.column_stack((x, y)))
+    return np.vstack(pos)
+
+
+##########################################################################################
+#Topologies
+def ring(n):
+    ''' Ring of n switches, the switch links of MyTopo '''
+    i = np.arange(n)
+    return SwitchGraph('ring', n, np.column_stack((i, (i + 1) % n)), pos=layout_circle(n), params={'n': n})
+
+
+def fat_tree(k):
+    ''' k-ary fat-tree (Al-Fares et al.): (k/2)^2 core switches, k pods of
+    k/2 aggregation and k/2 edge switches. Switches are numbered core, then
+    aggregation, then edge, pod by pod; hosts attach to edge switches. '''
+    assert k >= 2 and k % 2 == 0, "<FATAL> fat_tree(): k must be even"
+    h = k // 2
+    num_core = h * h
+    agg = num_core + np.arange(k * h).reshape(k, h)      # agg[pod, j]
+    edge = num_core + k * h + np.arange(k * h).reshape(k, h)   # edge[pod, i]
+
+    # every edge switch of a pod to every aggregation switch of the pod
+    e = np.broadcast_to(edge[:, :, None], (k, h, h))
+    a = np.broadcast_to(agg[:, None, :], (k, h, h))
+    pod_links = np.column_stack((e.ravel(), a.ravel()))
+    # aggregation switch j of each pod to core switches j*h .. j*h+h-1
+    core = np.arange(num_core).reshape(h, h)             # core[j, m]
+    a = np.broadcast_to(agg[:, :, None], (k, h, h))
+    c = np.broadcast_to(core[None, :, :], (k, h, h))
+    core_links = np.column_stack((a.ravel(), c.ravel()))
+
+    pos = layout_layers([num_core, k * h, k * h])
+    return SwitchGraph('fattree', num_core + 2 * k * h, np.vstack((pod_links, core_links)),
+                       edge.ravel(), pos, {'k': k})
+
+
+def torus(dims):
+    ''' 2D or 3D torus (wrap-around grid), e.g. dims=(8, 8) or (4, 4, 4).
+    Dimensions of size 2 get a single link, size 1 none. '''
+    dims = tuple(int(d) for d in dims)
+    assert len(dims) in (2, 3) and min(dims) >= 1, "<FATAL> torus(): dims must be 2 or 3 positive sizes"
+    n = int(np.prod(dims))
+    idx = np.arange(n).reshape(dims)
+    links = [np.column_stack((idx.ravel(), np.roll(idx, -1, axis=axis).ravel()))
+             for axis in range(len(dims))]
+
+    grid = np.indices(dims[:2]).reshape(2, -1).T if len(dims) == 2 else \
+        np.indices(dims).reshape(3, -1).T
+    pos = (grid[:, :2] + 0.5) / np.array(dims[:2], dtype=float)
+    if len(dims) == 3:
+        # layers side by side, shrunk so they don't overlap
+        pos = (pos + np.column_stack((grid[:, 2], np.zeros(n)))) / np.array([dims[2], 1.0])
+    return SwitchGraph('torus', n, np.vstack(links), pos=pos, params={'dims': list(dims)})
+
+
+def leaf_spine(leaves, spines):
+    ''' Two-tier Clos: every leaf to every spine; hosts attach to leaves.
+    Spines are s1..s{spines}, leaves follow. '''
+    spine = np.arange(spines)
+    leaf = spines + np.arange(leaves)
+    s, l = np.meshgrid(spine, leaf)
+    return SwitchGraph('leafspine', spines + leaves, np.column_stack((l.ravel(), s.ravel())),
+                       leaf, layout_layers([spines, leaves]), {'leaves': leaves, 'spines': spines})
+
+
+def random_geometric(N, D, seed=None):
+    ''' The graph generate_graph() in assign1.py builds, made by its
+    random_geometric_graph() so the two can't drift apart: N nodes uniform in
+    [0, 1)^2, linked when within distance D, disconnected components merged by
+    merge_disconnected_components(). Needs assign1.py at the top of the tree. '''
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, os.pardir)
+    if root not in sys.path:
+        sys.path.append(root)
+    import assign1
+
+    G = assign1.random_geometric_graph(N, D, seed)
+    edges = np.array(list(G.edges()), dtype=np.int64).reshape(-1, 2)
+    pos = np.array([G.nodes[v]['pos'] for v in range(N)], dtype=float).reshape(N, 2)
+    return SwitchGraph('rgg', N, edges, pos=pos, params={'N': N, 'D': D, 'seed': seed})
+
+
+##########################################################################################
+#Command line, shared by customtopo.py and emunet.py
+def add_arguments(parser):
+    parser.add_argument('--topo', action="store", default='ring', choices=TOPOLOGIES)
+    parser.add_argument('--k', type=int, action="store", default=4, help="fat-tree arity")
+    parser.add_argument('--dims', action="store", default='4x4', help="torus size, e.g. 8x8 or 4x4x4")
+    parser.add_argument('--spines', type=int, action="store", default=2, help="leaf-spine: NumOFS leaves")
+    parser.add_argument('--radius', type=float, action="store", default=0.125, help="rgg: NumOFS nodes")
+    parser.add_argument('--topo-seed', type=int, action="store", default=None)
+    parser.add_argument('--load', action="store", default=None, help="json or edge-list file, instead of --topo")
+    parser.add_argument('--save', action="store", default=None, help="write the topology (.json or edge list)")
+
+
+def from_args(args):
+    if args.load:
+        graph = load(args.load)
+    elif args.topo == 'fattree':
+        graph = fat_tree(args.k)
+    elif args.topo == 'torus':
+        graph = torus([int(d) for d in args.dims.lower().split('x')])
+    elif args.topo == 'leafspine':
+        graph = leaf_spine(args.NumOFS, args.spines)
+    elif args.topo == 'rgg':
+        graph = random_geometric(args.NumOFS, args.radius, args.topo_seed)
+    else:
+        graph = ring(args.NumOFS)
+    if args.save:
+        graph.save(args.save)
+    return graph
+
+
+def main(*args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--NumOFS', type=int, action="store", default=4)
+    add_arguments(parser)
+    args = parser.parse_args()
+    graph = from_args(args)
+    print(graph)
+    degree = graph.degree()
+    print("   degree min/mean/max = {}/{:.2f}/{}".format(degree.min(), degree.mean(), degree.max()))
+
+
+if __name__ == "__main__":
+    main()
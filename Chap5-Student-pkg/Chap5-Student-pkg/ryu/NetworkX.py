@@ -3,13 +3,27 @@ from ryu.ofproto import ofproto_v1_3, ether
 from ryu.controller.handler import set_ev_cls
 from ryu.controller import ofp_event
 from ryu.topology import event
-from ryu.topology.api import get_switch, get_link
+from ryu.topology.api import get_switch
 from ryu.lib import hub
-from ryu.controller.handler import MAIN_DISPATCHER, CONFIG_DISPATCHER
+from ryu.controller.handler import MAIN_DISPATCHER, CONFIG_DISPATCHER, DEAD_DISPATCHER
 from ryu.lib.packet import packet, ethernet, arp, lldp, icmpv6
+from ryu.topology.switches import LLDPPacket
+# Helper modules, copies of the ones next to assign3's switch: they have
+# to be deployed in the same directory as this file (ryu-manager puts it on
+# sys.path), and a fix to one copy goes to the other too.
+from msg_batch import MsgBatcher
+from admission import Admission
+from metrics import Metrics, port_from_env
+from lifecycle import FlowLifecycle
+from route_jobs import RouteJobs
+import sharding
+import checkpoint
+import logging
 #
 # NetworkX
-# <Add code here>
+import networkx as nx
+import numpy as np
+import time
 
 class NetworkX(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
@@ -18,10 +32,100 @@ class NetworkX(app_manager.RyuApp):
     #
     def __init__(self, *args, **kwargs):
         super(NetworkX, self).__init__(*args, **kwargs)
-        self.network_changed_thread = hub.spawn_after(1,None)
+        # FlowMods/PacketOuts are coalesced per datapath before being written
+        self.batcher = MsgBatcher()
+        # counters, Packet-In latency and flow-table occupancy, served as
+        # Prometheus text on http://127.0.0.1:metrics_port/metrics (9108, plus
+        # the shard number when sharded; RYU_METRICS_PORT overrides it)
+        self.metrics = Metrics(self.logger)
+        # token buckets per datapath / source MAC in front of packet_in_handler
+        self.admission = Admission(self.metrics)
+        self.metrics.add_source('batcher', self.batcher.report)
+        self.metrics.add_source('admission', self.admission.report)
+        self.metrics_port = port_from_env()
+        self.metrics.serve(self.metrics_port)
+        # adaptive idle timeouts, LRU eviction near flow_table_capacity
+        self.flow_table_capacity = 2000
+        self.lifecycle = FlowLifecycle(self.metrics, self.batcher.send, capacity=self.flow_table_capacity)
+        self.metrics.add_source('lifecycle', self.lifecycle.report)
+        hub.spawn(self.lifecycle.monitor)
         #
         # NetworkX
-        # <Add code here>
+        # Persistent topology: nodes are dpids, edge (src, dst) has the
+        # attribute port = output port on src towards dst
+        self.G = nx.DiGraph()
+        # hosts[MAC] = (dpid, port) of the edge port the host is attached to
+        self.hosts = {}
+        # (dpid, port) of every inter-switch port
+        self.switch_ports = set()
+        # Forwarding table: next_port[index[src], index[dst]] = output port
+        # on src towards dst (-1 = no route). Rebuilt on topology changes,
+        # off the hub by route_jobs; the old table serves until the new one
+        # (table_version) is swapped in.
+        self.dpid_index = {}
+        self.next_port = np.full((0, 0), -1, dtype=np.int32)
+        self.table_version = 0
+        # flood_blocked[dpid] = ports of dpid on links off the flooding
+        # spanning tree, built with the table. Unknown destinations are only
+        # flooded along the tree, so broadcasts can't loop.
+        self.flood_blocked = {}
+        self.route_jobs = RouteJobs()
+        self.metrics.add_source('route_jobs', self.route_jobs.report)
+        # ECMP: when a switch has several equal-cost next hops towards a
+        # destination switch, traffic goes to a SELECT group (group id =
+        # destination dpid) instead of a single port.
+        # Protection: otherwise, if a loop-free alternate next hop exists,
+        # traffic goes to a FAST-FAILOVER group (same group id) watching the
+        # primary port, so the OFS switches over without the controller.
+        # groups[(dpid, dst dpid)] = (group type, ((port, bucket weight), ...))
+        self.multipath = True
+        self.protection = True
+        self.groups = {}
+        # next_hops of the table in use, to reinstall a reconnected OFS's groups
+        self.next_hops = {}
+        #
+        # Link cost monitor: port statistics are polled every poll_interval
+        # and turned into edge weights
+        #   weight = 1 + util_cost * utilization + loss_cost * loss rate
+        # A weight is only changed when it moves by more than hysteresis
+        # (relative), so routes don't flap on noisy counters.
+        self.datapaths = {}
+        self.port_stats = {}    # (dpid, port) -> (time, tx_bytes, tx_packets, rx_packets)
+        self.port_rates = {}    # (dpid, port) -> (tx bit/s, tx packets, rx packets) since last poll
+        self.poll_interval = 2
+        self.link_capacity = 1e9   # switch links in customtopo are 1 Gbit
+        self.util_cost = 4.0
+        self.loss_cost = 20.0
+        self.hysteresis = 0.2
+        self.monitor_thread = hub.spawn(self.monitor)
+        #
+        # Sharding (RYU_SHARDS > 1, see sharding.py): this process only
+        # gets the OFSs it owns. Links and host locations are shared with
+        # the other shards, so G and hosts are global and the owner of each
+        # OFS on a path routes its own hop.
+        # remote_links[(src, dst)] = time of the last LLDP between shards
+        self.shards = sharding.from_env()
+        self.remote_links = {}
+        self.remote_link_timeout = 10
+        if self.shards is not None:
+            self.shards.subscribe('links', self.shard_link)
+            self.shards.subscribe('hosts', self.shard_host)
+            self.metrics.add_source('shards', self.shards.report)
+        #
+        # Warm restart (RYU_CHECKPOINT, see checkpoint.py): G and hosts are
+        # saved while they change and restored at start up. Restored links
+        # not rediscovered within restore_grace are deleted, and the flows
+        # every OFS kept are checked against hosts (FlowStats) when it
+        # connects.
+        self.checkpoint = checkpoint.from_env()
+        self.restored = False
+        self.restored_links = set()
+        self.restore_grace = 10
+        self.revalidating = set()
+        if self.checkpoint is not None:
+            self.restore(self.checkpoint.load())
+            self.metrics.add_source('checkpoint', self.checkpoint.report)
+            hub.spawn(self.checkpoint.run, self.checkpoint_state)
 
     ##############################################################
     # Handle PACKET-IN message
@@ -41,65 +145,351 @@ class NetworkX(app_manager.RyuApp):
         # ****
         # Ignore LLDP, ICMPv6 packets
         if pkt.get_protocol(lldp.lldp) or pkt.get_protocol(icmpv6.icmpv6):
+            if self.shards is not None and pkt.get_protocol(lldp.lldp):
+                self.shard_lldp(dpid, pin, msg.data)
+            return
+        started = self.metrics.packet_in(dp)
+
+        # Shed Packet-Ins over the rate limits (ARP storms, scans)
+        if not self.admission.admit(dp, smac, pin):
             return
-        
-        print("\nOFC receives Packet-In message from Datapath ID of {}".format(dpid))
 
         # Learn source MAC address and port
         # NetworkX
-        # <Add code here>
-        
-        print("\n   - DATA info: packet from {} to {}".format(smac,dmac))
+        if (dpid, pin) not in self.switch_ports and self.hosts.get(smac) != (dpid, pin):
+            self.hosts[smac] = (dpid, pin)
+            self.changed()
+            if self.shards is not None:
+                self.shards.put('hosts', smac, [dpid, pin])
+        self.metrics.log('packet_in', logging.DEBUG, dpid=dpid, src=smac, dst=dmac, in_port=pin)
+        self.lifecycle.packet_in(dpid, dmac)
 
         # Find best route
         # NetworkX
-        # <Add code here>
+        ofp        = dp.ofproto
+        ofp_parser = dp.ofproto_parser
+        group_id   = self.lookup_group(dpid, dmac)
+        port_out   = self.lookup_port(dpid, dmac)
+
+        if group_id is not None:
+            actions = [ofp_parser.OFPActionGroup(group_id)]
+        elif port_out is not None:
+            actions = [ofp_parser.OFPActionOutput(port_out)]
+        else:
+            actions = self.flood_actions(dp, pin)
+            if actions is None:
+                return
+        if port_out is not None:
+            match        = ofp_parser.OFPMatch(eth_dst=dmac, in_port=pin)
+            instructions = [ofp_parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
+            self.flow_add(dp, self.lifecycle.timeout(dpid, dmac), 1, match, instructions)
+
+        data = None
+        if msg.buffer_id == ofp.OFP_NO_BUFFER:
+            data = msg.data
+        out = ofp_parser.OFPPacketOut(datapath=dp, buffer_id=msg.buffer_id,
+                                      in_port=pin, actions=actions, data=data)
+        self.batcher.send(dp, out)
+        self.metrics.packet_out(dp, started, flood=(port_out is None))
+
+    # Flood along the spanning tree: every port but pin and the blocked
+    # ones. Packets coming in on a blocked port, or before the first table
+    # is in, are dropped.
+    def flood_actions(self, dp, pin):
+        ofp        = dp.ofproto
+        ofp_parser = dp.ofproto_parser
+        if dp.id not in self.dpid_index:
+            return None
+        blocked = self.flood_blocked.get(dp.id, set())
+        if pin in blocked:
+            return None
+        if not blocked:
+            return [ofp_parser.OFPActionOutput(ofp.OFPP_FLOOD)]
+        ports = []
+        for switch in get_switch(self, dp.id):
+            ports = [p.port_no for p in switch.ports
+                     if p.port_no != pin and p.port_no not in blocked]
+        return [ofp_parser.OFPActionOutput(port) for port in ports]
+
+    def lookup_group(self, dpid, dmac):
+        if dmac not in self.hosts:
+            return None
+        dst_dpid = self.hosts[dmac][0]
+        if (dpid, dst_dpid) in self.groups:
+            return dst_dpid
+        return None
+
+    # Per-packet routing is two dict lookups and one array read
+    def lookup_port(self, dpid, dmac):
+        if dmac not in self.hosts:
+            return None
+        dst_dpid, dst_port = self.hosts[dmac]
+        if dst_dpid == dpid:
+            return dst_port
+        index = self.dpid_index
+        if dpid not in index or dst_dpid not in index:
+            return None
+        port = int(self.next_port[index[dpid], index[dst_dpid]])
+        if port < 0:
+            return None
+        return port
 
 
 
     ##############################################################
     # Network Changed:
+    # Every event only applies its own delta to self.G and schedules a
+    # rebuild of the forwarding table.
     #######################################
     # Switch is added
     @set_ev_cls(event.EventSwitchEnter)
     def handler_switch_enter(self, ev):
-        print("Switch entering (Datapath ID = {}) ---------------".format(ev.switch.dp.id))
-        hub.kill(self.network_changed_thread)
-        self.network_changed_thread = hub.spawn_after(1,self.network_changed)
+        self.metrics.log('switch_enter', dpid=ev.switch.dp.id)
+        self.G.add_node(ev.switch.dp.id)
+        self.schedule_table_update()
         
     #######################################
     # Switch is removed/unavailable
     @set_ev_cls(event.EventSwitchLeave)
     def handler_switch_leave(self, ev):
-        print("Switch leaving (Datapath ID = {}) ---------------".format(ev.switch.dp.id))
-        hub.kill(self.network_changed_thread)
-        self.network_changed_thread = hub.spawn_after(1,self.network_changed)
+        dpid = ev.switch.dp.id
+        self.metrics.log('switch_leave', dpid=dpid)
+        if dpid in self.G:
+            self.G.remove_node(dpid)
+            self.switch_ports = set(p for p in self.switch_ports if p[0] != dpid)
+            self.schedule_table_update()
 
     #######################################
-    # Update the topology
-    def network_changed(self):
-        print("\nNetwork is changed-------------------------------")
-        self.topo_raw_links = get_link(self, None)
-        self.BuildTopology()
+    # Link is added
+    @set_ev_cls(event.EventLinkAdd)
+    def handler_link_add(self, ev):
+        l = ev.link
+        self.restored_links.discard((l.src.dpid, l.dst.dpid))
+        self.link_add(l.src.dpid, l.dst.dpid, l.src.port_no)
+        self.publish_link(l.src.dpid, l.dst.dpid)
 
-    def BuildTopology(self):
-        # NetworkX
-        # <Add code here>
+    #######################################
+    # Link is removed/unavailable
+    @set_ev_cls(event.EventLinkDelete)
+    def handler_link_delete(self, ev):
+        l = ev.link
+        self.link_delete(l.src.dpid, l.dst.dpid)
+        self.publish_link(l.src.dpid, l.dst.dpid)
+
+    def link_add(self, src, dst, port):
+        if self.G.has_edge(src, dst):
+            self.G[src][dst]['port'] = port
+            return
+        self.G.add_edge(src, dst, port=port, weight=1.0)
+        self.switch_ports.add((src, port))
+        self.schedule_table_update()
+        self.metrics.log('link_add', src=src, dst=dst, port=port)
+
+    def link_delete(self, src, dst):
+        if not self.G.has_edge(src, dst):
+            return
+        self.metrics.log('link_delete', src=src, dst=dst)
+        self.switch_ports.discard((src, self.G[src][dst]['port']))
+        self.G.remove_edge(src, dst)
+        self.schedule_table_update()
+
+    #######################################
+    # Forwarding table
+    # A burst of topology events triggers a single rebuild
+    def schedule_table_update(self):
+        self.changed()
+        self.route_jobs.request('forwarding', self.table_snapshot,
+                                build_forwarding_table, self.install_forwarding_table)
 
-        for l in self.topo_raw_links:
-            _dpid_src = l.src.dpid
-            _dpid_dst = l.dst.dpid
-            _port_src = l.src.port_no
-            _port_dst = l.dst.port_no
-            
-            # NetworkX
-            # <Add code here>
+    def table_snapshot(self):
+        return self.G.copy(), self.multipath, self.protection
 
+    # swap in the new table in one step; flows still sending to an old
+    # next hop are deleted, so the next packet is routed on the new table
+    def install_forwarding_table(self, version, table):
+        index, next_port, next_hops, blocked = table
+        stale = self.changed_routes(index, next_port, next_hops)
+        self.dpid_index, self.next_port = index, next_port
+        self.flood_blocked = blocked
+        self.table_version = version
+        self.next_hops = next_hops
+        self.update_groups(next_hops)
+        self.flush_routes(stale)
 
+    # (src, dst) pairs routed on the old table whose action (output port,
+    # or group) is not the same on the new one
+    def changed_routes(self, index, next_port, next_hops):
+        nodes = sorted(self.dpid_index, key=self.dpid_index.get)
+        if not nodes:
+            return []
+        old = self.next_port.copy()
+        for src, dst in self.groups:
+            if src in self.dpid_index and dst in self.dpid_index:
+                old[self.dpid_index[src], self.dpid_index[dst]] = -2
+        rows = np.array([index.get(dpid, -1) for dpid in nodes])
+        known = rows >= 0
+        new = np.where(known[:, None] & known[None, :],
+                       next_port[np.ix_(np.maximum(rows, 0), np.maximum(rows, 0))], -1)
+        for src, dst in next_hops:
+            if src in self.dpid_index and dst in self.dpid_index:
+                new[self.dpid_index[src], self.dpid_index[dst]] = -2
+        return [(nodes[i], nodes[j]) for i, j in zip(*np.nonzero((old != -1) & (old != new)))]
 
+    def flush_routes(self, stale):
+        macs = {}
+        for mac, (dpid, _) in self.hosts.items():
+            macs.setdefault(dpid, []).append(mac)
+        for src, dst in stale:
+            dp = self.datapaths.get(src)
+            if dp is None:
+                continue
+            for mac in macs.get(dst, ()):
+                self.flow_rem(dp, dp.ofproto_parser.OFPMatch(eth_dst=mac))
 
+    # Install/modify/delete groups so they match next_hops
+    def update_groups(self, next_hops):
+        for key in list(self.groups):
+            if key not in next_hops:
+                dp = self.datapaths.get(key[0])
+                if dp is not None:
+                    self.group_mod(dp, dp.ofproto.OFPGC_DELETE, key[1], self.groups[key][0], ())
+                del self.groups[key]
+        for key, (gtype, buckets) in next_hops.items():
+            if self.groups.get(key) == (gtype, buckets):
+                continue
+            dp = self.datapaths.get(key[0])
+            if dp is None:
+                continue
+            command = dp.ofproto.OFPGC_MODIFY if key in self.groups else dp.ofproto.OFPGC_ADD
+            self.group_mod(dp, command, key[1], gtype, buckets)
+            self.groups[key] = (gtype, buckets)
 
+    def group_mod(self, dp, command, group_id, gtype, buckets):
+        ofp        = dp.ofproto
+        ofp_parser = dp.ofproto_parser
+        # every bucket watches its own port: dead links are skipped by the OFS
+        bucket_list = [ofp_parser.OFPBucket(weight=weight, watch_port=port,
+                                            watch_group=ofp.OFPG_ANY,
+                                            actions=[ofp_parser.OFPActionOutput(port)])
+                       for port, weight in buckets]
+        if gtype == 'ff':
+            type_ = ofp.OFPGT_FF
+        else:
+            type_ = ofp.OFPGT_SELECT
+        mod = ofp_parser.OFPGroupMod(dp, command, type_, group_id, bucket_list)
+        self.metrics.log('group_mod', logging.DEBUG, type=gtype, dpid=dp.id, group=group_id,
+                         buckets=','.join('{}:{}'.format(port, weight) for port, weight in buckets))
+        self.batcher.send(dp, mod)
+
+    #######################################
+    # Link cost monitor
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def state_change_handler(self, ev):
+        dp = ev.datapath
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths[dp.id] = dp
+            self.update_groups(self.next_hops)
+        elif ev.state == DEAD_DISPATCHER:
+            self.datapaths.pop(dp.id, None)
+            # its groups are gone with it (an OVS restart starts empty)
+            for key in [key for key in self.groups if key[0] == dp.id]:
+                del self.groups[key]
+
+    def monitor(self):
+        while True:
+            for dp in list(self.datapaths.values()):
+                ofp_parser = dp.ofproto_parser
+                dp.send_msg(ofp_parser.OFPPortStatsRequest(dp, 0, dp.ofproto.OFPP_ANY))
+            self.expire_remote_links()
+            hub.sleep(self.poll_interval)
 
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def port_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        now = time.time()
+        for stat in ev.msg.body:
+            key = (dpid, stat.port_no)
+            if key in self.port_stats:
+                t, tx_bytes, tx_packets, rx_packets = self.port_stats[key]
+                if now > t:
+                    self.port_rates[key] = ((stat.tx_bytes - tx_bytes) * 8 / (now - t),
+                                            stat.tx_packets - tx_packets,
+                                            stat.rx_packets - rx_packets)
+            self.port_stats[key] = (now, stat.tx_bytes, stat.tx_packets, stat.rx_packets)
+        self.update_link_weights(dpid)
+
+    def update_link_weights(self, dpid):
+        if dpid not in self.G:
+            return
+        changed = False
+        for u, v, attr in self.G.out_edges(dpid, data=True):
+            if (u, attr['port']) not in self.port_rates or not self.G.has_edge(v, u):
+                continue
+            tx_rate, tx_packets, _ = self.port_rates[(u, attr['port'])]
+            rx_packets = self.port_rates.get((v, self.G[v][u]['port']), (0, 0, tx_packets))[2]
+            util = min(tx_rate / self.link_capacity, 1.0)
+            loss = 0.0
+            if tx_packets > 0:
+                loss = min(max(1.0 - float(rx_packets) / tx_packets, 0.0), 1.0)
+            weight = 1.0 + self.util_cost * util + self.loss_cost * loss
+            if abs(weight - attr['weight']) > self.hysteresis * attr['weight']:
+                self.metrics.log('link_weight', src=u, dst=v, util='{:.2f}'.format(util),
+                                 loss='{:.2f}'.format(loss), old='{:.2f}'.format(attr['weight']),
+                                 new='{:.2f}'.format(weight))
+                attr['weight'] = weight
+                self.publish_link(u, v)
+                changed = True
+        if changed:
+            self.schedule_table_update()
+
+    #######################################
+    # Sharding
+    def publish_link(self, src, dst):
+        if self.shards is None:
+            return
+        value = None
+        if self.G.has_edge(src, dst):
+            value = [self.G[src][dst]['port'], self.G[src][dst]['weight']]
+        self.shards.put('links', sharding.key(src, dst), value)
+
+    def shard_link(self, key, value, old):
+        src, dst = [int(x) for x in key.split(':')]
+        if value is None:
+            self.link_delete(src, dst)
+            return
+        port, weight = value
+        self.link_add(src, dst, port)
+        if self.G[src][dst]['weight'] != weight:
+            self.G[src][dst]['weight'] = weight
+            self.schedule_table_update()
+
+    def shard_host(self, mac, value, old):
+        if value is None:
+            self.hosts.pop(mac, None)
+        else:
+            self.hosts[mac] = tuple(value)
+
+    # LLDP from an OFS of another shard: a link neither topology API sees
+    def shard_lldp(self, dpid, port, data):
+        try:
+            src, src_port = LLDPPacket.lldp_parse(data)
+        except LLDPPacket.LLDPUnknownFormat:
+            return
+        if self.shards.owns(src):
+            return
+        self.switch_ports.add((dpid, port))
+        self.remote_links[(src, dpid)] = time.time()
+        if not self.G.has_edge(src, dpid):
+            self.link_add(src, dpid, src_port)
+            self.publish_link(src, dpid)
+
+    def expire_remote_links(self):
+        now = time.time()
+        for (src, dst), seen in list(self.remote_links.items()):
+            if now - seen > self.remote_link_timeout:
+                del self.remote_links[(src, dst)]
+                self.link_delete(src, dst)
+                self.publish_link(src, dst)
 
     ##############################################################
     # Add action for "missing flow"
@@ -111,19 +501,28 @@ class NetworkX(app_manager.RyuApp):
         ofp        = dp.ofproto
         ofp_parser = dp.ofproto_parser
 
+        # Table-miss Packet-Ins go through the meter first
         actions      = [ofp_parser.OFPActionOutput(ofp.OFPP_CONTROLLER, ofp.OFPCML_NO_BUFFER)]
-        instructions = [ofp_parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
+        instructions = [self.admission.install_meter(dp),
+                        ofp_parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
         self.flow_add(dp, 0, 0, None, instructions)
 
+        # Restored state: see what the OFS kept
+        if self.restored:
+            self.revalidating.add(dp.id)
+            dp.send_msg(ofp_parser.OFPFlowStatsRequest(dp, 0, ofp.OFPTT_ALL, ofp.OFPP_ANY,
+                                                       ofp.OFPG_ANY, 0, 0, ofp_parser.OFPMatch()))
+
 
     ##############################################################
     # Flow add/remove functions
     def flow_add(self, dp, idle_timeout, priority, match, instructions):
         ofp        = dp.ofproto
         ofp_parser = dp.ofproto_parser
+        # SEND_FLOW_REM: idle timeouts are reported, for the occupancy count
         mod        = ofp_parser.OFPFlowMod(datapath=dp, command=ofp.OFPFC_ADD, 
                                             idle_timeout=idle_timeout, priority=priority, 
-                                            
+                                            flags=ofp.OFPFF_SEND_FLOW_REM if idle_timeout else 0,
                                             match=match, instructions=instructions)
         if priority==0:
             in_port = "Any"
@@ -132,14 +531,174 @@ class NetworkX(app_manager.RyuApp):
             in_port = match["in_port"]
             eth_dst = match["eth_dst"]
         #
-        print("      + FlowMod (ADD) of Datapath ID={}, Match: (Dst. MAC={}, PortIn={}), Action: (PortOut={})".format(
-            dp.id, eth_dst, in_port, instructions[0].actions[0].port))
+        action = instructions[-1].actions[0]
+        if isinstance(action, ofp_parser.OFPActionGroup):
+            out = "Group={}".format(action.group_id)
+        else:
+            out = "PortOut={}".format(action.port)
+        self.metrics.log('flow_add', logging.DEBUG, dpid=dp.id, eth_dst=eth_dst, in_port=in_port, action=out)
 
-        dp.send_msg(mod)
+        self.metrics.flow_mod(dp, mod)
+        self.batcher.send(dp, mod)
+        if idle_timeout:
+            self.lifecycle.added(dp, mod)
 
     def flow_rem(self, dp, match):
         ofp        = dp.ofproto
         ofp_parser = dp.ofproto_parser
         mod        = ofp_parser.OFPFlowMod(datapath=dp, command=ofp.OFPFC_DELETE, out_port=ofp.OFPP_ANY, out_group=ofp.OFPP_ANY, match=match)
-        print("      + FlowMod (REMOVE) of Datapath ID={}, Match: (Dst. MAC={})".format(dp.id, match["eth_dst"]))
-        dp.send_msg(mod)
\ No newline at end of file
+        self.metrics.log('flow_delete', dpid=dp.id, eth_dst=match["eth_dst"])
+        self.metrics.flow_mod(dp, mod)
+        self.batcher.send(dp, mod)
+
+    # idle/hard timeouts of flows added with OFPFF_SEND_FLOW_REM
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        self.metrics.flow_removed(ev.msg)
+        self.lifecycle.flow_removed(ev.msg)
+
+    # usage of the flows, polled by the lifecycle when a table fills up
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_reply_handler(self, ev):
+        if ev.msg.datapath.id in self.revalidating:
+            self.revalidate(ev.msg)
+        self.lifecycle.stats_reply(ev.msg)
+
+    ##############################################################
+    # Warm restart
+    def changed(self):
+        if self.checkpoint is not None:
+            self.checkpoint.mark()
+
+    def checkpoint_state(self):
+        return {'hosts': self.hosts,
+                'links': [[u, v, attr['port'], attr['weight']] for u, v, attr in self.G.edges(data=True)]}
+
+    def restore(self, state):
+        if state is None:
+            return
+        self.hosts = dict((mac, tuple(loc)) for mac, loc in state['hosts'].items())
+        for u, v, port, weight in state['links']:
+            self.G.add_edge(u, v, port=port, weight=weight)
+            self.switch_ports.add((u, port))
+            self.restored_links.add((u, v))
+        self.restored = True
+        self.schedule_table_update()
+        hub.spawn_after(self.restore_grace, self.drop_restored_links)
+        self.metrics.log('restored', hosts=len(self.hosts), links=len(self.restored_links),
+                         age='{:.1f}'.format(self.checkpoint.restored_age))
+
+    # links LLDP did not find again are gone
+    def drop_restored_links(self):
+        if self.restored_links:
+            self.metrics.log('restored_links_dropped', links=len(self.restored_links))
+        for u, v in list(self.restored_links):
+            self.link_delete(u, v)
+        self.restored_links = set()
+
+    # Flows an OFS kept across the restart are counted for occupancy and
+    # eviction; a restored host whose own edge OFS sends its traffic to
+    # another port is forgotten, with those flows
+    def revalidate(self, msg):
+        dp         = msg.datapath
+        ofp        = dp.ofproto
+        ofp_parser = dp.ofproto_parser
+        if not (msg.flags or 0) & ofp.OFPMPF_REPLY_MORE:
+            self.revalidating.discard(dp.id)
+        stale = set()
+        for stat in msg.body:
+            if stat.priority == 0 or 'eth_dst' not in stat.match:
+                continue
+            self.metrics.flow_found(dp, stat)
+            if stat.idle_timeout:
+                self.lifecycle.added(dp, stat)
+            dmac = stat.match['eth_dst']
+            ports = [action.port for inst in stat.instructions for action in getattr(inst, 'actions', [])
+                     if isinstance(action, ofp_parser.OFPActionOutput)]
+            location = self.hosts.get(dmac)
+            if location is not None and location[0] == dp.id and ports and ports[0] != location[1]:
+                stale.add(dmac)
+        for dmac in stale:
+            self.metrics.log('restored_host_stale', dpid=dp.id, mac=dmac)
+            self.hosts.pop(dmac, None)
+            self.flow_rem(dp, dp.ofproto_parser.OFPMatch(eth_dst=dmac))
+
+
+##############################################################
+# Route computation, run in the route_jobs pool on a copy of G
+def build_forwarding_table(G, multipath=True, protection=True):
+    ''' Returns (index, next_port, next_hops, blocked): index[dpid] =
+    row/column of dpid in next_port, next_port[index[src], index[dst]] =
+    output port on src towards dst (-1 = no route), next_hops[(src, dst)] =
+    (group type, ((port, bucket weight), ...)) where src needs a SELECT/FF
+    group and blocked[dpid] = ports of dpid off the flooding spanning tree. '''
+    nodes = sorted(G.nodes())
+    index = dict((dpid, i) for i, dpid in enumerate(nodes))
+    next_port = np.full((len(nodes), len(nodes)), -1, dtype=np.int32)
+    next_hops = {}
+    dists = {}
+
+    # Dijkstra towards every destination over the reversed graph: the
+    # predecessor v of u in the reversed graph is u's next hop to dst
+    R = G.reverse(copy=False)
+    for dst in nodes:
+        j = index[dst]
+        pred, dist = nx.dijkstra_predecessor_and_distance(R, dst, weight='weight')
+        dists[dst] = dist
+        for u, vs in pred.items():
+            if vs:
+                next_port[index[u], j] = G[u][vs[0]]['port']
+            if len(vs) > 1 and multipath:
+                # all predecessors have the same distance: equal-cost next hops
+                next_hops[(u, dst)] = ('select', tuple(sorted(
+                    (G[u][v]['port'], max(1, int(round(100 / G[u][v]['weight']))))
+                    for v in vs)))
+
+    if protection:
+        for dst in nodes:
+            for u in nodes:
+                if u == dst or (u, dst) in next_hops:
+                    continue
+                primary = int(next_port[index[u], index[dst]])
+                backup = find_backup(G, u, dst, dists, primary)
+                if backup is not None:
+                    next_hops[(u, dst)] = ('ff', ((primary, 0), (backup, 0)))
+
+    return index, next_port, next_hops, flood_tree(G)
+
+# Ports off a BFS spanning tree rooted at the lowest dpid of each
+# component: blocked[dpid] = ports of dpid not to flood on
+def flood_tree(G):
+    U = G.to_undirected(as_view=True)
+    tree = set()
+    for component in nx.connected_components(U):
+        for u, v in nx.bfs_edges(U, min(component)):
+            tree.add((u, v))
+            tree.add((v, u))
+    blocked = {}
+    for u, v, port in G.edges(data='port'):
+        if (u, v) not in tree:
+            blocked.setdefault(u, set()).add(port)
+    return blocked
+
+# Backup port of u towards dst, other than primary: the cheapest
+# loop-free alternate, a neighbour v with
+#   dist(v, dst) < dist(v, u) + dist(u, dst)
+# so v's own route to dst never comes back through u (dist(v, u) is at
+# most the v->u link weight). None when u has no such neighbour: a backup
+# that could send the packet back to u would only loop it.
+def find_backup(G, u, dst, dists, primary):
+    dist = dists[dst]
+    if u not in dist or primary < 0:
+        return None
+    best = None
+    for v in G.successors(u):
+        if G[u][v]['port'] == primary or v not in dist:
+            continue
+        cost = G[u][v]['weight'] + dist[v]
+        if dist[v] < dists[u].get(v, float('inf')) + dist[u]:
+            if best is None or cost < best[0]:
+                best = (cost, v)
+    if best is None:
+        return None
+    return G[u][best[1]]['port']
@@ -0,0 +1,90 @@
+# Warm restarts: with RYU_CHECKPOINT=<file> the app writes its learned
+# state (hosts, ARP, topology, paths) to a msgpack snapshot and reloads it
+# when ryu-manager starts again, instead of relearning everything through
+# floods and Packet-Ins:
+#
+#   RYU_CHECKPOINT=/var/tmp/ryu.ckpt ryu-manager --observe-links switch_ofp1_3.py
+#
+# Sharded controllers (see sharding.py) get one file per shard.
+import os
+import time
+
+import msgpack
+from ryu.lib import hub
+
+
+def from_env():
+    ''' Checkpoint at RYU_CHECKPOINT, or None when it is not set '''
+    path = os.environ.get('RYU_CHECKPOINT')
+    if not path:
+        return None
+    if int(os.environ.get('RYU_SHARDS', '1')) > 1:
+        path += '.{}'.format(os.environ.get('RYU_SHARD', '0'))
+    return Checkpoint(path)
+
+
+class Checkpoint(object):
+    ''' Periodic snapshots of the app's state.
+
+    The app marks the state dirty when it learns something; run() calls
+    snapshot() at most every interval seconds while it is dirty and writes
+    the result (plain dicts/lists/numbers/strings) to a temporary file that
+    replaces the old snapshot in one rename, so a crash never leaves half a
+    file. load() returns the state of the last snapshot, or None when there
+    is none, it is unreadable, of another format version or older than
+    max_age seconds. The app revalidates what it restores: the snapshot
+    may be up to interval seconds behind, and the network may have changed
+    while the controller was down. '''
+
+    VERSION = 1
+
+    def __init__(self, path, interval=5, max_age=3600):
+        self.path = path
+        self.interval = interval
+        self.max_age = max_age
+        self.dirty = False
+        # metrics
+        self.saves = 0
+        self.size = 0
+        self.save_time = 0.0
+        self.restored_age = -1
+
+    def mark(self):
+        self.dirty = True
+
+    def save(self, state):
+        started = time.time()
+        data = msgpack.packb({'version': self.VERSION, 'time': started, 'state': state},
+                             use_bin_type=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+        self.saves += 1
+        self.size = len(data)
+        self.save_time = time.time() - started
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                snapshot = msgpack.unpackb(f.read(), raw=False, strict_map_key=False)
+        except (IOError, OSError, ValueError, msgpack.UnpackException):
+            return None
+        if not isinstance(snapshot, dict) or snapshot.get('version') != self.VERSION:
+            return None
+        age = time.time() - snapshot.get('time', 0)
+        if age > self.max_age:
+            return None
+        self.restored_age = age
+        return snapshot['state']
+
+    def run(self, snapshot):
+        while True:
+            hub.sleep(self.interval)
+            if self.dirty:
+                self.dirty = False
+                self.save(snapshot())
+
+    def report(self):
+        return {'saves': self.saves, 'bytes': self.size, 'save_time': self.save_time,
+                'restored_age': self.restored_age}
@@ -0,0 +1,145 @@
+import math
+import time
+from collections import OrderedDict
+from ryu.lib import hub
+
+
+class FlowLifecycle(object):
+    ''' Idle timeouts and table capacity for the per-destination flows.
+
+    Timeouts: every forwarding flow is added with OFPFF_SEND_FLOW_REM, and
+    the inter-arrival time of packets towards each destination MAC is
+    learned (EWMA) from
+      - idle-timeout OFPFlowRemoved stats: (duration - idle_timeout) spread
+        over packet_count - 1 gaps
+      - re-misses: a Packet-In for a destination whose flow timed out on the
+        same OFS less than max_timeout ago means the gap was longer than the
+        timeout, and the flow was removed too early
+    and the next flow for it gets factor * that gap, between min_timeout and
+    max_timeout (default_timeout before anything is learned). Once a table
+    is past low_water of its capacity, new timeouts are halved.
+
+    Capacity: the occupancy counted by Metrics is checked on every add; past
+    high_water * capacity the least recently used flows are deleted (strict)
+    until it is back to low_water. Usage comes from the adds themselves and
+    from flow stats, which are only polled for tables past half of
+    low_water. '''
+
+    def __init__(self, metrics, send, capacity=2000, min_timeout=2, max_timeout=60,
+                 default_timeout=10, factor=2.0, alpha=0.3, low_water=0.8, high_water=0.95,
+                 poll_interval=5):
+        self.metrics = metrics
+        self.send = send                 # send(dp, msg), e.g. the batcher's
+        self.capacity = capacity
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.default_timeout = default_timeout
+        self.factor = factor
+        self.alpha = alpha
+        self.low_water = low_water
+        self.high_water = high_water
+        self.poll_interval = poll_interval
+        self.gaps = {}         # MAC -> EWMA of the packet inter-arrival time (s)
+        self.removed = {}      # (dpid, MAC) -> (time, idle_timeout) of the last idle timeout
+        # lru[dpid] = OrderedDict {flow key: [match, priority, table_id, packets]}, oldest first
+        self.lru = {}
+        self.datapaths = {}
+        self.evicted = 0
+        self.re_misses = 0
+
+    def timeout(self, dpid, dmac):
+        ''' idle_timeout for a new flow towards dmac on dpid '''
+        gap = self.gaps.get(dmac)
+        if gap is None:
+            timeout = self.default_timeout
+        else:
+            timeout = int(math.ceil(self.factor * gap))
+        if self.metrics.occupancy(dpid) >= self.low_water * self.capacity:
+            timeout //= 2
+        return max(self.min_timeout, min(self.max_timeout, timeout))
+
+    def learn(self, dmac, gap):
+        if dmac in self.gaps:
+            self.gaps[dmac] += self.alpha * (gap - self.gaps[dmac])
+        else:
+            self.gaps[dmac] = gap
+
+    def packet_in(self, dpid, dmac):
+        removed = self.removed.pop((dpid, dmac), None)
+        if removed is None:
+            return
+        at, idle_timeout = removed
+        gap = time.time() - at + idle_timeout
+        if gap < self.max_timeout:
+            self.re_misses += 1
+            self.learn(dmac, gap)
+
+    def flow_removed(self, msg):
+        dp = msg.datapath
+        ofp = dp.ofproto
+        dmac = msg.match.get('eth_dst')
+        key = self.metrics.flow_key(msg.table_id, msg.priority, msg.match)
+        self.lru.get(dp.id, {}).pop(key, None)
+        if dmac is None or msg.reason != ofp.OFPRR_IDLE_TIMEOUT:
+            return
+        self.removed[(dp.id, dmac)] = (time.time(), msg.idle_timeout)
+        if msg.packet_count > 1:
+            active = msg.duration_sec + msg.duration_nsec / 1e9 - msg.idle_timeout
+            self.learn(dmac, max(active, 0.0) / (msg.packet_count - 1))
+
+    def added(self, dp, mod):
+        ''' record a forwarding flow the app has just sent, evicting if the
+        table is full '''
+        self.datapaths[dp.id] = dp
+        lru = self.lru.setdefault(dp.id, OrderedDict())
+        key = self.metrics.flow_key(mod.table_id, mod.priority, mod.match)
+        lru[key] = [mod.match, mod.priority, mod.table_id, 0]
+        lru.move_to_end(key)
+        if self.metrics.occupancy(dp.id) > self.high_water * self.capacity:
+            self.evict(dp, int(self.metrics.occupancy(dp.id) - self.low_water * self.capacity))
+
+    def evict(self, dp, count):
+        ofp = dp.ofproto
+        ofp_parser = dp.ofproto_parser
+        lru = self.lru.get(dp.id, {})
+        installed = self.metrics.flows.get(dp.id, {})
+        while count > 0 and lru:
+            key, (match, priority, table_id, _) = lru.popitem(last=False)
+            if key not in installed:
+                continue    # already deleted or timed out
+            mod = ofp_parser.OFPFlowMod(datapath=dp, table_id=table_id, command=ofp.OFPFC_DELETE_STRICT,
+                                        priority=priority, out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY,
+                                        match=match)
+            self.metrics.flow_mod(dp, mod)
+            self.send(dp, mod)
+            self.evicted += 1
+            count -= 1
+        self.metrics.log('evict', dpid=dp.id, occupancy=self.metrics.occupancy(dp.id), capacity=self.capacity)
+
+    def monitor(self):
+        while True:
+            for dpid, dp in list(self.datapaths.items()):
+                if self.metrics.occupancy(dpid) >= self.low_water * self.capacity / 2:
+                    ofp = dp.ofproto
+                    ofp_parser = dp.ofproto_parser
+                    dp.send_msg(ofp_parser.OFPFlowStatsRequest(dp, 0, ofp.OFPTT_ALL, ofp.OFPP_ANY,
+                                                               ofp.OFPG_ANY, 0, 0, ofp_parser.OFPMatch()))
+            hub.sleep(self.poll_interval)
+
+    def stats_reply(self, msg):
+        ''' flows whose packet count went up since the last poll were used '''
+        lru = self.lru.get(msg.datapath.id)
+        if not lru:
+            return
+        for stat in msg.body:
+            key = self.metrics.flow_key(stat.table_id, stat.priority, stat.match)
+            entry = lru.get(key)
+            if entry is not None and stat.packet_count > entry[3]:
+                entry[3] = stat.packet_count
+                lru.move_to_end(key)
+
+    def report(self):
+        timeouts = [self.timeout(0, mac) for mac in self.gaps]
+        mean = float(sum(timeouts)) / len(timeouts) if timeouts else self.default_timeout
+        return {'evicted': self.evicted, 're_misses': self.re_misses,
+                'learned_destinations': len(self.gaps), 'idle_timeout_mean': mean}
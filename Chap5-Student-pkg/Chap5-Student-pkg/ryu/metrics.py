@@ -0,0 +1,232 @@
+import logging
+import os
+import socket
+import time
+from ryu.lib import hub
+from admission import TokenBucket
+
+
+def port_from_env(default=9108):
+    ''' /metrics port: RYU_METRICS_PORT (0 = no endpoint), or default plus
+    RYU_SHARD when sharded (see sharding.py), so the shards on one host
+    don't collide '''
+    port = os.environ.get('RYU_METRICS_PORT')
+    if port:
+        return int(port)
+    if int(os.environ.get('RYU_SHARDS', '1')) > 1:
+        return default + int(os.environ.get('RYU_SHARD', '0'))
+    return default
+
+
+class LatencyHistogram(object):
+    ''' HDR-style histogram of latencies in microseconds: exact below
+    2**sub_bits, above that 2**(sub_bits-1) linear sub-buckets per power of
+    two, so every value is kept within 2**(1-sub_bits) relative error
+    (1.6% for sub_bits=7) at any magnitude, in a few hundred counters. '''
+
+    def __init__(self, sub_bits=7):
+        self.sub_bits = sub_bits
+        self.sub_count = 1 << sub_bits
+        self.half = self.sub_count >> 1
+        self.counts = {}      # bucket index -> count
+        self.count = 0
+        self.total = 0.0      # seconds
+        self.max = 0.0
+
+    def index(self, us):
+        if us < self.sub_count:
+            return us
+        shift = us.bit_length() - self.sub_bits
+        return self.sub_count + (shift - 1) * self.half + ((us >> shift) - self.half)
+
+    def value(self, index):
+        ''' midpoint of the bucket, in microseconds '''
+        if index < self.sub_count:
+            return index
+        shift = (index - self.sub_count) // self.half + 1
+        low = ((index - self.sub_count) % self.half + self.half) << shift
+        return low + ((1 << shift) - 1) / 2.0
+
+    def record(self, seconds):
+        us = max(int(seconds * 1e6), 0)
+        i = self.index(us)
+        self.counts[i] = self.counts.get(i, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        ''' q in [0, 1]; returns seconds '''
+        if not self.count:
+            return 0.0
+        rank = max(1, int(round(q * self.count)))
+        seen = 0
+        for i in sorted(self.counts):
+            seen += self.counts[i]
+            if seen >= rank:
+                return self.value(i) / 1e6
+        return self.max
+
+
+class RateLimitedLog(object):
+    ''' key=value log lines, at most `rate` per second (up to `burst` at
+    once) per event name; lines over the limit are only counted, and the
+    count is attached as suppressed=N to the next line that gets through. '''
+
+    def __init__(self, logger, rate=5, burst=20):
+        self.logger = logger
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}      # event -> TokenBucket
+        self.suppressed = {}   # event -> lines dropped since the last one logged
+        self.suppressed_total = 0
+
+    def __call__(self, event, level=logging.INFO, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        if event not in self.buckets:
+            self.buckets[event] = TokenBucket(self.rate, self.burst)
+        if not self.buckets[event].consume(time.time()):
+            self.suppressed[event] = self.suppressed.get(event, 0) + 1
+            self.suppressed_total += 1
+            return
+        line = 'event={}'.format(event)
+        for name, value in fields.items():
+            line += ' {}={}'.format(name, value)
+        dropped = self.suppressed.pop(event, 0)
+        if dropped:
+            line += ' suppressed={}'.format(dropped)
+        self.logger.log(level, line)
+
+
+class Metrics(object):
+    ''' Controller telemetry:
+      - per-datapath counters of Packet-In, PacketOut, flood, FlowMod and
+        FlowRemoved messages
+      - Packet-In -> PacketOut latency histogram (until the PacketOut is
+        handed to the batcher)
+      - flow-table occupancy per datapath, tracked from the FlowMods the app
+        sends and the OFPFlowRemoved messages it gets back
+      - report() of other components (batcher, admission) under a prefix
+    served as Prometheus text on http://host:port/metrics by serve(). '''
+
+    COUNTERS = ('packet_in', 'packet_out', 'flood', 'flow_add', 'flow_modify',
+                'flow_delete', 'flow_removed')
+
+    def __init__(self, logger, prefix='ryu'):
+        self.prefix = prefix
+        self.log = RateLimitedLog(logger)
+        self.logger = logger
+        self.latency = LatencyHistogram()
+        self.counters = {}     # dpid -> {counter name: count}
+        # flows[dpid] = {(table_id, priority, match): (cookie, match fields)}
+        self.flows = {}
+        self.sources = {}      # prefix -> function returning a dict of numbers
+        self.server = None
+
+    def count(self, dpid, name, n=1):
+        if dpid not in self.counters:
+            self.counters[dpid] = dict((c, 0) for c in self.COUNTERS)
+        self.counters[dpid][name] += n
+
+    def packet_in(self, dp):
+        ''' count a Packet-In; returns its arrival time for packet_out() '''
+        self.count(dp.id, 'packet_in')
+        return time.time()
+
+    def packet_out(self, dp, started, flood=False):
+        self.count(dp.id, 'packet_out')
+        if flood:
+            self.count(dp.id, 'flood')
+        if started is not None:
+            self.latency.record(time.time() - started)
+
+    def flow_key(self, table_id, priority, match):
+        return (table_id, priority, str(sorted(match.items())))
+
+    def flow_mod(self, dp, mod):
+        ofp = dp.ofproto
+        flows = self.flows.setdefault(dp.id, {})
+        if mod.command == ofp.OFPFC_ADD:
+            self.count(dp.id, 'flow_add')
+            key = self.flow_key(mod.table_id, mod.priority, mod.match)
+            flows[key] = (mod.cookie, dict(mod.match.items()))
+        elif mod.command in (ofp.OFPFC_MODIFY, ofp.OFPFC_MODIFY_STRICT):
+            self.count(dp.id, 'flow_modify')
+        elif mod.command == ofp.OFPFC_DELETE_STRICT:
+            self.count(dp.id, 'flow_delete')
+            flows.pop(self.flow_key(mod.table_id, mod.priority, mod.match), None)
+        elif mod.command == ofp.OFPFC_DELETE:
+            self.count(dp.id, 'flow_delete')
+            for key, (cookie, fields) in list(flows.items()):
+                if mod.table_id != ofp.OFPTT_ALL and mod.table_id != key[0]:
+                    continue
+                if (cookie & mod.cookie_mask) != (mod.cookie & mod.cookie_mask):
+                    continue
+                if all(fields.get(f) == v for f, v in mod.match.items()):
+                    del flows[key]
+
+    def flow_found(self, dp, stat):
+        ''' a flow already on the OFS (FlowStats, e.g. after a restart) '''
+        key = self.flow_key(stat.table_id, stat.priority, stat.match)
+        self.flows.setdefault(dp.id, {})[key] = (stat.cookie, dict(stat.match.items()))
+
+    def flow_removed(self, msg):
+        dpid = msg.datapath.id
+        self.count(dpid, 'flow_removed')
+        self.flows.get(dpid, {}).pop(self.flow_key(msg.table_id, msg.priority, msg.match), None)
+
+    def occupancy(self, dpid=None):
+        if dpid is not None:
+            return len(self.flows.get(dpid, {}))
+        return sum(len(f) for f in self.flows.values())
+
+    def add_source(self, prefix, report):
+        self.sources[prefix] = report
+
+    def render(self):
+        ''' Prometheus text exposition format '''
+        p = self.prefix
+        lines = []
+        for name in self.COUNTERS:
+            lines.append('# TYPE {}_{}_total counter'.format(p, name))
+            for dpid in sorted(self.counters):
+                lines.append('{}_{}_total{{dpid="{}"}} {}'.format(p, name, dpid, self.counters[dpid][name]))
+        lines.append('# TYPE {}_flow_table_entries gauge'.format(p))
+        for dpid in sorted(self.flows):
+            lines.append('{}_flow_table_entries{{dpid="{}"}} {}'.format(p, dpid, len(self.flows[dpid])))
+        lines.append('# TYPE {}_packet_in_latency_seconds summary'.format(p))
+        for q in (0.5, 0.9, 0.99, 0.999):
+            lines.append('{}_packet_in_latency_seconds{{quantile="{}"}} {:.6f}'.format(
+                p, q, self.latency.percentile(q)))
+        lines.append('{}_packet_in_latency_seconds_sum {:.6f}'.format(p, self.latency.total))
+        lines.append('{}_packet_in_latency_seconds_count {}'.format(p, self.latency.count))
+        lines.append('# TYPE {}_log_suppressed_total counter'.format(p))
+        lines.append('{}_log_suppressed_total {}'.format(p, self.log.suppressed_total))
+        for source in sorted(self.sources):
+            for name, value in sorted(self.sources[source]().items()):
+                lines.append('{}_{}_{} {}'.format(p, source, name, value))
+        return '\n'.join(lines) + '\n'
+
+    def wsgi(self, environ, start_response):
+        if environ.get('PATH_INFO', '/') not in ('/', '/metrics'):
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'not found\n']
+        body = self.render().encode()
+        start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+    def serve(self, port, host='127.0.0.1'):
+        ''' start the /metrics endpoint (none for port 0); a port that can't
+        be bound is logged and raised, so the app doesn't run without it '''
+        if not port:
+            return None
+        try:
+            self.server = hub.WSGIServer((host, port), self.wsgi)
+        except socket.error as e:
+            self.logger.error('event=metrics_server_failed port=%s error=%s '
+                              '(set RYU_METRICS_PORT, 0 = no endpoint)', port, e)
+            raise
+        return hub.spawn(self.server.serve_forever)
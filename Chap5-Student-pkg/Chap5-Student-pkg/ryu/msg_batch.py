@@ -0,0 +1,142 @@
+import time
+from ryu.lib import hub
+
+
+class MsgBatcher(object):
+    ''' Per-datapath outbound queue for OpenFlow messages. Messages sent
+    within `window` seconds are coalesced and written to the OFS as one
+    buffer (or one ONF bundle when use_bundle is set):
+      - an ADD identical to a queued ADD drops the queued one and goes
+        to the tail, so it still follows the GroupMods/DELETEs queued
+        between the two
+      - a DELETE drops every queued ADD it would have removed anyway
+    Everything else (PacketOut, Barrier, ...) keeps its order. '''
+
+    def __init__(self, window=0.005, use_bundle=False):
+        self.window = window
+        self.use_bundle = use_bundle
+        self.queues = {}       # dpid -> list of queued messages (None = dropped)
+        self.adds = {}         # dpid -> {flow key: index in queue}
+        self.datapaths = {}    # dpid -> datapath
+        self.first_enqueue = {}
+        self.timers = {}
+        self.bundle_id = 0
+        # metrics
+        self.enqueued = 0
+        self.written = 0
+        self.deduped = 0
+        self.cancelled = 0
+        self.flushes = 0
+        self.max_depth = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def send(self, dp, msg):
+        dpid = dp.id
+        queue = self.queues.setdefault(dpid, [])
+        adds = self.adds.setdefault(dpid, {})
+        self.datapaths[dpid] = dp
+        self.enqueued += 1
+        ofp = dp.ofproto
+
+        if isinstance(msg, dp.ofproto_parser.OFPFlowMod):
+            if msg.command == ofp.OFPFC_ADD:
+                key = self.flow_key(msg)
+                if key in adds:
+                    # same match/priority: the later ADD overwrites on the OFS anyway
+                    queue[adds[key]] = None
+                    self.deduped += 1
+                adds[key] = len(queue)
+            elif msg.command == ofp.OFPFC_DELETE:
+                for key, idx in list(adds.items()):
+                    if self.deletes(msg, queue[idx], ofp):
+                        queue[idx] = None
+                        del adds[key]
+                        self.cancelled += 1
+
+        queue.append(msg)
+        depth = len(queue)
+        if depth > self.max_depth:
+            self.max_depth = depth
+        if dpid not in self.timers:
+            self.first_enqueue[dpid] = time.time()
+            self.timers[dpid] = hub.spawn_after(self.window, self.flush_timer, dpid)
+
+    def flow_key(self, mod):
+        return (mod.table_id, mod.priority, str(sorted(mod.match.items())))
+
+    def deletes(self, delete, add, ofp):
+        ''' True if the non-strict DELETE would remove the flow ADD installs '''
+        if delete.out_port != ofp.OFPP_ANY or delete.out_group != ofp.OFPG_ANY:
+            return False
+        if delete.table_id != ofp.OFPTT_ALL and delete.table_id != add.table_id:
+            return False
+        if (add.cookie & delete.cookie_mask) != (delete.cookie & delete.cookie_mask):
+            return False
+        add_fields = dict(add.match.items())
+        for field, value in delete.match.items():
+            if add_fields.get(field) != value:
+                return False
+        return True
+
+    def flush_timer(self, dpid):
+        self.timers.pop(dpid, None)
+        self.flush(dpid)
+
+    def flush(self, dpid):
+        timer = self.timers.pop(dpid, None)
+        if timer is not None:
+            hub.kill(timer)
+        msgs = [m for m in self.queues.pop(dpid, []) if m is not None]
+        self.adds.pop(dpid, None)
+        started = self.first_enqueue.pop(dpid, None)
+        dp = self.datapaths.get(dpid)
+        if not msgs or dp is None or not getattr(dp, 'is_active', True):
+            return
+
+        ofp = dp.ofproto
+        ofp_parser = dp.ofproto_parser
+        if (self.use_bundle and len(msgs) > 1 and hasattr(ofp_parser, 'ONFBundleCtrlMsg')
+                and all(isinstance(m, ofp_parser.OFPFlowMod) for m in msgs)):
+            # OF1.3 has no OFPBundleCtrlMsg; use the ONF extension instead
+            self.bundle_id += 1
+            wrapped = [ofp_parser.ONFBundleCtrlMsg(dp, self.bundle_id,
+                                                   ofp.ONF_BCT_OPEN_REQUEST, ofp.ONF_BF_ATOMIC, [])]
+            for m in msgs:
+                wrapped.append(ofp_parser.ONFBundleAddMsg(dp, self.bundle_id,
+                                                          ofp.ONF_BF_ATOMIC, m, []))
+            wrapped.append(ofp_parser.ONFBundleCtrlMsg(dp, self.bundle_id,
+                                                       ofp.ONF_BCT_COMMIT_REQUEST, ofp.ONF_BF_ATOMIC, []))
+            msgs = wrapped
+
+        buf = bytearray()
+        for m in msgs:
+            dp.set_xid(m)
+            m.serialize()
+            buf += m.buf
+        dp.send(bytes(buf))
+
+        self.written += len(msgs)
+        self.flushes += 1
+        if started is not None:
+            latency = time.time() - started
+            self.latency_sum += latency
+            if latency > self.latency_max:
+                self.latency_max = latency
+
+    def flush_all(self):
+        for dpid in list(self.queues):
+            self.flush(dpid)
+
+    def queue_depth(self, dpid=None):
+        if dpid is not None:
+            return len(self.queues.get(dpid, []))
+        return sum(len(q) for q in self.queues.values())
+
+    def report(self):
+        mean = self.latency_sum / self.flushes if self.flushes else 0.0
+        return {'enqueued': self.enqueued, 'written': self.written,
+                'deduped': self.deduped, 'cancelled': self.cancelled,
+                'flushes': self.flushes, 'queue_depth': self.queue_depth(),
+                'max_queue_depth': self.max_depth,
+                'flush_latency_mean': mean, 'flush_latency_max': self.latency_max}
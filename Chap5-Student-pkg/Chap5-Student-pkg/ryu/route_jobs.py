@@ -0,0 +1,89 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from ryu.lib import hub
+
+LOG = logging.getLogger(__name__)
+
+
+class RouteJobs(object):
+    ''' Runs route/topology computations in a concurrent.futures pool, so
+    the eventlet hub keeps handling Packet-Ins, PortStatus and echoes while
+    they run (ryu-manager leaves threads unpatched, so pool threads are real
+    OS threads; processes=True also gets them off the GIL).
+
+    request(name, snapshot, compute, install):
+      - snapshot() runs on the hub and returns the arguments of compute,
+        a copy of the state it needs (the app keeps changing the original)
+      - compute(*args) runs in the pool and must only use its arguments
+      - install(version, result) runs on the hub and swaps the new table in
+        with a single assignment; until then the old table keeps serving
+    There is at most one job per name in flight. Requests made while it
+    runs are folded into one more run, with a fresh snapshot, after it.
+    Versions only grow, so a table is never replaced by an older one. '''
+
+    def __init__(self, workers=1, processes=False, poll_interval=0.002):
+        if processes:
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.poll_interval = poll_interval
+        self.jobs = {}          # name -> {'running': bool, 'dirty': bool}
+        self.version = 0
+        self.installed = {}     # name -> version of the table in use
+        # metrics
+        self.completed = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.compute_time = 0.0
+        self.compute_max = 0.0
+
+    def request(self, name, snapshot, compute, install):
+        job = self.jobs.setdefault(name, {'running': False, 'dirty': False})
+        if job['running']:
+            self.coalesced += 1
+            job['dirty'] = True
+            return
+        job['running'] = True
+        hub.spawn(self.run, name, snapshot, compute, install)
+
+    def run(self, name, snapshot, compute, install):
+        job = self.jobs[name]
+        try:
+            while True:
+                job['dirty'] = False
+                args = snapshot()
+                self.version += 1
+                version = self.version
+                started = time.time()
+                future = self.executor.submit(compute, *args)
+                while not future.done():
+                    hub.sleep(self.poll_interval)
+                elapsed = time.time() - started
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self.failed += 1
+                    LOG.error('event=route_job_failed name=%s version=%s error=%r', name, version, e,
+                              exc_info=e)
+                else:
+                    if version > self.installed.get(name, 0):
+                        install(version, result)
+                        self.installed[name] = version
+                    self.completed += 1
+                    self.compute_time += elapsed
+                    self.compute_max = max(self.compute_max, elapsed)
+                if not job['dirty']:
+                    break
+        finally:
+            job['running'] = False
+
+    def pending(self, name):
+        job = self.jobs.get(name)
+        return job is not None and job['running']
+
+    def report(self):
+        mean = self.compute_time / self.completed if self.completed else 0.0
+        return {'submitted': self.version, 'completed': self.completed,
+                'coalesced': self.coalesced, 'failed': self.failed,
+                'compute_time_mean': mean, 'compute_time_max': self.compute_max}
@@ -0,0 +1,191 @@
+# Sharded deployment: datapaths are split by dpid over N ryu-manager
+# processes, each on its own OpenFlow port, sharing topology and host
+# locations through a Unix-socket pub/sub store:
+#
+#   RYU_SHARDS=2 RYU_SHARD=0 ryu-manager --ofp-tcp-listen-port 6653 --observe-links switch_ofp1_3.py
+#   RYU_SHARDS=2 RYU_SHARD=1 ryu-manager --ofp-tcp-listen-port 6654 --observe-links switch_ofp1_3.py
+#   sudo python customtopo.py --NumOFS 8 --controllers 2
+#
+# Switch s<dpid> connects to shard (dpid - 1) % RYU_SHARDS (customtopo.py
+# does the same); RYU_SHARD_SOCKET is the store socket
+# (default /tmp/ryu-shards.sock), served by shard 0. Each shard serves
+# /metrics on 9108 + RYU_SHARD (metrics.port_from_env()).
+import json
+import os
+import socket
+
+import eventlet
+from ryu.lib import hub
+
+
+def from_env():
+    ''' ShardStore configured from RYU_SHARDS/RYU_SHARD/RYU_SHARD_SOCKET, or
+    None when there is a single controller '''
+    shards = int(os.environ.get('RYU_SHARDS', '1'))
+    if shards <= 1:
+        return None
+    shard = int(os.environ.get('RYU_SHARD', '0'))
+    path = os.environ.get('RYU_SHARD_SOCKET', '/tmp/ryu-shards.sock')
+    store = ShardStore(shard, shards, path)
+    store.start()
+    return store
+
+
+def key(*parts):
+    ''' JSON object keys are strings: (1, 2) -> "1:2" '''
+    return ':'.join(str(p) for p in parts)
+
+
+class ShardStore(object):
+    ''' Replicated key/value tables plus shard-to-shard messages.
+
+    Every shard keeps a full replica of every table. put() updates the
+    local replica and publishes the change; changes from other shards are
+    applied to the replica and passed to the subscribe()d callback
+    callback(key, value, old) on the hub (value None = deleted). Shard 0
+    also runs the broker, which keeps the latest value of every key, sends
+    all of them to a shard when it (re)connects and relays every change
+    to all other shards. send()/on() carry requests addressed to one
+    shard. On the wire every message is one JSON object per line. '''
+
+    def __init__(self, shard, shards, path):
+        self.shard = shard
+        self.shards = shards
+        self.path = path
+        self.tables = {}        # table -> {key: value}
+        self.callbacks = {}     # table -> callback(key, value, old)
+        self.handlers = {}      # op -> handler(message)
+        self.sock = None
+        self.outbox = []        # messages sent while disconnected
+        # broker (shard 0)
+        self.server = None
+        self.clients = {}       # shard -> socket
+        self.state = {}         # (table, key) -> value
+        # metrics
+        self.published = 0
+        self.received = 0
+
+    def owner(self, dpid):
+        return (dpid - 1) % self.shards
+
+    def owns(self, dpid):
+        return self.owner(dpid) == self.shard
+
+    def start(self):
+        if self.shard == 0:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.server = hub.StreamServer((self.path,), self.serve_client)
+            hub.spawn(self.server.serve_forever)
+        hub.spawn(self.client_loop)
+
+    # client side
+    def get(self, table, k, default=None):
+        return self.tables.get(table, {}).get(k, default)
+
+    def items(self, table):
+        return list(self.tables.get(table, {}).items())
+
+    def subscribe(self, table, callback):
+        self.callbacks[table] = callback
+
+    def on(self, op, handler):
+        self.handlers[op] = handler
+
+    def put(self, table, k, value):
+        ''' value None deletes k; unchanged values are not republished '''
+        current = self.tables.setdefault(table, {})
+        if current.get(k) == value and (value is not None or k not in current):
+            return
+        if value is None:
+            current.pop(k, None)
+        else:
+            current[k] = value
+        self.published += 1
+        self.write({'table': table, 'key': k, 'value': value, 'from': self.shard})
+
+    def send(self, shard, op, **fields):
+        fields.update({'to': shard, 'op': op, 'from': self.shard})
+        self.write(fields)
+
+    def write(self, message):
+        line = (json.dumps(message) + '\n').encode()
+        if self.sock is None:
+            self.outbox.append(line)
+            return
+        try:
+            self.sock.sendall(line)
+        except socket.error:
+            self.outbox.append(line)
+
+    def client_loop(self):
+        while True:
+            try:
+                sock = eventlet.connect(self.path, family=socket.AF_UNIX)
+            except socket.error:
+                hub.sleep(0.5)
+                continue
+            sock.sendall((json.dumps({'hello': self.shard}) + '\n').encode())
+            self.sock = sock
+            outbox, self.outbox = self.outbox, []
+            for line in outbox:
+                sock.sendall(line)
+            for line in sock.makefile('r'):
+                self.receive(json.loads(line))
+            self.sock = None
+            hub.sleep(0.5)
+
+    def receive(self, message):
+        self.received += 1
+        if 'op' in message:
+            handler = self.handlers.get(message['op'])
+            if handler is not None:
+                handler(message)
+            return
+        table, k, value = message['table'], message['key'], message['value']
+        current = self.tables.setdefault(table, {})
+        old = current.get(k)
+        if value is None:
+            current.pop(k, None)
+        else:
+            current[k] = value
+        callback = self.callbacks.get(table)
+        if callback is not None and old != value:
+            callback(k, value, old)
+
+    # broker side (shard 0)
+    def serve_client(self, sock, addr):
+        shard = None
+        try:
+            for line in sock.makefile('r'):
+                message = json.loads(line)
+                if 'hello' in message:
+                    shard = message['hello']
+                    self.clients[shard] = sock
+                    for (table, k), value in list(self.state.items()):
+                        sock.sendall((json.dumps({'table': table, 'key': k, 'value': value,
+                                                  'from': -1}) + '\n').encode())
+                    continue
+                if 'to' in message:
+                    target = self.clients.get(message['to'])
+                    if target is not None:
+                        target.sendall(line.encode())
+                    continue
+                if message['value'] is None:
+                    self.state.pop((message['table'], message['key']), None)
+                else:
+                    self.state[(message['table'], message['key'])] = message['value']
+                for other, target in list(self.clients.items()):
+                    if other != shard:
+                        try:
+                            target.sendall(line.encode())
+                        except socket.error:
+                            self.clients.pop(other, None)
+        finally:
+            if self.clients.get(shard) is sock:
+                del self.clients[shard]
+
+    def report(self):
+        return {'shard': self.shard, 'shards': self.shards, 'published': self.published,
+                'received': self.received, 'connected': int(self.sock is not None),
+                'keys': sum(len(t) for t in self.tables.values())}
@@ -2,23 +2,49 @@
 import random as rnd
 import matplotlib.pyplot as plt
 import networkx as nx
+import numpy as np
 import csv
+import heapq
+import math
+import sys
+import time
+import diststore
 
-def merge_disconnected_components(G):
+def merge_disconnected_components(G, r = rnd):
     ''' If G has separated connected components, they must be merged to avoid
-    gaining an incorrect result from shortest path computations. '''
+    gaining an incorrect result from shortest path computations. r is the
+    random source of the links, the random module by default. '''
     ccs = list(nx.connected_components(G))
     for i in range(len(ccs)):       # visit each connected component
         if i is 0: continue
-        cc1 = list(ccs[i - 1])
-        cc2 = list(ccs[i])
-        rnd.shuffle(cc1)            # shuffle nodes in the current component
-        rnd.shuffle(cc2)            # shuffle nodes in the previous component
+        cc1 = sorted(ccs[i - 1])    # sorted: the set order follows the edge order
+        cc2 = sorted(ccs[i])
+        r.shuffle(cc1)              # shuffle nodes in the current component
+        r.shuffle(cc2)              # shuffle nodes in the previous component
         G.add_edge(cc1[-1], cc2[0]) # add an edge to connect two.
         print("   DEBUG: merging two isolated connected components...")
     assert nx.number_connected_components(G) is 1, "<FATAL> merge_disconnected_components()"
     return G
 
+def random_geometric_graph(N, D, seed = None):
+    ''' nx.random_geometric_graph(N, D) with its components merged by
+    merge_disconnected_components(). The positions are drawn the way
+    networkx draws them and linked by the same test (distance <= D), so the
+    same random state gives the same graph, but the links come from a sweep
+    over the nodes sorted by x instead of all pairs, which stays fast for
+    10^4+ nodes without scipy. seed None uses the random module's state. '''
+    r = rnd if seed is None else rnd.Random(seed)
+    pos = np.array([[r.random() for i in range(2)] for v in range(N)]).reshape(N, 2)
+    G = nx.empty_graph(N)
+    nx.set_node_attributes(G, {v: pos[v].tolist() for v in range(N)}, 'pos')
+    order = np.argsort(pos[:, 0], kind = 'stable')
+    p = pos[order]
+    for s in range(1, N):
+        if (p[s:, 0] - p[:-s, 0]).min() > D: break
+        close = np.flatnonzero(((p[s:] - p[:-s]) ** 2).sum(axis = 1) <= D ** 2)
+        G.add_edges_from(zip(order[close].tolist(), order[close + s].tolist()))
+    return merge_disconnected_components(G, r)
+
 def generate_graph(N, M, D):
     ''' G is generated of a collection of nodes of N in x-pos in [0, 1.0)
     and y-pos [0, 1.0) in which N is a total number of nodes, M is a
@@ -29,7 +55,7 @@ def generate_graph(N, M, D):
     where the value should be either of 'd' for a data holder, 'd-ctr' for
     a data hoder center, 's' for a server, 's-ctr' for a server center, and
     for a server ceter, and 'r-ctr' for a reduced graph for data servers. '''
-    G = merge_disconnected_components(nx.random_geometric_graph(N, D))
+    G = random_geometric_graph(N, D)
     wrks = {}  # node work status
     for i in range(N):
         wrks[i] = 's' if i < M else 'd'
@@ -37,10 +63,13 @@ def generate_graph(N, M, D):
     # for i in range(G.order()): print(G.nodes[i])
     return G
 
-def find_center_node(G):
+def find_center_node(G, approx = False, k = 16):
     ''' Given undirected graph G, apply Floyd Warshall for all nodes to find a
-    center node which has the smallest maximum distance. '''
+    center node which has the smallest maximum distance. approx = True uses
+    k landmark BFS runs instead (see approx_center_node()) for graphs far too
+    big for all pairs. '''
     assert nx.number_connected_components(G) is 1, "<FATAL> find_center_node()"
+    if approx: return approx_center_node(G, k)
     paths = nx.floyd_warshall(G)
     matrx = {src:dict(tgt) for src, tgt in paths.items()}
     # print("   DEBUG:", matrx)
@@ -54,6 +83,56 @@ def find_center_node(G):
     # print("   DEBUG: center(node, max-distance) = :", center)
     return center
 
+def approx_center_node(G, k = 16, refine = None, tol = 0):
+    ''' Approximate center of connected, unweighted G in O(k (N + E)): at
+    most k landmark BFS runs plus at most refine (default k) more. A BFS
+    from L bounds every node v by
+        max(d(v, L), ecc(L) - d(v, L)) <= ecc(v) <= d(v, L) + ecc(L).
+    Landmarks are a double sweep, then farthest-point picks (the node
+    furthest from all landmarks so far). Refinement first BFSes the node
+    with the smallest upper bound if it hasn't been yet (it can't be worse
+    than the center found), and stops once that bound is within tol of the
+    smallest lower bound, i.e. of the radius. Otherwise only candidates whose
+    lower bound is below the best eccentricity found can still beat it; they
+    are BFSed smallest lower bound first, each one tightening the bounds
+    of the rest. Returns [center, eccentricity, bound]: the eccentricity
+    is exact and at most bound above the true radius (0 = exact center). '''
+    if refine is None: refine = k
+    nodes = list(G)
+    big = np.iinfo(np.int64).max
+    lower = np.zeros(len(nodes), dtype = np.int64)
+    upper = np.full(len(nodes), big, dtype = np.int64)
+    nearest = np.full(len(nodes), big, dtype = np.int64)   # to the closest landmark
+    done = np.zeros(len(nodes), dtype = bool)
+    center = [-1, -1]
+
+    def bfs(i):
+        dist = nx.single_source_shortest_path_length(G, nodes[i])
+        d = np.fromiter((dist[n] for n in nodes), dtype = np.int64, count = len(nodes))
+        ecc = int(d.max())
+        np.maximum(lower, np.maximum(d, ecc - d), out = lower)
+        np.minimum(upper, d + ecc, out = upper)
+        np.minimum(nearest, d, out = nearest)
+        done[i] = True
+        if center[1] < 0 or ecc < center[1]: center[:] = [nodes[i], ecc]
+        return d
+
+    bfs(int(np.argmax(bfs(0))))          # double sweep
+    while done.sum() < min(k, len(nodes)):
+        bfs(int(np.argmax(nearest)))
+    for _ in range(refine):
+        i = int(np.argmin(upper))
+        if not done[i]:
+            bfs(i)
+            continue
+        if upper[i] - lower.min() <= tol: break
+        candidates = np.flatnonzero(~done & (lower < center[1]))
+        if len(candidates) == 0: break
+        bfs(int(candidates[np.argmin(lower[candidates])]))
+    # print("   DEBUG: approx center, BFS runs =", done.sum(), "candidates left =",
+    #       np.count_nonzero(~done & (lower < center[1])))
+    return center + [center[1] - int(lower.min())]
+
 def set_node_colors(G):
     ''' Among the ncount of nodes, hcount hosts are colored red, center is
     colored gold and others are colored white, and returns the color list. '''
@@ -69,16 +148,163 @@ def set_node_colors(G):
     # print("Length =", len(colors), colors)
     return colors
 
-def reduce_graph(G, M, N, draw = True):
-    ''' G will be reduced to M-node,data server only, graph '''
+def steiner_tree(G, terminals, weight = 'weight'):
+    ''' Mehlhorn's 2-approximation of the minimum Steiner tree of G spanning
+    terminals, in O(E log N): a single multi-source Dijkstra from all
+    terminals gives every node its closest terminal, every edge between two
+    such regions is a candidate terminal-to-terminal path, an MST on those
+    candidates picks the paths to keep, and their union is turned back into
+    a tree and stripped of non-terminal leaves. Edges without a weight
+    attribute count 1 (hops). '''
+    terminals = set(terminals)
+    dist, base, pred = {}, {}, {}
+    heap = [(0, t, t) for t in terminals]
+    heapq.heapify(heap)
+    while heap:
+        d, u, b = heapq.heappop(heap)
+        if u in dist: continue
+        dist[u], base[u] = d, b
+        for v, attr in G[u].items():
+            if v not in dist:
+                dv = d + attr.get(weight, 1)
+                if dv < pred.get(v, (float('inf'),))[0]:
+                    pred[v] = (dv, u)
+                    heapq.heappush(heap, (dv, v, b))
+
+    # cheapest path through a region boundary, per pair of terminals
+    bridges = {}
+    for u, v, attr in G.edges(data = True):
+        if u not in dist or v not in dist or base[u] == base[v]: continue
+        key = tuple(sorted((base[u], base[v])))
+        cost = dist[u] + attr.get(weight, 1) + dist[v]
+        if key not in bridges or cost < bridges[key][0]:
+            bridges[key] = (cost, u, v)
+    H = nx.Graph()
+    H.add_nodes_from(terminals)
+    for (a, b), (cost, u, v) in bridges.items():
+        H.add_edge(a, b, weight = cost)
+
+    # expand the terminal MST back into paths of G
+    T = nx.Graph()
+    T.add_nodes_from(terminals)
+    for a, b in nx.minimum_spanning_edges(H, data = False):
+        cost, u, v = bridges[tuple(sorted((a, b)))]
+        T.add_edge(u, v, **{weight: G[u][v].get(weight, 1)})
+        for x in (u, v):
+            while x != base[x]:
+                p = pred[x][1]
+                T.add_edge(p, x, **{weight: G[p][x].get(weight, 1)})
+                x = p
+    T = nx.minimum_spanning_tree(T, weight = weight)
+    leaves = [n for n in T if T.degree[n] == 1 and n not in terminals]
+    while leaves:
+        n = leaves.pop()
+        for m in list(T[n]):
+            T.remove_edge(n, m)
+            if T.degree[m] == 1 and m not in terminals: leaves.append(m)
+        T.remove_node(n)
+    return T
+
+def tree_center(T, weight = 'weight'):
+    ''' Center of tree T: the node halfway along a longest path (two
+    Dijkstra passes instead of all pairs). Returns [node, max-distance]
+    like find_center_node(). '''
+    start = next(iter(T))
+    dist = nx.single_source_dijkstra_path_length(T, start, weight = weight)
+    a = max(dist, key = dist.get)
+    dist, paths = nx.single_source_dijkstra(T, a, weight = weight)
+    b = max(dist, key = dist.get)
+    center = [a, dist[b]]
+    for n in paths[b]:
+        md = max(dist[n], dist[b] - dist[n])
+        if md <= center[1]: center = [n, md]
+    return center
+
+def reduce_steiner(G):
+    ''' Reduction through steiner_tree() over the 's' and 'd-ctr' nodes;
+    returns (G with only the tree edges, m_node_graph) like the MST path
+    of reduce_graph() does. '''
+    terminals = [n for n, wrk in G.nodes(data = 'wrk') if wrk in ('s', 'd-ctr')]
+    T = steiner_tree(G, terminals)
+    reduced = nx.create_empty_copy(G)
+    reduced.add_edges_from(T.edges())
+    if T.number_of_edges() > 0:
+        reduced_ctr = tree_center(T)[0]
+        reduced.nodes[reduced_ctr]['wrk'] = 'r-ctr'
+
+    # M-node graph: terminals next to each other on the tree, weighted by
+    # the number of hops between them
+    red = ('s', 'd-ctr', 'r-ctr')
+    m_node_graph = nx.create_empty_copy(reduced)
+    for src in T:
+        if reduced.nodes[src]['wrk'] not in red: continue
+        seen = {src: 0}
+        queue = [src]
+        for u in queue:
+            for v in T[u]:
+                if v in seen: continue
+                seen[v] = seen[u] + 1
+                if reduced.nodes[v]['wrk'] in red:
+                    m_node_graph.add_edge(src, v, weight = seen[v])
+                else:
+                    queue.append(v)
+    m_node_graph = nx.minimum_spanning_tree(m_node_graph)
+    return reduced, m_node_graph
+
+def draw_reduced_graph(G, m_node_graph, pos):
+    ''' draw a reduced graph, then its M-node graph '''
+    plt1 = plt.figure(figsize=(15, 15))
+    colors = set_node_colors(G)
+    nx.draw_networkx_nodes(G, pos, node_size = 160,
+                           node_color = colors, edgecolors = 'gray',
+                           cmap = plt.cm.Reds_r)
+    nx.draw_networkx_edges(G, pos, alpha = 0.2)
+    labels = {}
+    for n in range(G.order()): labels[n] = str(n)
+    nx.draw_networkx_labels(G, pos, labels, font_size = 10)
+
+    plt2 = plt.figure(figsize=(15, 15))
+    colors = set_node_colors(m_node_graph)
+    nx.draw_networkx_nodes(m_node_graph, pos, node_size = 160,
+                           node_color = colors, edgecolors = 'gray',
+                           cmap = plt.cm.Reds_r)
+    labels = nx.get_edge_attributes(m_node_graph,'weight')
+    # formatted_labels = {}
+    # for label in labels:
+    #     formatted_labels[label]=  "weight: "+str(label[1])
+    nx.draw_networkx_edge_labels(m_node_graph,pos,edge_labels=labels)
+    nx.draw_networkx_edges(m_node_graph,pos)
+    labels = {}
+    for n in range(m_node_graph.order()): labels[n] = str(n)
+    nx.draw_networkx_labels(m_node_graph, pos, labels, font_size = 10)
+
+    plt.xlim(-0.05, 1.05)
+    plt.ylim(-0.05, 1.05)
+    # plt.axis('off')
+    plt.show(block = False)
+
+def reduce_graph(G, M, N, draw = True, mode = 'mst', ctr = None):
+    ''' G will be reduced to M-node,data server only, graph. mode 'mst'
+    prunes an MST of G down to the paths between the servers; 'steiner'
+    builds a Steiner tree over the servers and the center instead (see
+    steiner_tree()), which is smaller and much faster to get, and finds
+    that center with landmark BFS runs rather than all pairs. ctr is the
+    center of G when the caller already has it. '''
     pos = nx.get_node_attributes(G, 'pos')
-    ctr = find_center_node(G)[0]
+    if ctr is None: ctr = find_center_node(G, approx = (mode == 'steiner'))[0]
     G.nodes[ctr]['wrk'] = 'd-ctr'
 
+    if mode == 'steiner':
+        G, m_node_graph = reduce_steiner(G)
+        if draw: draw_reduced_graph(G, m_node_graph, pos)
+        return G
+    assert mode == 'mst', "<FATAL> reduce_graph(): unknown mode " + str(mode)
+
     # realize a logic to reduce the network based on find MST
     G = nx.minimum_spanning_tree(G)
     mst_ctr = find_center_node(G)[0]
-    G.nodes[mst_ctr]['wrk'] = 's-ctr'
+    # keep the role of a server or the center: the path walk below looks for them
+    if G.nodes[mst_ctr]['wrk'] == 'd': G.nodes[mst_ctr]['wrk'] = 's-ctr'
 
     all_nodes_list = list(G.nodes.data('wrk'))
     all_data_nodes = list() # Get all the red nodes.
@@ -182,38 +408,30 @@ def reduce_graph(G, M, N, draw = True):
 
 
     if draw:  # draw an original graph with a network center
-        plt1 = plt.figure(figsize=(15, 15))
-        colors = set_node_colors(G)
-        nx.draw_networkx_nodes(G, pos, node_size = 160,
-                               node_color = colors, edgecolors = 'gray',
-                               cmap = plt.cm.Reds_r)
-        nx.draw_networkx_edges(G, pos, alpha = 0.2)
-        labels = {}
-        for n in range(G.order()): labels[n] = str(n)
-        nx.draw_networkx_labels(G, pos, labels, font_size = 10)
-
-        plt2 = plt.figure(figsize=(15, 15))
-        colors = set_node_colors(m_node_graph)
-        nx.draw_networkx_nodes(m_node_graph, pos, node_size = 160,
-                               node_color = colors, edgecolors = 'gray',
-                               cmap = plt.cm.Reds_r)
-        labels = nx.get_edge_attributes(m_node_graph,'weight')
-        # formatted_labels = {}
-        # for label in labels:
-        #     formatted_labels[label]=  "weight: "+str(label[1])
-        nx.draw_networkx_edge_labels(m_node_graph,pos,edge_labels=labels)
-        nx.draw_networkx_edges(m_node_graph,pos)
-        labels = {}
-        for n in range(m_node_graph.order()): labels[n] = str(n)
-        nx.draw_networkx_labels(m_node_graph, pos, labels, font_size = 10)
-
-    if draw:
-        plt.xlim(-0.05, 1.05)
-        plt.ylim(-0.05, 1.05)
-        # plt.axis('off')
-        plt.show(block = False)
+        draw_reduced_graph(G, m_node_graph, pos)
     return G
 
+def compare_reductions(N, M, D, graphs = 5):
+    ''' Benchmark of reduce_graph() modes on the same graphs: tree cost
+    (edges kept) and runtime of 'mst' against 'steiner'. Both get the same
+    center of G, found before the clock starts, so only the reduction
+    itself is timed. '''
+    print("-- reduce_graph modes, (N, M) = (" + str(N) + ", " + str(M) + ")", "D =", D)
+    totals = {'mst': [0, 0.0], 'steiner': [0, 0.0]}
+    for g in range(graphs):
+        G = generate_graph(N, M, D)
+        ctr = find_center_node(G, approx = True)[0]
+        for mode in ('mst', 'steiner'):
+            start = time.time()
+            R = reduce_graph(G.copy(), M, N, False, mode, ctr)
+            elapsed = time.time() - start
+            totals[mode][0] += R.number_of_edges()
+            totals[mode][1] += elapsed
+            print("   graph", g, mode, "tree cost =", R.number_of_edges(), "time = %.3fs" % elapsed)
+    for mode, (cost, elapsed) in totals.items():
+        print("   mean", mode, "tree cost =", cost / graphs, "time = %.3fs" % (elapsed / graphs))
+    return totals
+
 def testremoval(G,M,X,Y):
     '''Tests to see if M nodes are reachable by node 0 after removing an edge.'''
     G.remove_edge(X,Y)
@@ -237,16 +455,17 @@ def checkconnection(G,M):
         return True
 
 def furthestfromMnodes(G,M,arr):
-    '''Returns the sum of distances between the node furthest from all M nodes and the M nodes themselves.'''
+    '''Returns the sum of distances between the node furthest from all M nodes and the M nodes themselves.
+    One BFS per M node; nodes it can't reach (dropped from the reduced graph) are skipped.
+    None when there is no node but the M nodes to pick from.'''
     nodedict = {}
-    for x in range(M, len(G)):
-        sum = 0
-        for y in arr:
-            sum +=nx.shortest_path_length(G,x,y)
-        nodedict[x] = sum
-    highest = M
-    for x in range(M, len(G)):
-        if nodedict[x]>nodedict[highest]:
+    for y in arr:
+        for x, d in nx.single_source_shortest_path_length(G,y).items():
+            if x >= M:
+                nodedict[x] = nodedict.get(x, 0) + d
+    highest = None
+    for x in sorted(nodedict):
+        if highest is None or nodedict[x]>nodedict[highest]:
             highest = x
     return highest
 
@@ -281,6 +500,34 @@ def closestMtoMdistance(G,M,arr):
             lowest = x
     return distancefromnodes(G,lowest,arr)
 
+# two-sided 95% Student t quantiles by degrees of freedom
+T95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+       2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+       2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+class RunningStat:
+    ''' Welford's streaming mean/variance of one metric, so no per-round
+    lists are kept; ci() is the half width of its 95% confidence interval. '''
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def ci(self):
+        if self.n < 2: return float('inf')
+        df = self.n - 1
+        t = T95[df - 1] if df <= len(T95) else 1.96 + 2.4 / df
+        return t * math.sqrt(self.m2 / df / self.n)
+
+    def converged(self, rel_err):
+        return self.ci() <= rel_err * abs(self.mean)
+
 # def reduce_all_ones(G):
 #     non_red_nodes = list(G.nodes.data('wrk'))
 #     print(non_red_nodes)
@@ -299,34 +546,85 @@ def simulation(N, M, D, d_min, d_max, d_M, round_per_graph, draw = False):
     G = reduce_graph(G, M, N, draw) ##NOTE added N parameter to help simplify adding missing white nodes.
     # rest is your work...
 
-def iteration(N, M, D, d_min, d_max, d_M, round_per_graph):
+def iteration(N, M, D, d_min, d_max, d_M, round_per_graph,
+              rel_err = 0.05, min_rounds = 3, max_rounds = 200):
     ''' N is a total number of node, M is a server node, D is a RGG's distance
     parameter, a uniform [d_max, d_min] is a generated data size to exchange,
     d_M is the number of data generating servres, round_per_graph is the
     number of iterations per a generated graph, and draw is to decide if the
     graph is gerated or not. This is a variation of the above simulation meant
-    to analyze the graph created. Four analysis functions are used 10 times to gain
-    the correct answer to the experimental set.'''
+    to analyze the graph created. Four analysis functions are sampled for
+    round_per_graph rounds on each fresh graph, and graphs are made until the
+    95% confidence interval of every one of them is within rel_err of its
+    mean, or after max_rounds (in whole graphs). Rounds on one graph share it
+    (with d_M == M three of the metrics don't change at all), so the CIs are
+    over the per-graph means. A reduced graph of servers only has no node for
+    furthestfromMnodes() and is skipped for a new one. Returns [furthest,
+    random, center, closest, M, N] means followed by the four CI half widths,
+    the rounds and the graphs used.'''
     print("-- (N, M) = (" + str(N) + ", " + str(M) + ")", "D =", D,
           "data =[" + str(d_min) + " ," + str(d_max) + "]",
           "Data Senders =", d_M, "Per Graph =", round_per_graph)
-    answerlist = [[0 for i in range(6)] for j in range(10)]
+    stats = [RunningStat() for i in range(4)]
+    rounds = graphs = skipped = 0
+    while rounds < max_rounds and (rounds < min_rounds or
+                                   not all(st.converged(rel_err) for st in stats)):
+        G = generate_graph(N, M, D)
+        G = reduce_graph(G, M, N, False)
+        if max(G) < M:
+            skipped += 1
+            assert skipped <= max_rounds, "<FATAL> iteration(): too many reduced graphs of servers only, M too close to N?"
+            print("   DEBUG: reduced graph has servers only, making a new one...")
+            continue
+        # reduce_graph() already found the center of the reduced graph
+        center = [n for n, wrk in G.nodes(data = 'wrk') if wrk == 'r-ctr'][0]
+        graphs += 1
+        sums = [0, 0, 0, 0]
+        for r in range(round_per_graph):
+            arr = list(range(M))
+            arr = rnd.sample(arr,int(d_M))
+            sums[0] += distancefromnodes(G,furthestfromMnodes(G,M,arr),arr)
+            sums[1] += randomMtoMdistance(G,M,arr)
+            sums[2] += distancefromnodes(G,center,arr)
+            sums[3] += closestMtoMdistance(G,M,arr)
+        for st, total in zip(stats, sums): st.add(total / round_per_graph)
+        rounds += round_per_graph
+    print("   rounds =", rounds, "graphs =", graphs, " ".join(
+          "%.1f+-%.1f" % (st.mean, st.ci()) for st in stats))
+    return [st.mean for st in stats] + [M, N] + [st.ci() for st in stats] + [rounds, graphs]
+
+def store_iteration(N, M, D, d_M, path, workers = None, memory = 256 << 20):
+    ''' One round of the iteration() metrics for graphs too big for
+    find_center_node() and per-pair shortest_path_length(). The graph is
+    reduced like iteration() does, but in 'steiner' mode, as 'mst' needs all
+    pairs itself; all hop counts of the reduced graph go to a disk-backed
+    diststore.DistanceStore at path, built by BFS worker processes, and each
+    metric is a streaming reduction over it within memory bytes. The center
+    is the 'r-ctr' of the reduced graph, as in iteration(). Returns
+    [furthest, random, center, closest, M, N] like iteration() does. '''
+    print("-- store (N, M) = (" + str(N) + ", " + str(M) + ")", "D =", D,
+          "Data Senders =", d_M, "path =", path)
+    start = time.time()
     G = generate_graph(N, M, D)
-    G = reduce_graph(G, M, False)
-    for i in range(10):
-        arr = list(range(M))
-        arr = rnd.sample(arr,int(d_M))
-        answerlist[i][5] = N
-        answerlist[i][4] = M
-        answerlist[i][0] = distancefromnodes(G,furthestfromMnodes(G,M,arr),arr)
-        answerlist[i][1] = randomMtoMdistance(G,M,arr)
-        answerlist[i][2] = distancefromnodes(G,find_center_node(G)[0],arr)
-        answerlist[i][3] = closestMtoMdistance(G,M,arr)
-    return answerlist
+    G = reduce_graph(G, M, N, False, 'steiner')
+    print("   reduced %.1fs" % (time.time() - start))
+    # only the tree: the nodes the reduction dropped are unreachable
+    nodes = [n for n in G if G.degree[n] > 0 or n < M]
+    center = [n for n, wrk in G.nodes(data = 'wrk') if wrk == 'r-ctr'][0]
+    store = diststore.DistanceStore.build(path, G, nodes, workers = workers, memory = memory)
+    print("   distances %.1fs" % (time.time() - start))
+    arr = rnd.sample(range(M), int(d_M))
+    source = rnd.randrange(0, M)
+    furthest = store.argmax('sum', arr, [n for n in nodes if n >= M])
+    closest = store.argmin('sum', arr, range(M))
+    return [furthest[1],
+            int(store.sums([y for y in arr if y != source], [source])[0]),
+            int(store.sums(arr, [center])[0]),
+            closest[1], M, N]
 
 def assignment():
-    '''Runs the above iteration code 10 x 10 x 4 times of different variations. Answers returned are added to an array,
-    which is then written to a csv as the answer.'''
+    '''Runs the above iteration code 10 x 4 times of different variations, each for as many rounds as it needs.
+    Answers returned (one row per variation) are added to an array, which is then written to a csv as the answer.'''
     answerlist = [[0 for col in range(10)] for row in range(40)]
     for x in range(0,10):
         M = rnd.randrange(1,11)*10
@@ -343,11 +641,25 @@ def assignment():
     with open('answerfile.csv', mode='w') as answer_file:
         answerwriter = csv.writer(answer_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
         for j in range(len(answerlist)):
-            for k in range(len(answerlist[j])):
-                answerwriter.writerow(answerlist[j][k])
-
-
-
-simulation(200, 20, 0.125, 10, 100, 10, 10, True)
-plt.show()
+            answerwriter.writerow(answerlist[j])
+
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['benchmark']:   # python assign1.py benchmark
+        compare_reductions(200, 20, 0.125)
+    elif sys.argv[1:2] == ['store']:     # python assign1.py store 50000 500 0.01 /var/tmp/dist.npy
+        N, M, D = int(sys.argv[2]), int(sys.argv[3]), float(sys.argv[4])
+        print(store_iteration(N, M, D, M, sys.argv[5]))
+    elif sys.argv[1:2] == ['center']:    # python assign1.py center 1000000 0.002
+        N, D = int(sys.argv[2]), float(sys.argv[3])
+        start = time.time()
+        G = generate_graph(N, 0, D)
+        print("-- approx center, N =", N, "D =", D, "graph %.1fs" % (time.time() - start))
+        start = time.time()
+        print("   [center, eccentricity, bound] =", find_center_node(G, True),
+              "%.1fs" % (time.time() - start))
+    else:
+        simulation(200, 20, 0.125, 10, 100, 10, 10, True)
+        plt.show()
 
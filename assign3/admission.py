@@ -0,0 +1,144 @@
+import time
+from collections import OrderedDict
+
+
+class TokenBucket(object):
+    ''' rate tokens per second, up to burst tokens saved up '''
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.last = time.time()
+
+    def consume(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class Admission(object):
+    ''' Packet-In admission control. Every Packet-In must get a token from
+    the bucket of its datapath and from the bucket of its source MAC;
+    otherwise it is shed (ignored by the controller). A source that gets
+    shed `strikes` times in a row is blocked on its OFS with a drop flow
+    for `block_time` seconds. The table-miss flow itself is metered on the
+    OFS so a flood is cut before it reaches the controller.
+
+    Source buckets are kept for at most `max_sources` (datapath, MAC) pairs.
+    One idle for burst / rate seconds is full again and is dropped; when the
+    table is still full (a MAC scan: every spoofed source would get a fresh
+    burst), new sources share the bucket of their (datapath, in_port). '''
+
+    METER_ID = 1
+
+    def __init__(self, metrics, dp_rate=1000, dp_burst=2000, src_rate=100, src_burst=200,
+                 strikes=50, block_time=10, meter_rate=2000, meter_burst=4000,
+                 max_sources=4096):
+        self.metrics = metrics
+        self.dp_rate = dp_rate
+        self.dp_burst = dp_burst
+        self.src_rate = src_rate
+        self.src_burst = src_burst
+        self.strikes = strikes
+        self.block_time = block_time
+        self.meter_rate = meter_rate
+        self.meter_burst = meter_burst
+        self.max_sources = max_sources
+        self.dp_buckets = {}     # dpid -> TokenBucket
+        self.src_buckets = OrderedDict()   # (dpid, MAC) -> TokenBucket, least recently used first
+        self.port_buckets = {}   # (dpid, in_port) -> TokenBucket, once src_buckets is full
+        self.src_strikes = {}    # (dpid, MAC) -> Packet-Ins shed in a row
+        self.blocked = OrderedDict()       # (dpid, MAC) -> time the drop flow expires, oldest first
+        # counters[dpid] = {'admitted', 'shed_dp', 'shed_src', 'shed_port', 'blocked'}
+        self.counters = {}
+
+    def admit(self, dp, smac, pin):
+        ''' True if the Packet-In from smac on port pin of dp should be handled '''
+        now = time.time()
+        dpid = dp.id
+        count = self.counters.setdefault(dpid, {'admitted': 0, 'shed_dp': 0, 'shed_src': 0,
+                                                'shed_port': 0, 'blocked': 0})
+        key = (dpid, smac)
+        while self.blocked and next(iter(self.blocked.values())) <= now:
+            self.blocked.popitem(last=False)
+
+        # already blocked on the OFS, these are stragglers
+        if key in self.blocked:
+            count['shed_src'] += 1
+            return False
+
+        if dpid not in self.dp_buckets:
+            self.dp_buckets[dpid] = TokenBucket(self.dp_rate, self.dp_burst)
+        bucket = self.source_bucket(now, key)
+        if bucket is None:
+            port = (dpid, pin)
+            if port not in self.port_buckets:
+                self.port_buckets[port] = TokenBucket(self.src_rate, self.src_burst)
+            if not self.port_buckets[port].consume(now):
+                count['shed_port'] += 1
+                return False
+        elif not bucket.consume(now):
+            count['shed_src'] += 1
+            self.src_strikes[key] = self.src_strikes.get(key, 0) + 1
+            if self.src_strikes[key] >= self.strikes:
+                self.block_source(dp, smac)
+                self.blocked[key] = now + self.block_time
+                self.src_strikes.pop(key)
+                count['blocked'] += 1
+            return False
+        self.src_strikes.pop(key, None)
+
+        if not self.dp_buckets[dpid].consume(now):
+            count['shed_dp'] += 1
+            return False
+        count['admitted'] += 1
+        return True
+
+    def source_bucket(self, now, key):
+        ''' bucket of key, None when the table is full of active sources '''
+        if key in self.src_buckets:
+            self.src_buckets.move_to_end(key)
+            return self.src_buckets[key]
+        idle = self.src_burst / float(self.src_rate)
+        while self.src_buckets:
+            oldest, bucket = next(iter(self.src_buckets.items()))
+            if now - bucket.last < idle:
+                break
+            self.src_buckets.popitem(last=False)
+            self.src_strikes.pop(oldest, None)
+        if len(self.src_buckets) >= self.max_sources:
+            return None
+        self.src_buckets[key] = TokenBucket(self.src_rate, self.src_burst)
+        return self.src_buckets[key]
+
+    def block_source(self, dp, smac):
+        ofp = dp.ofproto
+        ofp_parser = dp.ofproto_parser
+        # no instructions = drop; above every forwarding flow
+        mod = ofp_parser.OFPFlowMod(datapath=dp, priority=100, hard_timeout=self.block_time,
+                                    match=ofp_parser.OFPMatch(eth_src=smac), instructions=[])
+        self.metrics.log('block_source', dpid=dp.id, src=smac, seconds=self.block_time)
+        dp.send_msg(mod)
+
+    def install_meter(self, dp):
+        ''' Add the Packet-In meter to dp; returns the instruction to put in
+        front of the table-miss actions '''
+        ofp = dp.ofproto
+        ofp_parser = dp.ofproto_parser
+        bands = [ofp_parser.OFPMeterBandDrop(rate=self.meter_rate, burst_size=self.meter_burst)]
+        mod = ofp_parser.OFPMeterMod(datapath=dp, command=ofp.OFPMC_ADD,
+                                     flags=ofp.OFPMF_PKTPS | ofp.OFPMF_BURST,
+                                     meter_id=self.METER_ID, bands=bands)
+        dp.send_msg(mod)
+        return ofp_parser.OFPInstructionMeter(self.METER_ID, ofp.OFPIT_METER)
+
+    def report(self):
+        total = {'admitted': 0, 'shed_dp': 0, 'shed_src': 0, 'shed_port': 0, 'blocked': 0}
+        for count in self.counters.values():
+            for name in total:
+                total[name] += count[name]
+        return total
@@ -3,14 +3,32 @@ from ryu.ofproto import ofproto_v1_3, ether
 from ryu.controller.handler import set_ev_cls
 from ryu.controller import ofp_event
 from ryu.controller.handler import MAIN_DISPATCHER, CONFIG_DISPATCHER
-from ryu.lib.packet import packet, ethernet, arp
+from ryu.lib.packet import packet, ethernet, arp, lldp
 from ryu.app.ofctl.api import get_datapath
 from ryu.topology.api import get_switch, get_link
 from ryu.topology import event
+from ryu.topology.switches import LLDPPacket
 from ryu.lib import hub, mac
+import bisect
+import collections
+import os
+from msg_batch import MsgBatcher
+from admission import Admission
+from metrics import Metrics, port_from_env
+from lifecycle import FlowLifecycle
+from route_jobs import RouteJobs
+import sharding
+import checkpoint
+import time
+import logging
 
 class Switch(app_manager.RyuApp):
     OFP_VERSIONS =[ofproto_v1_3.OFP_VERSION]
+    # masked eth_dst flows of the 'subtree' mode: above the per-MAC flows,
+    # and a cookie no per-MAC delete matches
+    AGG_PRIORITY = 2
+    AGG_COOKIE = 1 << 63
+    ARP_PRIORITY = 3
 
     
     
@@ -20,8 +38,91 @@ class Switch(app_manager.RyuApp):
         # for assignment 2
         # ARP_table[IP] = MAC
         self.ARP_table = {}
-        self.shortest_paths = {}
+        # path_parents[swid1][swid2] = switch before swid2 on the shortest
+        # path from swid1; computed off the hub by route_jobs and swapped in
+        # whole, paths_version is the job version of the table in use
+        self.path_parents = {}
+        self.paths_version = 0
+        self.paths_stale = True
+        self.route_jobs = RouteJobs()
         self.switches = {}
+        # host_location[MAC] = (swid, port) of the edge port the host sits on,
+        # shared by all OFSs (with ARP_table, also IP -> location); only
+        # learned on edge ports, switch_ports holds the (swid, port) of
+        # every inter-switch link end
+        self.host_location = {}
+        self.switch_ports = set()
+        # link_ports[(swid1, swid2)] = port on swid1 facing swid2
+        self.link_ports = {}
+        # blocked_ports[swid] = its switch ports off the flooding spanning
+        # tree (comes with path_parents)
+        self.blocked_ports = {}
+        # flow_owners[MAC] = set of swid holding a flow for eth_dst=MAC
+        self.flow_owners = {}
+        # mac_cookies[MAC] = OpenFlow cookie tagged on every flow for eth_dst=MAC
+        self.mac_cookies = {}
+        # FlowMods/PacketOuts are coalesced per datapath before being written
+        self.batcher = MsgBatcher()
+        # counters, Packet-In latency and flow-table occupancy, served as
+        # Prometheus text on http://127.0.0.1:metrics_port/metrics (9108, plus
+        # the shard number when sharded; RYU_METRICS_PORT overrides it)
+        self.metrics = Metrics(self.logger)
+        # token buckets per datapath / source MAC in front of packet_in_handler
+        self.admission = Admission(self.metrics)
+        self.metrics.add_source('batcher', self.batcher.report)
+        self.metrics.add_source('admission', self.admission.report)
+        self.metrics_port = port_from_env()
+        self.metrics.serve(self.metrics_port)
+        # adaptive idle timeouts, LRU eviction near flow_table_capacity
+        self.flow_table_capacity = 2000
+        self.lifecycle = FlowLifecycle(self.metrics, self.batcher.send, capacity=self.flow_table_capacity)
+        self.metrics.add_source('lifecycle', self.lifecycle.report)
+        self.metrics.add_source('route_jobs', self.route_jobs.report)
+        hub.spawn(self.lifecycle.monitor)
+        # match_mode, from RYU_MATCH_MODE:
+        #             'in_port' = (default) flows match (eth_dst, in_port)
+        #             'dst'     = flows match eth_dst only, O(hosts) per OFS
+        #             'subtree' = 'dst', plus when the switches form a tree,
+        #                         one masked eth_dst flow per block of host
+        #                         MACs behind the same port, installed ahead
+        #                         of the traffic
+        self.match_mode = os.environ.get('RYU_MATCH_MODE') or 'in_port'
+        assert self.match_mode in ('in_port', 'dst', 'subtree'), \
+            "<FATAL> RYU_MATCH_MODE must be in_port, dst or subtree, not " + self.match_mode
+        # aggregates[swid] = set of (MAC value, MAC mask, port) installed
+        self.aggregates = {}
+        self.aggregates_pending = False
+        # sharding (RYU_SHARDS > 1, see sharding.py): links and host
+        # locations are shared with the other shards; path hops on their
+        # OFSs are installed by them, and the first packet is released
+        # once they all acknowledged (or after shard_timeout)
+        self.shards = sharding.from_env()
+        self.remote_links = {}     # (swid1, swid2) -> (time of the last LLDP between shards, port on swid2)
+        self.remote_link_timeout = 10
+        self.pending_outs = {}     # request -> [dp, PacketOut, Packet-In time, hops left]
+        self.shard_requests = 0
+        self.shard_timeout = 0.1
+        if self.shards is not None:
+            self.shards.subscribe('links', self.shard_link)
+            self.shards.subscribe('hosts', self.shard_host)
+            self.shards.on('install', self.shard_install)
+            self.shards.on('installed', self.shard_installed)
+            self.metrics.add_source('shards', self.shards.report)
+            hub.spawn(self.expire_remote_links)
+        # warm restart (RYU_CHECKPOINT, see checkpoint.py): the learned state
+        # is saved while it changes and restored at start up. Restored links
+        # stand in for LLDP until it finds them again (restore_grace at
+        # most), and the flows every OFS kept are checked against the
+        # restored state (FlowStats) when it connects.
+        self.checkpoint = checkpoint.from_env()
+        self.restored = False
+        self.restored_links = {}   # (swid1, swid2) -> port, until rediscovered
+        self.restore_grace = 10
+        self.revalidating = set()
+        if self.checkpoint is not None:
+            self.restore(self.checkpoint.load())
+            self.metrics.add_source('checkpoint', self.checkpoint.report)
+            hub.spawn(self.checkpoint.run, self.checkpoint_state)
 
     def remove_MAC(self, mac):
         for key in self.MAC_table:
@@ -42,12 +143,27 @@ class Switch(app_manager.RyuApp):
         dmac = etherh.dst
         pin  = msg.match['in_port']
         swid = dp.id
+        started = self.metrics.packet_in(dp)
+
+        # LLDP between OFSs of different shards
+        if self.shards is not None and pkt.get_protocol(lldp.lldp):
+            self.shard_lldp(swid, pin, msg.data)
+            return
+
+        # shed Packet-Ins over the rate limits (ARP storms, scans)
+        if not self.admission.admit(dp, smac, pin):
+            return
         
         #Create the MAC table for swid
         self.MAC_table.setdefault(swid,{})
 
         #Learn Src. MAC, avoid flood
         self.MAC_table[swid][smac] = pin
+        self.lifecycle.packet_in(swid, dmac)
+
+        # remember where the host is attached (edge ports only)
+        if not self.is_switch_port(swid, pin):
+            self.locate_host(smac, swid, pin)
 
         # 2.2: For arp
         if (pkt.get_protocol(arp.arp)):
@@ -57,47 +173,163 @@ class Switch(app_manager.RyuApp):
             if arp_pkt.src_ip not in self.ARP_table:
                 #print('Adding dest mac to arp table...', arp_pkt.dst_ip, dmac, smac, pin, swid)
                 self.ARP_table[arp_pkt.src_ip] = smac
+                self.changed()
 
 
-        # if dest MAC is already avail, figure out which port to output
-        # otherwise flood, but dont flood?
-        if dmac in self.MAC_table[swid]:
-            port_out = self.MAC_table[swid][dmac]
-        else:
-            if self.arp_handler(msg):
+        # host location is known: push the whole path at once
+        location = self.host_location.get(dmac)
+        if location is not None and location[0] != swid:
+            if self.provision_path(msg, dmac, started):
                 return
-            else:
-                # disabling flooding?
-                port_out = ofp.OFPP_FLOOD
-            
+
         # prepare and send PACKET-OUT
         data = None
         if msg.buffer_id == ofp.OFP_NO_BUFFER:
             data = msg.data  
 
+        # if dest MAC is already avail, figure out which port to output
+        # otherwise flood, but dont flood?
+        if location is not None and location[0] == swid:
+            port_out = location[1]
+        elif dmac in self.MAC_table[swid]:
+            port_out = self.MAC_table[swid][dmac]
+        else:
+            if self.arp_handler(msg, started):
+                return
+            # flood, along the spanning tree only
+            actions = self.flood_actions(dp, pin)
+            if actions is None:
+                self.metrics.count(swid, 'flood')
+                return
+            out = ofp_parser.OFPPacketOut(
+                datapath=dp, buffer_id=msg.buffer_id,
+                in_port=pin, actions=actions,
+                data=data)
+            self.batcher.send(dp, out)
+            self.metrics.packet_out(dp, started, flood=True)
+            return
+
         actions = [ofp_parser.OFPActionOutput(port_out)]
         out = ofp_parser.OFPPacketOut(
             datapath=dp, buffer_id=msg.buffer_id, 
             in_port=pin, actions=actions, 
             data=data)
+        self.batcher.send(dp, out)
+        self.metrics.packet_out(dp, started)
 
-        if port_out != ofp.OFPP_FLOOD:
-            dp.send_msg(out)
+        # 1.1: idle_timeout: learned per destination (10s until then)
+        self.add_flow(dp, dmac, pin, port_out)
+
+    # Output actions of a flood from pin on dp, or None to drop it. Floods
+    # only follow a spanning tree of the OFSs (the BFS tree of the lowest
+    # dpid, see compute_paths), so a broadcast reaches every OFS once
+    # instead of circling the loops. OpenFlow 1.3 has no OFPPC_NO_FLOOD for
+    # the other switch ports, so they are left out of the PacketOut, and
+    # floods arriving on them are dropped. Until the first tree is
+    # computed nothing is flooded.
+    def flood_actions(self, dp, pin):
+        ofp = dp.ofproto
+        ofp_parser = dp.ofproto_parser
+        if not self.path_parents:
+            self.request_paths()
+            return None
+        blocked = self.blocked_ports.get(dp.id, set())
+        if pin in blocked:
+            return None
+        if not blocked:
+            return [ofp_parser.OFPActionOutput(ofp.OFPP_FLOOD)]
+        ports = []
+        for switch in get_switch(self, dp.id):
+            ports = [p.port_no for p in switch.ports
+                     if p.port_no != pin and p.port_no not in blocked]
+        return [ofp_parser.OFPActionOutput(port) for port in ports]
 
-        # 1.1: idle_timeout: 10s for our flowmod
+    def add_flow(self, dp, dmac, pin, port_out):
+        ofp = dp.ofproto
+        ofp_parser = dp.ofproto_parser
+        actions = [ofp_parser.OFPActionOutput(port_out)]
         inst = [ofp_parser.OFPInstructionActions(
             ofp.OFPIT_APPLY_ACTIONS, actions)]
-        match = ofp_parser.OFPMatch(
-            eth_dst=dmac, in_port=pin)
-        
-        mod = ofp_parser.OFPFlowMod(datapath=dp, idle_timeout=10,
-        priority=1,match=match,instructions=inst)
+        if self.match_mode == 'in_port':
+            match = ofp_parser.OFPMatch(
+                eth_dst=dmac, in_port=pin)
+        else:
+            match = ofp_parser.OFPMatch(eth_dst=dmac)
 
-        if port_out != ofp.OFPP_FLOOD:
-            dp.send_msg(mod)
+        # SEND_FLOW_REM: idle timeouts are reported, for the occupancy count
+        idle_timeout = self.lifecycle.timeout(dp.id, dmac)
+        mod = ofp_parser.OFPFlowMod(datapath=dp, cookie=self.get_cookie(dmac),
+        idle_timeout=idle_timeout, priority=1, flags=ofp.OFPFF_SEND_FLOW_REM,
+        match=match,instructions=inst)
+        self.metrics.log('flow_add', logging.DEBUG, dpid=dp.id, eth_dst=dmac, in_port=pin,
+                         out_port=port_out, idle_timeout=idle_timeout)
+        self.metrics.flow_mod(dp, mod)
+        self.batcher.send(dp, mod)
+        self.lifecycle.added(dp, mod)
+        self.flow_owners.setdefault(dmac, set()).add(dp.id)
 
+    def get_cookie(self, mac):
+        if mac not in self.mac_cookies:
+            self.mac_cookies[mac] = len(self.mac_cookies) + 1
+        return self.mac_cookies[mac]
 
-    def arp_handler(self, msg):
+    # Install the flow on every OFS of the shortest path on the first miss,
+    # so the next hops never raise their own Packet-In
+    def provision_path(self, msg, dmac, started=None):
+        dp = msg.datapath
+        ofp = dp.ofproto
+        ofp_parser = dp.ofproto_parser
+        pin = msg.match['in_port']
+        dst_swid, dst_port = self.host_location[dmac]
+
+        path = self.get_path(dp.id, dst_swid)
+        if path is None:
+            return False
+
+        # (swid, port in, port out) for every hop
+        hops = []
+        for i, hop in enumerate(path):
+            if i == 0:
+                hop_in = pin
+            else:
+                hop_in = self.link_ports.get((hop, path[i-1]))
+            if i == len(path) - 1:
+                hop_out = dst_port
+            else:
+                hop_out = self.link_ports.get((hop, path[i+1]))
+            hop_dp = dp if hop == dp.id else get_datapath(self, hop)
+            if hop_in is None or hop_out is None:
+                return False
+            if hop_dp is None and (self.shards is None or self.shards.owns(hop)):
+                return False
+            hops.append((hop, hop_dp, hop_in, hop_out))
+
+        # egress first, so a packet never reaches a switch before its flow does
+        for hop, hop_dp, hop_in, hop_out in reversed(hops):
+            if hop_dp is not None:
+                self.add_flow(hop_dp, dmac, hop_in, hop_out)
+        for hop, hop_dp, hop_in, hop_out in reversed(hops):
+            if hop_dp is not None:
+                self.batcher.flush(hop_dp.id)
+
+        # release the buffered packet at the ingress switch
+        data = None
+        if msg.buffer_id == ofp.OFP_NO_BUFFER:
+            data = msg.data
+        out = ofp_parser.OFPPacketOut(
+            datapath=dp, buffer_id=msg.buffer_id,
+            in_port=pin, actions=[ofp_parser.OFPActionOutput(hops[0][3])],
+            data=data)
+        remote = [(hop, hop_in, hop_out) for hop, hop_dp, hop_in, hop_out in hops if hop_dp is None]
+        if remote:
+            self.shard_provision(remote, dmac, dp, out, started)
+        else:
+            self.batcher.send(dp, out)
+            self.metrics.packet_out(dp, started)
+        return True
+
+
+    def arp_handler(self, msg, started=None):
         dp = msg.datapath
         ofp = dp.ofproto
         ofp_parser = dp.ofproto_parser
@@ -160,7 +392,8 @@ class Switch(app_manager.RyuApp):
                         in_port=ofp.OFPP_CONTROLLER,
                         actions=[ofp_parser.OFPActionOutput(port_out, 0)],
                         data=ARP_Reply.data)
-                    dp.send_msg(out)
+                    self.batcher.send(dp, out)
+                    self.metrics.packet_out(dp, started)
                     return True
                     
         return False
@@ -173,23 +406,78 @@ class Switch(app_manager.RyuApp):
         ofp_parser = dp.ofproto_parser
 
         #Prepare the Flow mod message
+        #table-miss Packet-Ins go through the meter first
         actions = [ofp_parser.OFPActionOutput(
             ofp.OFPP_CONTROLLER, ofp.OFPCML_NO_BUFFER)]
-        inst = [ofp_parser.OFPInstructionActions(
+        inst = [self.admission.install_meter(dp),
+                ofp_parser.OFPInstructionActions(
             ofp.OFPIT_APPLY_ACTIONS, actions)]
         
         mod = ofp_parser.OFPFlowMod(datapath=dp, 
         priority=0,instructions=inst)
 
+        self.metrics.flow_mod(dp, mod)
         dp.send_msg(mod)
 
+        # restored state: see what the OFS kept
+        if self.restored:
+            self.revalidating.add(dp.id)
+            dp.send_msg(ofp_parser.OFPFlowStatsRequest(dp, 0, ofp.OFPTT_ALL, ofp.OFPP_ANY,
+                                                       ofp.OFPG_ANY, 0, 0, ofp_parser.OFPMatch()))
+
+        # 'subtree': the aggregates also carry frames from hosts never seen
+        # before (e.g. the ARP reply of a host found by a flood), so ARP
+        # keeps coming to the controller and every host gets learned
+        if self.match_mode == 'subtree':
+            mod = ofp_parser.OFPFlowMod(datapath=dp, priority=self.ARP_PRIORITY,
+                                        match=ofp_parser.OFPMatch(eth_type=ether.ETH_TYPE_ARP),
+                                        instructions=inst)
+            self.metrics.flow_mod(dp, mod)
+            dp.send_msg(mod)
+
+    # idle/hard timeouts of flows added with OFPFF_SEND_FLOW_REM
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        self.metrics.flow_removed(ev.msg)
+        self.lifecycle.flow_removed(ev.msg)
+
+    # usage of the flows, polled by the lifecycle when a table fills up
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_reply_handler(self, ev):
+        if ev.msg.datapath.id in self.revalidating:
+            self.revalidate(ev.msg)
+        self.lifecycle.stats_reply(ev.msg)
+
     def remove_flow(self, datapath, match):
         ofp = datapath.ofproto
         ofp_parser = datapath.ofproto_parser
         mod = ofp_parser.OFPFlowMod(datapath=datapath, command=ofp.OFPFC_DELETE, out_port=ofp.OFPP_ANY,
                                     out_group=ofp.OFPP_ANY, match=match)
-        print('Removed flow of datapath id: {}, match: dest MAC: {}'.format(datapath.id, match['eth_dst']))
-        datapath.send_msg(mod)
+        self.metrics.log('flow_delete', dpid=datapath.id, eth_dst=match['eth_dst'])
+        self.metrics.flow_mod(datapath, mod)
+        self.batcher.send(datapath, mod)
+
+    # 1.3: only the OFSs that got a flow for this MAC are told to delete;
+    # one cookie-masked delete per OFS clears all of them, then a barrier
+    def remove_host_flows(self, mac):
+        if mac not in self.mac_cookies:
+            return
+        cookie = self.mac_cookies[mac]
+        for swid in self.flow_owners.pop(mac, set()):
+            datapath = get_datapath(self, swid)
+            if datapath is None:
+                continue
+            ofp = datapath.ofproto
+            ofp_parser = datapath.ofproto_parser
+            mod = ofp_parser.OFPFlowMod(datapath=datapath, cookie=cookie,
+                                        cookie_mask=0xffffffffffffffff,
+                                        table_id=ofp.OFPTT_ALL, command=ofp.OFPFC_DELETE,
+                                        out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY,
+                                        match=ofp_parser.OFPMatch())
+            self.metrics.flow_mod(datapath, mod)
+            self.batcher.send(datapath, mod)
+            self.batcher.send(datapath, ofp_parser.OFPBarrierRequest(datapath))
+            self.metrics.log('flow_delete', dpid=swid, eth_dst=mac, cookie=cookie)
         
     # a simple get dict key by value function
     def get_MAC(self, table, port):
@@ -209,73 +497,441 @@ class Switch(app_manager.RyuApp):
         
         if port.state == ofp.OFPPS_LINK_DOWN:
             # 1.2 : host removed from network; update mac table
-            bad_MAC = self.get_MAC(self.MAC_table[swid], port.port_no)
+            bad_MAC = self.get_MAC(self.MAC_table.get(swid, {}), port.port_no)
             if bad_MAC != None:
                 self.MAC_table[swid].pop(bad_MAC)
-                print('Removed from MAC table: MAC: {}'.format(bad_MAC))
-            
-            # 1.3: all flow entries related to that host should be removed;
-            match = ofp_parser.OFPMatch(eth_dst=bad_MAC)
-            dp_list = get_datapath(self, None)
-            for dp_item in dp_list:
-                self.remove_flow(dp_item, match)
+            for host_mac, location in list(self.host_location.items()):
+                if location == (swid, port.port_no):
+                    self.metrics.log('host_removed', dpid=swid, mac=host_mac)
+                    # 1.3: all flow entries related to that host should be removed;
+                    self.forget_host(host_mac)
                 
         # triggering the test with deleting a host
         # print('Shortest paths test: ', self.get_shortest_paths())
         
-    # 2.1 : Find best routes between all pairs of OFS:
+    # link added/removed: the paths are recomputed in the background, the
+    # old ones keep being used until then
+    @set_ev_cls([event.EventLinkAdd, event.EventLinkDelete])
+    def topology_changed(self, ev):
+        link = ev.link
+        if isinstance(ev, event.EventLinkAdd):
+            self.restored_links.pop((link.src.dpid, link.dst.dpid), None)
+            self.add_switch_port(link.src.dpid, link.src.port_no)
+            self.add_switch_port(link.dst.dpid, link.dst.port_no)
+        else:
+            self.switch_ports.discard((link.src.dpid, link.src.port_no))
+        self.paths_stale = True
+        self.request_paths()
+        self.schedule_aggregates()
+        if self.shards is not None:
+            port = link.src.port_no if isinstance(ev, event.EventLinkAdd) else None
+            self.shards.put('links', sharding.key(link.src.dpid, link.dst.dpid), port)
+
+    # a port that turned out to be a link end locates no host
+    def add_switch_port(self, swid, port):
+        self.switch_ports.add((swid, port))
+        for host_mac, location in list(self.host_location.items()):
+            if location == (swid, port):
+                self.forget_host(host_mac)
+
+    #######################################
+    # Host locations
+    def locate_host(self, mac, swid, port):
+        old = self.host_location.get(mac)
+        if old == (swid, port):
+            return
+        self.host_location[mac] = (swid, port)
+        if old is not None:
+            # moved: the flows towards the old port are stale
+            self.metrics.log('host_moved', mac=mac, dpid=swid, port=port)
+            self.remove_host_flows(mac)
+        self.schedule_aggregates()
+        self.changed()
+        if self.shards is not None:
+            self.shards.put('hosts', mac, [swid, port])
+
+    def forget_host(self, mac):
+        if self.host_location.pop(mac, None) is None:
+            return
+        self.remove_host_flows(mac)
+        self.schedule_aggregates()
+        self.changed()
+        if self.shards is not None:
+            self.shards.put('hosts', mac, None)
+
+    # 'subtree' mode: a burst of host/topology changes triggers one update
+    def schedule_aggregates(self):
+        if self.match_mode == 'subtree' and not self.aggregates_pending:
+            self.aggregates_pending = True
+            hub.spawn(self.update_aggregates)
+
+    def update_aggregates(self):
+        self.aggregates_pending = False
+        first_port = self.tree_ports()
+        wanted = {}
+        if first_port is not None:
+            switch_ports = set()
+            for swid in first_port:
+                for port in first_port[swid].values():
+                    switch_ports.add((swid, port))
+            for swid in first_port:
+                hosts = []
+                for host_mac, (host_swid, host_port) in self.host_location.items():
+                    if host_swid not in first_port or (host_swid, host_port) in switch_ports:
+                        continue
+                    if host_swid == swid:
+                        port = host_port
+                    else:
+                        port = first_port[swid][host_swid]
+                    hosts.append((int(host_mac.replace(':', ''), 16), port))
+                wanted[swid] = set(self.mac_blocks(sorted(hosts)))
+        # not a tree (any more): wanted is empty and every aggregate goes
+
+        for swid in set(self.aggregates) | set(wanted):
+            old = self.aggregates.get(swid, set())
+            new = wanted.get(swid, set())
+            if old == new:
+                continue
+            dp = get_datapath(self, swid)
+            if dp is None:
+                self.aggregates.pop(swid, None)
+                continue
+            ofp = dp.ofproto
+            for value, mask, port in old - new:
+                self.aggregate_flow(dp, ofp.OFPFC_DELETE_STRICT, value, mask, port)
+            for value, mask, port in new - old:
+                self.aggregate_flow(dp, ofp.OFPFC_ADD, value, mask, port)
+            self.aggregates[swid] = new
+            self.metrics.log('aggregates', dpid=swid, flows=len(new))
+
+    def aggregate_flow(self, dp, command, value, mask, port):
+        ofp = dp.ofproto
+        ofp_parser = dp.ofproto_parser
+        match = ofp_parser.OFPMatch(eth_dst=(self.int_to_mac(value), self.int_to_mac(mask)))
+        inst = [ofp_parser.OFPInstructionActions(
+            ofp.OFPIT_APPLY_ACTIONS, [ofp_parser.OFPActionOutput(port)])]
+        mod = ofp_parser.OFPFlowMod(datapath=dp, cookie=self.AGG_COOKIE, command=command,
+                                    priority=self.AGG_PRIORITY, out_port=ofp.OFPP_ANY,
+                                    out_group=ofp.OFPG_ANY, match=match, instructions=inst)
+        self.metrics.flow_mod(dp, mod)
+        self.batcher.send(dp, mod)
+
+    def int_to_mac(self, value):
+        return ':'.join('{:02x}'.format((value >> shift) & 0xff) for shift in range(40, -8, -8))
+
+    # Fewest masked MAC blocks (aligned prefixes) such that every address
+    # of a block is a known host, all behind a single port (Mininet's
+    # autoSetMacs numbers hosts contiguously); unknown destinations never
+    # match one and still reach the controller to be flooded. hosts is a
+    # sorted list of (MAC as int, port). Blocks never match group
+    # (broadcast/multicast) addresses, those still go to the controller.
+    def mac_blocks(self, hosts, bits=48):
+        group_bit = 1 << 40
+        keys = [h[0] for h in hosts]
+        blocks = []
+
+        def cover(lo, hi, prefix, length):
+            if lo == hi:
+                return
+            ports = set(port for _, port in hosts[lo:hi])
+            if len(ports) == 1 and hi - lo == 1 << (bits - length):
+                mask = ((1 << length) - 1) << (bits - length)
+                blocks.append((prefix & ~group_bit, mask | group_bit, ports.pop()))
+                return
+            bit = 1 << (bits - length - 1)
+            mid = bisect.bisect_left(keys, prefix | bit, lo, hi)
+            cover(lo, mid, prefix, length + 1)
+            cover(mid, hi, prefix | bit, length + 1)
+
+        cover(0, len(hosts), 0, 0)
+        return blocks
+
+    # first_port[swid1][swid2] = port on swid1 towards swid2, or None when
+    # the switches don't form a tree
+    def tree_ports(self):
+        switches, links = self.topology_snapshot()
+        neighbors = dict((swid, {}) for swid in switches)
+        for src, dst, port in links:
+            if src in neighbors and dst in neighbors:
+                neighbors[src][dst] = port
+        if not switches or sum(len(n) for n in neighbors.values()) != 2 * (len(switches) - 1):
+            return None
+        first_port = {}
+        for root in switches:
+            first = {root: None}
+            queue = [root]
+            for swid in queue:
+                for neighbor, port in neighbors[swid].items():
+                    if neighbor not in first:
+                        first[neighbor] = port if swid == root else first[swid]
+                        queue.append(neighbor)
+            if len(first) != len(switches):
+                return None
+            del first[root]
+            first_port[root] = first
+        return first_port
+
+    def is_switch_port(self, swid, port):
+        return (swid, port) in self.switch_ports
+
+    def get_path(self, swid1, swid2):
+        if swid1 == swid2:
+            return [swid1]
+        parents = self.path_parents.get(swid1, {})
+        if swid2 not in parents:
+            if self.paths_stale:
+                self.request_paths()
+            return None
+        path = [swid2]
+        while path[-1] != swid1:
+            path.append(parents[path[-1]])
+        return path[::-1]
+
+    # 2.1 : Find best routes between all pairs of OFS, in route_jobs
+    def request_paths(self):
+        self.route_jobs.request('paths', self.topology_snapshot, compute_paths, self.install_paths)
+
+    def topology_snapshot(self):
+        switches = [switch.dp.id for switch in get_switch(self, None)]
+        links = [(link.src.dpid, link.dst.dpid, link.src.port_no) for link in get_link(self, None)]
+        if self.shards is not None:
+            # links of the other shards, and the ones between shards
+            known = set(switches)
+            for key, port in self.shards.items('links'):
+                src, dst = [int(x) for x in key.split(':')]
+                links.append((src, dst, port))
+                for swid in (src, dst):
+                    if swid not in known:
+                        known.add(swid)
+                        switches.append(swid)
+        if self.restored_links:
+            # restored, not rediscovered yet
+            known = set(switches)
+            found = set((src, dst) for src, dst, _ in links)
+            for (src, dst), port in self.restored_links.items():
+                if (src, dst) in found:
+                    continue
+                links.append((src, dst, port))
+                for swid in (src, dst):
+                    if swid not in known:
+                        known.add(swid)
+                        switches.append(swid)
+        return switches, links
+
+    def install_paths(self, version, result):
+        self.path_parents, self.link_ports, self.blocked_ports = result
+        self.paths_version = version
+        self.paths_stale = self.route_jobs.jobs['paths']['dirty']
+        self.changed()
+
+    #######################################
+    # Sharding
+    def shard_link(self, key, value, old):
+        if key is not None:
+            swid = int(key.split(':')[0])
+            if value is not None:
+                self.add_switch_port(swid, value)
+            elif old is not None:
+                self.switch_ports.discard((swid, old))
+        self.paths_stale = True
+        self.request_paths()
+        self.schedule_aggregates()
+
+    def shard_host(self, mac, value, old):
+        if value is not None and old is None:
+            self.host_location[mac] = tuple(value)
+        else:
+            # gone, or moved: the flows towards the old port are stale
+            self.host_location.pop(mac, None)
+            self.remove_host_flows(mac)
+            if value is not None:
+                self.host_location[mac] = tuple(value)
+        self.schedule_aggregates()
+
+    # LLDP from an OFS of another shard: a link neither topology API sees
+    def shard_lldp(self, swid, port, data):
+        try:
+            src, src_port = LLDPPacket.lldp_parse(data)
+        except LLDPPacket.LLDPUnknownFormat:
+            return
+        if self.shards.owns(src):
+            return
+        self.remote_links[(src, swid)] = (time.time(), port)
+        if (swid, port) not in self.switch_ports:
+            self.add_switch_port(swid, port)
+        if self.shards.get('links', sharding.key(src, swid)) != src_port:
+            self.shards.put('links', sharding.key(src, swid), src_port)
+            self.link_ports[(src, swid)] = src_port
+            self.shard_link(None, src_port, None)
+
+    def expire_remote_links(self):
+        while True:
+            now = time.time()
+            for (src, dst), (seen, port) in list(self.remote_links.items()):
+                if now - seen > self.remote_link_timeout:
+                    del self.remote_links[(src, dst)]
+                    self.switch_ports.discard((dst, port))
+                    self.shards.put('links', sharding.key(src, dst), None)
+                    self.shard_link(None, None, None)
+            hub.sleep(self.remote_link_timeout / 2.0)
+
+    # hops on OFSs of other shards: their owners install the flows, the
+    # packet goes out once all of them acknowledged (after shard_timeout
+    # at the latest; a hop that missed it raises its own Packet-In)
+    def shard_provision(self, remote, dmac, dp, out, started):
+        self.shard_requests += 1
+        req = self.shard_requests
+        self.pending_outs[req] = [dp, out, started, len(remote)]
+        for hop, hop_in, hop_out in remote:
+            self.shards.send(self.shards.owner(hop), 'install', req=req, dpid=hop, mac=dmac,
+                             in_port=hop_in, out_port=hop_out)
+        hub.spawn_after(self.shard_timeout, self.release_packet, req)
+
+    def shard_install(self, message):
+        dp = get_datapath(self, message['dpid'])
+        if dp is not None:
+            self.add_flow(dp, message['mac'], message['in_port'], message['out_port'])
+            self.batcher.flush(dp.id)
+        self.shards.send(message['from'], 'installed', req=message['req'])
+
+    def shard_installed(self, message):
+        pending = self.pending_outs.get(message['req'])
+        if pending is None:
+            return
+        pending[3] -= 1
+        if pending[3] <= 0:
+            self.release_packet(message['req'])
+
+    def release_packet(self, req):
+        pending = self.pending_outs.pop(req, None)
+        if pending is None:
+            return
+        dp, out, started, _ = pending
+        self.batcher.send(dp, out)
+        self.metrics.packet_out(dp, started)
+
+    #######################################
+    # Warm restart
+    def changed(self):
+        if self.checkpoint is not None:
+            self.checkpoint.mark()
+
+    def checkpoint_state(self):
+        return {'MAC_table': self.MAC_table, 'ARP_table': self.ARP_table,
+                'host_location': self.host_location, 'mac_cookies': self.mac_cookies,
+                'links': [[src, dst, port] for (src, dst), port in self.link_ports.items()],
+                'path_parents': self.path_parents,
+                'blocked_ports': dict((swid, list(ports)) for swid, ports in self.blocked_ports.items())}
+
+    def restore(self, state):
+        if state is None:
+            return
+        self.MAC_table = state['MAC_table']
+        self.ARP_table = state['ARP_table']
+        self.host_location = dict((mac, tuple(loc)) for mac, loc in state['host_location'].items())
+        self.mac_cookies = state['mac_cookies']
+        self.path_parents = state['path_parents']
+        self.blocked_ports = dict((swid, set(ports)) for swid, ports in state['blocked_ports'].items())
+        for src, dst, port in state['links']:
+            self.link_ports[(src, dst)] = port
+            self.restored_links[(src, dst)] = port
+            self.switch_ports.add((src, port))
+        self.restored = True
+        hub.spawn_after(self.restore_grace, self.drop_restored_links)
+        self.metrics.log('restored', hosts=len(self.host_location), links=len(self.restored_links),
+                         age='{:.1f}'.format(self.checkpoint.restored_age))
+
+    # links LLDP did not find again are gone
+    def drop_restored_links(self):
+        if not self.restored_links:
+            return
+        self.metrics.log('restored_links_dropped', links=len(self.restored_links))
+        for (src, dst), port in self.restored_links.items():
+            self.switch_ports.discard((src, port))
+        self.restored_links = {}
+        self.paths_stale = True
+        self.request_paths()
+        self.schedule_aggregates()
+
+    # Flows an OFS kept across the restart: counted for occupancy and
+    # eviction, recorded as owners/aggregates, and any restored host whose
+    # own edge OFS sends its traffic elsewhere is forgotten
+    def revalidate(self, msg):
+        dp = msg.datapath
+        ofp = dp.ofproto
+        ofp_parser = dp.ofproto_parser
+        swid = dp.id
+        if not (msg.flags or 0) & ofp.OFPMPF_REPLY_MORE:
+            self.revalidating.discard(swid)
+        stale = set()
+        for stat in msg.body:
+            if stat.priority == 0 or 'eth_dst' not in stat.match:
+                continue
+            ports = [action.port for inst in stat.instructions for action in getattr(inst, 'actions', [])
+                     if isinstance(action, ofp_parser.OFPActionOutput)]
+            if not ports:
+                continue
+            self.metrics.flow_found(dp, stat)
+            if stat.cookie == self.AGG_COOKIE:
+                value, mask = stat.match['eth_dst']
+                self.aggregates.setdefault(swid, set()).add(
+                    (int(value.replace(':', ''), 16), int(mask.replace(':', ''), 16), ports[0]))
+                continue
+            dmac = stat.match['eth_dst']
+            self.lifecycle.added(dp, stat)
+            self.flow_owners.setdefault(dmac, set()).add(swid)
+            location = self.host_location.get(dmac)
+            if location is not None and location[0] == swid and ports[0] != location[1]:
+                stale.add(dmac)
+        for dmac in stale:
+            self.metrics.log('restored_host_stale', dpid=swid, mac=dmac)
+            self.forget_host(dmac)
+
+    # same, but on the calling thread (debugging)
     def get_shortest_paths(self):
-        topo_raw_switches = get_switch(self, None)
-        topo_raw_links = get_link(self, None)
+        self.path_parents, self.link_ports, self.blocked_ports = compute_paths(*self.topology_snapshot())
+        return self.path_parents
 
-        links = {}
-        for switch in topo_raw_switches:
-            links[switch.dp.id] = []
-        
-        for link in topo_raw_links:
-            # link.src.dpid, link.dst.dpid
-            if link.dst.dpid not in links[link.src.dpid]:
-                links[link.src.dpid].append(link.dst.dpid)
-            if link.src.dpid not in links[link.dst.dpid]:
-                links[link.dst.dpid].append(link.src.dpid)
-        switches = [switch.dp.id for switch in topo_raw_switches]
-        
-        for i in switches: 
-            self.shortest_paths[i] = {}
-        for i in switches:
-            for j in switches:
-                if i != j:
-                    self.get_shortest_path(i, j, links)
-
-        return self.shortest_paths
-        
-          
-    # 2.1 : Find best route between pair of OFS:
-    def get_shortest_path(self, swid1, swid2, links):
-        '''return the shortest path from swid1 to swid2. '''
-
-        # exit early + get saved data if it already exists
-        if swid2 in self.shortest_paths[swid1]:
-            return self.shortest_paths[swid1][swid2]
-
-        visited = []
-        queue = [[swid1]]
-        while len(queue) > 0:
-            path = queue.pop(0)
-            swid = path[-1]
-            if swid not in visited:
-                neighbors = links[swid]
-                for neighbor in neighbors:
-                    new_path = list(path)
-                    new_path.append(neighbor)
-                    queue.append(new_path)
-                    if neighbor == swid2:
-                        self.shortest_paths[swid1][swid2] = new_path
-                        self.shortest_paths[swid2][swid1] = new_path[::-1]
-                        return new_path
-                visited.append(swid)
-        print ('Unable to find path from swid {} to swid {}'.format(swid1, swid2))
-        return None
 
-        
-        
+# 2.1 : BFS from every OFS. Runs in the route_jobs pool: plain data in,
+# plain data out. Returns (parents, link_ports, blocked): parents[swid1][swid2]
+# is the switch before swid2 on the path from swid1, link_ports[(swid1, swid2)]
+# the port on swid1 facing swid2, blocked[swid] the ports of swid on links
+# off the flooding tree (the BFS tree of the lowest dpid of each component).
+def compute_paths(switches, links):
+    neighbors = dict((swid, []) for swid in switches)
+    link_ports = {}
+    for src, dst, port in links:
+        link_ports[(src, dst)] = port
+        if src not in neighbors or dst not in neighbors:
+            continue
+        if dst not in neighbors[src]:
+            neighbors[src].append(dst)
+        if src not in neighbors[dst]:
+            neighbors[dst].append(src)
+
+    parents = {}
+    for root in switches:
+        parent = {root: None}
+        queue = collections.deque([root])
+        while queue:
+            swid = queue.popleft()
+            for neighbor in neighbors[swid]:
+                if neighbor not in parent:
+                    parent[neighbor] = swid
+                    queue.append(neighbor)
+        parents[root] = parent
+
+    tree = set()
+    for root in sorted(switches):
+        if any((root, other) in tree or (other, root) in tree for other in neighbors[root]):
+            continue    # component already spanned
+        for swid, parent in parents[root].items():
+            if parent is not None:
+                tree.add((parent, swid))
+                tree.add((swid, parent))
+    blocked = {}
+    for (src, dst), port in link_ports.items():
+        if (src, dst) not in tree:
+            blocked.setdefault(src, set()).add(port)
+    return parents, link_ports, blocked
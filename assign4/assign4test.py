@@ -3,6 +3,11 @@ import random as rnd
 import matplotlib.pyplot as plt
 import networkx as nx
 import csv
+import os
+import sys
+# RunningStat (and its T95 table) is assign1.py's, one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from assign1 import RunningStat
 def merge_disconnected_components(G):
     ''' If G has separated connected components, they must be merged to avoid
     gaining an incorrect result from shortest path computations. '''
@@ -256,33 +261,43 @@ def closestMtoMdistance(G):
             lowest = x
     return lowest
    
-def iteration(N, M, D, d_min, d_max, d_M, round_per_graph):
+def iteration(N, M, D, d_min, d_max, d_M, round_per_graph,
+              rel_err = 0.05, min_rounds = 3, max_rounds = 200):
     ''' N is a total number of node, M is a server node, D is a RGG's distance
     parameter, a uniform [d_max, d_min] is a generated data size to exchange, 
     d_M is the number of data generating servres, round_per_graph is the 
     number of iterations per a generated graph, and draw is to decide if the 
     graph is gerated or not. This is a variation of the above simulation meant 
-    to analyze the graph created. Four analysis functions are used 10 times to gain
-    the correct answer to the experimental set.''' 
+    to analyze the graph created. On each fresh graph the three deterministic
+    metrics are taken once and randomMtoMdistance is averaged over
+    round_per_graph rounds (rounds on one graph share it, so they aren't
+    independent samples), and graphs are made until the 95% confidence
+    interval of every metric, over the per-graph values, is within rel_err of
+    its mean, or after max_rounds (in whole graphs). Returns [furthest, random,
+    center, closest, M, N] means followed by the four CI half widths, the
+    rounds and the graphs used.''' 
     print("-- (N, M) = (" + str(N) + ", " + str(M) + ")", "D =", D,
           "data =[" + str(d_min) + " ," + str(d_max) + "]",
           "Data Senders =", d_M, "Per Graph =", round_per_graph)
-    answerlist = [0 for i in range(6)]
-    G = generate_graph(N, M, D)
-    G = reduce_graph(G, M, False)
-    for i in range(10):
-        answerlist[1] += randomMtoMdistance(G)
-    answerlist[0] = distancefromnodes(G,furthestfromMnodes(G))
-    answerlist[1] = answerlist[1]/10
-    answerlist[2] = distancefromnodes(G,find_center_node(G)[0])
-    answerlist[3] = distancefromnodes(G,closestMtoMdistance(G))
-    answerlist[5] = N
-    answerlist[4] = M
-    return answerlist
+    stats = [RunningStat() for i in range(4)]
+    rounds = graphs = 0
+    while rounds < max_rounds and (rounds < min_rounds or
+                                   not all(st.converged(rel_err) for st in stats)):
+        G = generate_graph(N, M, D)
+        G = reduce_graph(G, M, False)
+        stats[0].add(distancefromnodes(G,furthestfromMnodes(G)))
+        stats[2].add(distancefromnodes(G,find_center_node(G)[0]))
+        stats[3].add(distancefromnodes(G,closestMtoMdistance(G)))
+        stats[1].add(sum(randomMtoMdistance(G) for r in range(round_per_graph)) / round_per_graph)
+        graphs += 1
+        rounds += round_per_graph
+    print("   rounds =", rounds, "graphs =", graphs, " ".join(
+          "%.1f+-%.1f" % (st.mean, st.ci()) for st in stats))
+    return [st.mean for st in stats] + [M, N] + [st.ci() for st in stats] + [rounds, graphs]
     
 def assignment():
-    '''Runs the above iteration code 10 x 10 x 4 times of different variations. Answers returned are added to an array,
-    which is then written to a csv as the answer.'''
+    '''Runs the above iteration code 10 x 4 times of different variations, each for as many rounds as it needs.
+    Answers returned are added to an array, which is then written to a csv as the answer.'''
     answerlist = [0 for row in range(40)]
     for x in range(0,10):
         M = (x+1)*10
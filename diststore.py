@@ -0,0 +1,162 @@
+# Disk-backed hop-count matrix for graphs whose all-pairs distances don't
+# fit in memory: N = 50k is 5 GB as uint16 on disk, against tens of GB for
+# the floyd_warshall dict find_center_node() builds. Rows are written block
+# by block into a numpy memmap (.npy) by BFS worker processes (bfs_block()
+# in placement.py), and the per-node metrics are streamed over row chunks:
+#
+#   store = DistanceStore.build('/var/tmp/dist.npy', G, workers = 4)
+#   store.sums(cols = arr)                    # per node: sum of hops to arr
+#   store.argmin('max')                       # center: smallest eccentricity
+#   store.argmax('sum', cols = arr, rows = range(M, N))
+#
+# memory (bytes) caps what one process holds at a time: a worker's BFS
+# block while building, a row chunk while reducing.
+import multiprocessing
+
+import numpy as np
+
+import placement
+
+
+def block_words(order, targets, memory):
+    ''' bfs_block() words (64 sources each) that fit in memory bytes: per
+    word it holds 4 bit rows per node and 16 bit planes plus the unpacked
+    distances per target '''
+    per_word = 32 * order + 576 * targets
+    return int(max(1, min(16, memory // per_word)))
+
+
+# BFS worker state, set once per process by _init_worker()
+_job = {}
+
+def _init_worker(path, offset, columns, order, src, tgt, words):
+    _job.update(path = path, offset = offset, columns = columns, order = order,
+                src = src, tgt = tgt, words = words)
+
+def _fill_block(start):
+    # map just this block's rows, so written pages don't pile up in the worker
+    src = _job['src'][start:start + 64 * _job['words']]
+    rows = np.memmap(_job['path'], dtype = np.uint16, mode = 'r+',
+                     offset = _job['offset'] + start * len(_job['tgt']) * 2,
+                     shape = (len(src), len(_job['tgt'])))
+    rows[:] = placement.bfs_block(_job['columns'], _job['order'], src, _job['tgt'], _job['words'])
+    rows.flush()
+    del rows
+    return start
+
+
+class DistanceStore(object):
+    ''' Hop counts from nodes (rows) to targets (columns, the same nodes by
+    default) in a uint16 .npy file opened as a memmap; UNREACHABLE
+    (65535) where there is no path. Rows and columns are addressed by
+    node label. Rows are contiguous on disk; a column is a strided read
+    of every row, so column() reads the row instead when the store is
+    symmetric. sums()/maxes() reduce each row over a set of columns, and
+    argmin()/argmax() pick the best row by such a reduction, in row
+    chunks of at most memory bytes, each mapped only while it is reduced,
+    never loading the whole matrix. '''
+
+    def __init__(self, path, nodes, targets = None, mode = 'r', memory = 256 << 20):
+        self.path = path
+        self.nodes = list(nodes)
+        self.targets = self.nodes if targets is None else list(targets)
+        self.row_of = {n: i for i, n in enumerate(self.nodes)}
+        self.col_of = {n: i for i, n in enumerate(self.targets)}
+        self.symmetric = self.targets == self.nodes
+        self.memory = memory
+        self.D = np.load(path, mmap_mode = mode)
+        self.offset = self.D.offset
+        assert self.D.shape == (len(self.nodes), len(self.targets)), "<FATAL> DistanceStore(): shape"
+
+    @classmethod
+    def build(cls, path, G, nodes = None, targets = None, workers = None, memory = 256 << 20):
+        ''' BFS from every node (all of G by default) into a new store at
+        path, with workers processes (default: one per CPU), each holding
+        at most about memory bytes '''
+        nodes = list(G) if nodes is None else list(nodes)
+        targets = nodes if targets is None else list(targets)
+        D = np.lib.format.open_memmap(path, mode = 'w+', dtype = np.uint16,
+                                      shape = (len(nodes), len(targets)))
+        offset = D.offset
+        del D
+        order, index, columns = placement.adjacency(G)
+        src = np.array([index[n] for n in nodes], dtype = np.int64)
+        tgt = np.array([index[n] for n in targets], dtype = np.int64)
+        words = block_words(len(order), len(tgt), memory)
+        starts = range(0, len(src), 64 * words)
+        args = (path, offset, columns, len(order), src, tgt, words)
+        workers = workers or multiprocessing.cpu_count()
+        if workers == 1 or len(starts) == 1:
+            _init_worker(*args)
+            for start in starts: _fill_block(start)
+            _job.clear()
+        else:
+            with multiprocessing.Pool(min(workers, len(starts)), _init_worker, args) as pool:
+                for _ in pool.imap_unordered(_fill_block, starts): pass
+        return cls(path, nodes, targets, 'r', memory)
+
+    def row(self, n, cols = None):
+        i = self.row_of[n]
+        if cols is None: return np.array(self.D[i])
+        return self.D[i, [self.col_of[c] for c in cols]]
+
+    def column(self, n, rows = None):
+        if self.symmetric: return self.row(n, rows)
+        j = self.col_of[n]
+        if rows is None: return np.array(self.D[:, j])
+        return self.D[[self.row_of[r] for r in rows], j]
+
+    def chunks(self, rows = None, cols = None):
+        ''' (row positions, uint16 block) over the rows (all by default),
+        restricted to cols, at most memory bytes per block '''
+        rows = np.arange(len(self.nodes)) if rows is None else \
+               np.sort([self.row_of[r] for r in rows]).astype(np.int64)
+        cols = None if cols is None else np.array([self.col_of[c] for c in cols], dtype = np.int64)
+        contiguous = len(rows) == 0 or rows[-1] - rows[0] + 1 == len(rows)
+        # whole rows are paged in (or copied) before the columns are picked
+        step = max(1, self.memory // (4 * max(len(self.targets), 1)))
+        for k in range(0, len(rows), step):
+            pos = rows[k:k + step]
+            if contiguous:
+                block = np.memmap(self.path, dtype = np.uint16, mode = 'r',
+                                  offset = self.offset + int(pos[0]) * len(self.targets) * 2,
+                                  shape = (len(pos), len(self.targets)))
+            else:
+                block = self.D[pos]
+            yield pos, (block if cols is None else block[:, cols])
+            del block
+
+    def reduce(self, op, rows = None, cols = None):
+        ''' per row (positions, values) of op ('sum' or 'max') over cols '''
+        assert op in ('sum', 'max'), "<FATAL> DistanceStore.reduce(): unknown op " + str(op)
+        for pos, block in self.chunks(rows, cols):
+            if op == 'sum': yield pos, block.sum(axis = 1, dtype = np.int64)
+            else: yield pos, block.max(axis = 1).astype(np.int64)
+
+    # per row sums/maxes over cols, in the order of rows (the store's by default)
+    def sums(self, cols = None, rows = None):
+        return self._per_row('sum', cols, rows)
+
+    def maxes(self, cols = None, rows = None):
+        return self._per_row('max', cols, rows)
+
+    def _per_row(self, op, cols, rows):
+        values = np.concatenate([v for _, v in self.reduce(op, rows, cols)] or [np.zeros(0, np.int64)])
+        if rows is None: return values
+        # chunks() walks the rows sorted by position; put them back
+        out = np.empty_like(values)
+        out[np.argsort([self.row_of[r] for r in rows], kind = 'stable')] = values
+        return out
+
+    def argmin(self, op, cols = None, rows = None, sign = 1):
+        ''' [node, value] of the row with the smallest op over cols (first
+        one in row order on ties) '''
+        best = [None, None]
+        for pos, values in self.reduce(op, rows, cols):
+            i = int(np.argmin(sign * values))
+            if best[0] is None or sign * values[i] < sign * best[1]:
+                best = [self.nodes[pos[i]], int(values[i])]
+        return best
+
+    def argmax(self, op, cols = None, rows = None):
+        return self.argmin(op, cols, rows, sign = -1)
@@ -0,0 +1,778 @@
+# In-process data-plane emulator: stands in for Mininet + OVS so a Ryu app
+# can be run against thousands of switches without root or a kernel datapath.
+#
+#   python emunet.py --app Chap5-Student-pkg/Chap5-Student-pkg/ryu/NetworkX.py --NumOFS 1000 --NumHost 1 --pings 2000
+#   python emunet.py --app assign3/switch_ofp1_3.py --topo fattree --k 8 --NumHost 1
+#
+# The network is a discrete-event model (simulated time, heap of events):
+#   - links have the TCLink parameters bw (Mbit/s), delay and loss (%)
+#   - switches have one flow table (priorities, idle/hard timeouts, cookies),
+#     groups (SELECT/FF/ALL/INDIRECT), meters and per-port counters
+#   - the controller channel is a local loopback: the app writes OpenFlow 1.3
+#     bytes (send_msg/send), the switch splits them on the OpenFlow headers
+#     and takes each message body from the object registered under its xid
+#     (Ryu has no parsers for most controller-to-switch messages);
+#     switch-to-controller messages are delivered as ofp_event events
+import argparse
+import contextlib
+import heapq
+import io
+import os
+import random as rnd
+import sys
+import time
+
+from ryu.lib import hub
+from ryu.lib.packet import packet, ethernet, arp, ipv4, icmp
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser, ofproto_parser
+from ryu.controller import ofp_event
+from ryu.controller.handler import MAIN_DISPATCHER
+from ryu.topology import event, switches
+
+from replay_harness import load_app, patch_topology_api
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'Chap5-Student-pkg', 'Chap5-Student-pkg', 'mininet'))
+import topolib
+
+#Link parameter, same as customtopo.py
+linkopts1 = dict(bw=100,  delay='1ms') #Host link
+linkopts2 = dict(bw=1000, delay='3ms') #Switch Link
+linkopts3 = dict(loss=10, bw=1000, delay='3ms') #Switch Link, link loss=10%
+
+ofp = ofproto_v1_3
+ofp_parser = ofproto_v1_3_parser
+MAC_FIELDS = ('eth_dst', 'eth_src')
+
+
+def mac_to_int(mac):
+    return int(mac.replace(':', ''), 16)
+
+
+def parse_delay(delay):
+    ''' '3ms' -> 0.003 '''
+    if isinstance(delay, (int, float)):
+        return float(delay)
+    for unit, scale in (('us', 1e-6), ('ms', 1e-3), ('s', 1.0)):
+        if delay.endswith(unit):
+            return float(delay[:-len(unit)]) * scale
+    return float(delay)
+
+
+##########################################################################################
+#Topology, same API as mininet.topo.Topo
+class EmuTopo(object):
+    def __init__(self):
+        self.hosts = []       # (name, ip)
+        self.switches = []    # name
+        self.links = []       # (node1, node2, opts)
+
+    def addHost(self, name, ip=None, **opts):
+        self.hosts.append((name, ip))
+        return name
+
+    def addSwitch(self, name, **opts):
+        self.switches.append(name)
+        return name
+
+    def addLink(self, node1, node2, **opts):
+        self.links.append((node1, node2, opts))
+
+
+class MyTopo(EmuTopo):
+    ''' Ring of noOFS switches with noHost hosts each, as MyTopo in customtopo.py '''
+    def __init__(self, noOFS=1, noHost=1):
+        EmuTopo.__init__(self)
+        Host = []
+        OFS  = []
+        for i in range(noOFS*noHost):
+            Host.append(self.addHost("h{}".format(i+1), ip="10.{}.{}.{}".format(
+                ((i+1) >> 16) & 0xff, ((i+1) >> 8) & 0xff, (i+1) & 0xff)))
+        for i in range(noOFS):
+            OFS.append(self.addSwitch("s{}".format(i+1)))
+        for i in range(noOFS):
+            for j in range(noHost):
+                self.addLink(Host[i*noHost+j],OFS[i],**linkopts1)
+        for i in range(noOFS):
+            currOFS = OFS[i]
+            nextOFS = OFS[(i+1) % noOFS]
+            if currOFS != nextOFS:
+                self.addLink(currOFS,nextOFS,**linkopts2)
+
+
+##########################################################################################
+#Frames
+class Frame(object):
+    ''' Ethernet frame; kind is 'arp', 'echo-request', 'echo-reply' or 'data' '''
+    __slots__ = ('src', 'dst', 'eth_type', 'kind', 'arp_op', 'src_ip', 'dst_ip', 'size', 'born', 'seq')
+
+    def __init__(self, src, dst, kind, src_ip=None, dst_ip=None, arp_op=None, size=98, born=0.0, seq=0):
+        self.src = src
+        self.dst = dst
+        self.kind = kind
+        self.eth_type = 0x0806 if kind == 'arp' else 0x0800
+        self.arp_op = arp_op
+        self.src_ip = src_ip
+        self.dst_ip = dst_ip
+        self.size = size
+        self.born = born
+        self.seq = seq
+
+    def field(self, name):
+        if name == 'eth_dst':
+            return mac_to_int(self.dst)
+        if name == 'eth_src':
+            return mac_to_int(self.src)
+        if name == 'eth_type':
+            return self.eth_type
+        if name in ('ipv4_src', 'arp_spa'):
+            return self.src_ip
+        if name in ('ipv4_dst', 'arp_tpa'):
+            return self.dst_ip
+        if name == 'arp_op':
+            return self.arp_op
+        return None
+
+    def to_bytes(self):
+        pkt = packet.Packet()
+        pkt.add_protocol(ethernet.ethernet(dst=self.dst, src=self.src, ethertype=self.eth_type))
+        if self.kind == 'arp':
+            pkt.add_protocol(arp.arp(opcode=self.arp_op, src_mac=self.src, src_ip=self.src_ip,
+                                     dst_mac=self.dst if self.arp_op == arp.ARP_REPLY else '00:00:00:00:00:00',
+                                     dst_ip=self.dst_ip))
+        else:
+            pkt.add_protocol(ipv4.ipv4(src=self.src_ip, dst=self.dst_ip, proto=1))
+            type_ = icmp.ICMP_ECHO_REPLY if self.kind == 'echo-reply' else icmp.ICMP_ECHO_REQUEST
+            pkt.add_protocol(icmp.icmp(type_=type_, data=icmp.echo(seq=self.seq & 0xffff)))
+        pkt.serialize()
+        return bytes(pkt.data)
+
+    @classmethod
+    def from_bytes(cls, data, born=0.0):
+        pkt = packet.Packet(data)
+        eth = pkt.get_protocol(ethernet.ethernet)
+        arp_pkt = pkt.get_protocol(arp.arp)
+        if arp_pkt:
+            return cls(eth.src, eth.dst, 'arp', arp_pkt.src_ip, arp_pkt.dst_ip, arp_pkt.opcode,
+                       size=len(data), born=born)
+        ip = pkt.get_protocol(ipv4.ipv4)
+        icmp_pkt = pkt.get_protocol(icmp.icmp)
+        kind = 'data'
+        seq = 0
+        if icmp_pkt:
+            kind = 'echo-reply' if icmp_pkt.type == icmp.ICMP_ECHO_REPLY else 'echo-request'
+            seq = icmp_pkt.data.seq
+        return cls(eth.src, eth.dst, kind, ip.src if ip else None, ip.dst if ip else None,
+                   size=len(data), born=born, seq=seq)
+
+
+##########################################################################################
+#Nodes
+class EmuPort(object):
+    def __init__(self, port_no, name, hw_addr):
+        self.port_no = port_no
+        self.name = name
+        self.hw_addr = hw_addr
+        self.config = 0
+        self.state = ofp.OFPPS_LIVE
+        self.peer = None      # (node, port_no)
+        self.link = None      # (bw bit/s, delay s, loss fraction)
+        self.busy_until = 0.0
+        self.rx_packets = self.tx_packets = self.rx_bytes = self.tx_bytes = 0
+        self.tx_dropped = 0
+
+    def is_up(self):
+        return not (self.state & ofp.OFPPS_LINK_DOWN) and not (self.config & ofp.OFPPC_PORT_DOWN)
+
+    def ofpport(self):
+        return ofp_parser.OFPPort(self.port_no, self.hw_addr, self.name, self.config, self.state,
+                                  0, 0, 0, 0, 0, 0)
+
+
+class EmuHost(object):
+    def __init__(self, net, name, mac, ip):
+        self.net = net
+        self.name = name
+        self.mac = mac
+        self.ip = ip
+        self.ports = {}
+        self.arp_cache = {}
+        self.waiting = {}     # IP -> frames waiting for ARP resolution
+        self.received = 0
+        self.rtts = []
+
+    def send(self, frame):
+        self.net.transmit(self, 1, frame)
+
+    def ping(self, dst_ip, seq=0):
+        frame = Frame(self.mac, None, 'echo-request', self.ip, dst_ip, born=self.net.now, seq=seq)
+        self.send_ip(frame)
+
+    def send_ip(self, frame):
+        if frame.dst_ip in self.arp_cache:
+            frame.dst = self.arp_cache[frame.dst_ip]
+            self.send(frame)
+            return
+        if frame.dst_ip not in self.waiting:
+            self.send(Frame(self.mac, 'ff:ff:ff:ff:ff:ff', 'arp', self.ip, frame.dst_ip, arp.ARP_REQUEST,
+                            size=42, born=self.net.now))
+        self.waiting.setdefault(frame.dst_ip, []).append(frame)
+
+    def receive(self, frame, port_no):
+        if frame.dst != self.mac and frame.dst != 'ff:ff:ff:ff:ff:ff':
+            return
+        if frame.kind == 'arp':
+            self.arp_cache[frame.src_ip] = frame.src
+            if frame.arp_op == arp.ARP_REQUEST and frame.dst_ip == self.ip:
+                self.send(Frame(self.mac, frame.src, 'arp', self.ip, frame.src_ip, arp.ARP_REPLY,
+                                size=42, born=self.net.now))
+            for waiting in self.waiting.pop(frame.src_ip, []):
+                waiting.dst = frame.src
+                self.send(waiting)
+            return
+        self.received += 1
+        if frame.kind == 'echo-request' and frame.dst_ip == self.ip:
+            self.send(Frame(self.mac, frame.src, 'echo-reply', self.ip, frame.src_ip,
+                            born=frame.born, seq=frame.seq))
+        elif frame.kind == 'echo-reply':
+            self.rtts.append(self.net.now - frame.born)
+
+
+class FlowEntry(object):
+    __slots__ = ('priority', 'fields', 'match', 'instructions', 'idle_timeout', 'hard_timeout',
+                 'cookie', 'flags', 'installed', 'last_used', 'packets', 'bytes')
+
+    def __init__(self, mod, now):
+        self.priority = mod.priority
+        self.match = mod.match
+        self.fields = compile_match(mod.match)
+        self.instructions = mod.instructions
+        self.idle_timeout = mod.idle_timeout
+        self.hard_timeout = mod.hard_timeout
+        self.cookie = mod.cookie
+        self.flags = mod.flags
+        self.installed = now
+        self.last_used = now
+        self.packets = 0
+        self.bytes = 0
+
+    def matches(self, frame, in_port):
+        for name, value, mask in self.fields:
+            if name == 'in_port':
+                if in_port != value:
+                    return False
+                continue
+            got = frame.field(name)
+            if got is None:
+                return False
+            if mask is None:
+                if got != value:
+                    return False
+            elif got & mask != value & mask:
+                return False
+        return True
+
+    def expired(self, now):
+        if self.idle_timeout and now - self.last_used >= self.idle_timeout:
+            return ofp.OFPRR_IDLE_TIMEOUT
+        if self.hard_timeout and now - self.installed >= self.hard_timeout:
+            return ofp.OFPRR_HARD_TIMEOUT
+        return None
+
+
+def compile_match(match):
+    ''' OFPMatch -> [(field, value, mask)] with MACs as ints '''
+    fields = []
+    for name, value in match.items():
+        mask = None
+        if isinstance(value, tuple):
+            value, mask = value
+        if name in MAC_FIELDS:
+            value = mac_to_int(value)
+            if mask is not None:
+                mask = mac_to_int(mask)
+        fields.append((name, value, mask))
+    return fields
+
+
+class EmuSwitch(object):
+    ''' One OFS. It is also the datapath object handed to the Ryu app. '''
+
+    def __init__(self, net, name, dpid):
+        self.net = net
+        self.name = name
+        self.id = dpid
+        self.ofproto = ofp
+        self.ofproto_parser = ofp_parser
+        self.is_active = True
+        self.address = ('127.0.0.1', 6653)
+        self.xid = 0
+        self.outstanding = {}  # xid -> message object written but not yet received
+        self.ports = {}
+        self.flows = []        # sorted by priority, highest first
+        self.groups = {}       # group id -> (type, buckets)
+        self.meters = {}       # meter id -> [rate, burst, tokens, last]
+        self.bundles = {}      # bundle id -> [messages]
+        self.max_flows = None
+        self.table_full = 0
+        self.lookups = 0
+        self.misses = 0
+
+    # controller -> switch (loopback channel)
+    def set_xid(self, msg):
+        self.xid = (self.xid + 1) & 0xffffffff
+        msg.set_xid(self.xid)
+        self.outstanding[self.xid] = msg
+        return self.xid
+
+    def send_msg(self, msg):
+        self.set_xid(msg)
+        msg.serialize()
+        self.send(msg.buf)
+
+    def send(self, buf):
+        self.net.schedule(self.net.ctl_delay, self.receive, bytes(buf))
+
+    def send_packet_out(self, buffer_id=0xffffffff, in_port=None, actions=None, data=None):
+        if in_port is None:
+            in_port = ofp.OFPP_CONTROLLER
+        self.send_msg(ofp_parser.OFPPacketOut(self, buffer_id, in_port, actions or [], data))
+
+    def receive(self, buf):
+        offset = 0
+        while offset < len(buf):
+            version, msg_type, msg_len, xid = ofproto_parser.header(buf[offset:])
+            msg = self.outstanding.pop(xid, None)
+            if msg is not None:
+                self.handle(msg)
+            offset += msg_len
+        self.net.counters['of_messages'] += 1
+
+    def handle(self, msg):
+        net = self.net
+        if isinstance(msg, ofp_parser.OFPFlowMod):
+            net.counters['flow_mods'] += 1
+            self.flow_mod(msg)
+        elif isinstance(msg, ofp_parser.OFPPacketOut):
+            net.counters['packet_outs'] += 1
+            frame = Frame.from_bytes(msg.data, net.now) if msg.data else None
+            if frame is not None:
+                self.apply_actions(frame, msg.in_port, msg.actions)
+        elif isinstance(msg, ofp_parser.OFPGroupMod):
+            if msg.command == ofp.OFPGC_DELETE:
+                self.groups.pop(msg.group_id, None)
+            else:
+                self.groups[msg.group_id] = (msg.type, msg.buckets)
+        elif isinstance(msg, ofp_parser.OFPMeterMod):
+            if msg.command == ofp.OFPMC_DELETE:
+                self.meters.pop(msg.meter_id, None)
+            else:
+                band = msg.bands[0]
+                self.meters[msg.meter_id] = [band.rate, max(band.burst_size, 1), band.burst_size, net.now]
+        elif isinstance(msg, ofp_parser.OFPPortMod):
+            port = self.ports.get(msg.port_no)
+            if port is not None:
+                port.config = (port.config & ~msg.mask) | (msg.config & msg.mask)
+        elif isinstance(msg, ofp_parser.OFPBarrierRequest):
+            net.to_controller(ofp_event.EventOFPBarrierReply(ofp_parser.OFPBarrierReply(self)))
+        elif isinstance(msg, ofp_parser.OFPPortStatsRequest):
+            reply = ofp_parser.OFPPortStatsReply(self)
+            reply.body = [ofp_parser.OFPPortStats(p.port_no, p.rx_packets, p.tx_packets, p.rx_bytes,
+                                                  p.tx_bytes, 0, p.tx_dropped, 0, 0, 0, 0, 0, 0,
+                                                  int(net.now), 0)
+                          for p in self.ports.values()]
+            net.to_controller(ofp_event.EventOFPPortStatsReply(reply))
+        elif isinstance(msg, ofp_parser.OFPFlowStatsRequest):
+            reply = ofp_parser.OFPFlowStatsReply(self)
+            reply.body = [ofp_parser.OFPFlowStats(0, int(net.now - f.installed), 0, f.priority,
+                                                  f.idle_timeout, f.hard_timeout, f.flags, f.cookie,
+                                                  f.packets, f.bytes, f.match, f.instructions)
+                          for f in self.flows]
+            net.to_controller(ofp_event.EventOFPFlowStatsReply(reply))
+        elif isinstance(msg, ofp_parser.ONFBundleCtrlMsg):
+            if msg.type == ofp.ONF_BCT_OPEN_REQUEST:
+                self.bundles[msg.bundle_id] = []
+            elif msg.type == ofp.ONF_BCT_COMMIT_REQUEST:
+                for inner in self.bundles.pop(msg.bundle_id, []):
+                    self.handle(inner)
+            elif msg.type == ofp.ONF_BCT_DISCARD_REQUEST:
+                self.bundles.pop(msg.bundle_id, None)
+        elif isinstance(msg, ofp_parser.ONFBundleAddMsg):
+            self.bundles.setdefault(msg.bundle_id, []).append(msg.message)
+
+    def flow_mod(self, mod):
+        now = self.net.now
+        if mod.command == ofp.OFPFC_ADD:
+            fields = compile_match(mod.match)
+            for i, f in enumerate(self.flows):
+                if f.priority == mod.priority and f.fields == fields:
+                    self.flows[i] = FlowEntry(mod, now)
+                    return
+            if self.max_flows is not None and len(self.flows) >= self.max_flows:
+                self.table_full += 1
+                return
+            entry = FlowEntry(mod, now)
+            i = 0
+            while i < len(self.flows) and self.flows[i].priority >= entry.priority:
+                i += 1
+            self.flows.insert(i, entry)
+        elif mod.command in (ofp.OFPFC_MODIFY, ofp.OFPFC_MODIFY_STRICT):
+            for f in self.selected(mod, mod.command == ofp.OFPFC_MODIFY_STRICT):
+                f.instructions = mod.instructions
+        elif mod.command in (ofp.OFPFC_DELETE, ofp.OFPFC_DELETE_STRICT):
+            for f in self.selected(mod, mod.command == ofp.OFPFC_DELETE_STRICT):
+                self.flows.remove(f)
+                self.flow_removed(f, ofp.OFPRR_DELETE)
+
+    def selected(self, mod, strict):
+        ''' flows a MODIFY/DELETE applies to '''
+        fields = compile_match(mod.match)
+        chosen = []
+        for f in self.flows:
+            if (f.cookie & mod.cookie_mask) != (mod.cookie & mod.cookie_mask):
+                continue
+            if strict:
+                if f.priority == mod.priority and f.fields == fields:
+                    chosen.append(f)
+            elif all(field in f.fields for field in fields):
+                chosen.append(f)
+        return chosen
+
+    def flow_removed(self, f, reason):
+        if f.flags & ofp.OFPFF_SEND_FLOW_REM:
+            now = self.net.now
+            msg = ofp_parser.OFPFlowRemoved(self, cookie=f.cookie, priority=f.priority, reason=reason,
+                                            table_id=0, duration_sec=int(now - f.installed),
+                                            duration_nsec=int((now - f.installed) % 1 * 1e9),
+                                            idle_timeout=f.idle_timeout, hard_timeout=f.hard_timeout,
+                                            packet_count=f.packets, byte_count=f.bytes, match=f.match)
+            self.net.to_controller(ofp_event.EventOFPFlowRemoved(msg))
+
+    def expire(self, now):
+        for f in list(self.flows):
+            reason = f.expired(now)
+            if reason is not None:
+                self.flows.remove(f)
+                self.flow_removed(f, reason)
+
+    # data plane
+    def receive_frame(self, frame, in_port):
+        self.lookups += 1
+        for f in self.flows:
+            if f.matches(frame, in_port):
+                f.last_used = self.net.now
+                f.packets += 1
+                f.bytes += frame.size
+                self.apply_instructions(frame, in_port, f.instructions)
+                return
+        # no table-miss flow: drop
+        self.misses += 1
+
+    def apply_instructions(self, frame, in_port, instructions):
+        for inst in instructions:
+            if isinstance(inst, ofp_parser.OFPInstructionMeter):
+                if not self.meter_allows(inst.meter_id):
+                    return
+            elif isinstance(inst, ofp_parser.OFPInstructionActions):
+                self.apply_actions(frame, in_port, inst.actions)
+
+    def meter_allows(self, meter_id):
+        meter = self.meters.get(meter_id)
+        if meter is None:
+            return True
+        rate, burst, tokens, last = meter
+        tokens = min(burst, tokens + (self.net.now - last) * rate)
+        meter[3] = self.net.now
+        if tokens >= 1:
+            meter[2] = tokens - 1
+            return True
+        meter[2] = tokens
+        self.net.counters['meter_drops'] += 1
+        return False
+
+    def apply_actions(self, frame, in_port, actions):
+        for action in actions:
+            if isinstance(action, ofp_parser.OFPActionOutput):
+                self.output(frame, in_port, action.port)
+            elif isinstance(action, ofp_parser.OFPActionGroup):
+                self.apply_group(frame, in_port, action.group_id)
+
+    def apply_group(self, frame, in_port, group_id):
+        if group_id not in self.groups:
+            return
+        type_, buckets = self.groups[group_id]
+        live = [b for b in buckets if b.watch_port in (ofp.OFPP_ANY, None) or
+                (b.watch_port in self.ports and self.ports[b.watch_port].is_up())]
+        if not live:
+            return
+        if type_ == ofp.OFPGT_ALL:
+            chosen = live
+        elif type_ == ofp.OFPGT_SELECT:
+            total = sum(max(b.weight, 1) for b in live)
+            pick = hash((frame.src, frame.dst)) % total
+            for b in live:
+                pick -= max(b.weight, 1)
+                if pick < 0:
+                    chosen = [b]
+                    break
+        else:   # FF, INDIRECT: first live bucket
+            chosen = live[:1]
+        for b in chosen:
+            self.apply_actions(frame, in_port, b.actions)
+
+    def output(self, frame, in_port, port_no):
+        if port_no == ofp.OFPP_CONTROLLER:
+            self.packet_in(frame, in_port)
+        elif port_no in (ofp.OFPP_FLOOD, ofp.OFPP_ALL):
+            # OpenFlow 1.3 has no OFPPC_NO_FLOOD: both mean every other port
+            for p in self.ports.values():
+                if p.port_no != in_port:
+                    self.net.transmit(self, p.port_no, frame)
+        elif port_no == ofp.OFPP_IN_PORT:
+            self.net.transmit(self, in_port, frame)
+        elif port_no == ofp.OFPP_TABLE:
+            self.receive_frame(frame, in_port)
+        elif port_no != in_port and port_no in self.ports:
+            self.net.transmit(self, port_no, frame)
+
+    def packet_in(self, frame, in_port):
+        data = frame.to_bytes()
+        msg = ofp_parser.OFPPacketIn(self, buffer_id=ofp.OFP_NO_BUFFER, total_len=len(data),
+                                     reason=ofp.OFPR_NO_MATCH, table_id=0, cookie=0,
+                                     match=ofp_parser.OFPMatch(in_port=in_port), data=data)
+        self.net.counters['packet_ins'] += 1
+        self.net.to_controller(ofp_event.EventOFPPacketIn(msg))
+
+
+##########################################################################################
+#Network
+class EmuNet(object):
+    def __init__(self, topo, app_path, ctl_delay=0.0005, seed=None, verbose=False):
+        self.rnd = rnd.Random(seed)
+        self.now = 0.0
+        self.events = []
+        self.seq = 0
+        self.ctl_delay = ctl_delay
+        self.verbose = verbose
+        self.counters = {'packet_ins': 0, 'flow_mods': 0, 'packet_outs': 0, 'of_messages': 0,
+                         'frames': 0, 'lost': 0, 'meter_drops': 0, 'events': 0}
+        self.hosts = {}
+        self.switches = {}
+        self.build(topo)
+        self.module, self.app, self.handlers = load_app(app_path)
+        patch_topology_api(self.module, self.get_datapath, self.get_switch, self.get_link)
+
+    def build(self, topo):
+        for i, (name, ip) in enumerate(topo.hosts):
+            h = i + 1
+            mac = '00:00:00:{:02x}:{:02x}:{:02x}'.format((h >> 16) & 0xff, (h >> 8) & 0xff, h & 0xff)
+            self.hosts[name] = EmuHost(self, name, mac, ip or '10.0.0.{}'.format(h))
+        for name in topo.switches:
+            dpid = int(''.join(c for c in name if c.isdigit()) or len(self.switches) + 1)
+            self.switches[name] = EmuSwitch(self, name, dpid)
+        self.by_dpid = dict((sw.id, sw) for sw in self.switches.values())
+        for n1, n2, opts in topo.links:
+            a = self.node(n1)
+            b = self.node(n2)
+            pa = self.add_port(a)
+            pb = self.add_port(b)
+            link = (opts.get('bw', 1000) * 1e6, parse_delay(opts.get('delay', 0)), opts.get('loss', 0) / 100.0)
+            pa.peer, pa.link = (b, pb.port_no), link
+            pb.peer, pb.link = (a, pa.port_no), link
+
+    def node(self, name):
+        return self.hosts.get(name) or self.switches[name]
+
+    def add_port(self, node):
+        port_no = len(node.ports) + 1
+        dpid = getattr(node, 'id', 0)
+        port = EmuPort(port_no, '{}-eth{}'.format(node.name, port_no),
+                       '02:{:02x}:{:02x}:{:02x}:{:02x}:{:02x}'.format((dpid >> 24) & 0xff, (dpid >> 16) & 0xff,
+                                                                (dpid >> 8) & 0xff, dpid & 0xff, port_no & 0xff))
+        node.ports[port_no] = port
+        return port
+
+    # event loop
+    def schedule(self, delay, func, *args):
+        self.seq += 1
+        heapq.heappush(self.events, (self.now + delay, self.seq, func, args))
+
+    def run(self, until=None):
+        while self.events:
+            t, _, func, args = self.events[0]
+            if until is not None and t > until:
+                break
+            heapq.heappop(self.events)
+            self.now = t
+            self.counters['events'] += 1
+            func(*args)
+        if until is not None:
+            self.now = max(self.now, until)
+
+    def transmit(self, node, port_no, frame):
+        port = node.ports.get(port_no)
+        if port is None or port.peer is None or not port.is_up():
+            return
+        bw, delay, loss = port.link
+        start = max(self.now, port.busy_until)
+        port.busy_until = start + frame.size * 8 / bw
+        port.tx_packets += 1
+        port.tx_bytes += frame.size
+        self.counters['frames'] += 1
+        if loss and self.rnd.random() < loss:
+            self.counters['lost'] += 1
+            return
+        peer, peer_port = port.peer
+        self.schedule(port.busy_until + delay - self.now, self.arrive, peer, peer_port, frame)
+
+    def arrive(self, node, port_no, frame):
+        port = node.ports[port_no]
+        if not port.is_up():
+            return
+        port.rx_packets += 1
+        port.rx_bytes += frame.size
+        if isinstance(node, EmuSwitch):
+            node.receive_frame(frame, port_no)
+        else:
+            node.receive(frame, port_no)
+
+    # controller side
+    def to_controller(self, ev):
+        self.schedule(self.ctl_delay, self.dispatch, ev)
+
+    def dispatch(self, ev):
+        with self.quiet():
+            for handler in self.handlers.get(type(ev), []):
+                handler(ev)
+            # let the app's green threads run and its batched writes go out
+            hub.sleep(0)
+            batcher = getattr(self.app, 'batcher', None)
+            if batcher is not None:
+                batcher.flush_all()
+
+    @contextlib.contextmanager
+    def quiet(self):
+        if self.verbose:
+            yield
+        else:
+            with contextlib.redirect_stdout(io.StringIO()):
+                yield
+
+    def sweep(self, interval=1.0):
+        for sw in self.switches.values():
+            sw.expire(self.now)
+        # keep sweeping while there is traffic or a flow left to time out
+        if self.events or any(f.idle_timeout or f.hard_timeout
+                              for sw in self.switches.values() for f in sw.flows):
+            self.schedule(interval, self.sweep, interval)
+
+    # topology API replacements for the app
+    def get_datapath(self, app, dpid=None):
+        if dpid is None:
+            return list(self.by_dpid.values())
+        return self.by_dpid.get(dpid)
+
+    def get_switch(self, app, dpid=None):
+        result = []
+        for sw in self.by_dpid.values():
+            if dpid is None or sw.id == dpid:
+                ryu_sw = switches.Switch(sw)
+                for p in sw.ports.values():
+                    ryu_sw.add_port(p.ofpport())
+                result.append(ryu_sw)
+        return result
+
+    def get_link(self, app, dpid=None):
+        links = []
+        for sw in self.by_dpid.values():
+            if dpid is not None and sw.id != dpid:
+                continue
+            for p in sw.ports.values():
+                if p.peer is None or not isinstance(p.peer[0], EmuSwitch) or not p.is_up():
+                    continue
+                peer, peer_port = p.peer
+                links.append(switches.Link(switches.Port(sw.id, ofp, p.ofpport()),
+                                           switches.Port(peer.id, ofp, peer.ports[peer_port].ofpport())))
+        return links
+
+    def start(self):
+        ''' switch handshake and topology discovery (as with --observe-links) '''
+        for sw in self.by_dpid.values():
+            ev = ofp_event.EventOFPStateChange(sw)
+            ev.state = MAIN_DISPATCHER
+            self.dispatch(ev)
+            self.dispatch(ofp_event.EventOFPSwitchFeatures(
+                ofp_parser.OFPSwitchFeatures(sw, sw.id, 0, 254, 0, 0)))
+        for ryu_sw in self.get_switch(self.app):
+            self.dispatch(event.EventSwitchEnter(ryu_sw))
+        for link in self.get_link(self.app):
+            self.dispatch(event.EventLinkAdd(link))
+        self.schedule(1.0, self.sweep, 1.0)
+        self.run(until=self.now + 0.01)
+
+    def link_down(self, name1, name2):
+        ''' like "link s1 s2 down" in the Mininet CLI '''
+        a = self.node(name1)
+        for p in a.ports.values():
+            if p.peer is not None and p.peer[0].name == name2:
+                peer, peer_port = p.peer
+                for node, port in ((a, p), (peer, peer.ports[peer_port])):
+                    port.state = ofp.OFPPS_LINK_DOWN
+                    if isinstance(node, EmuSwitch):
+                        msg = ofp_parser.OFPPortStatus(node, ofp.OFPPR_MODIFY, port.ofpport())
+                        self.to_controller(ofp_event.EventOFPPortStatus(msg))
+                if isinstance(a, EmuSwitch) and isinstance(peer, EmuSwitch):
+                    pa = switches.Port(a.id, ofp, p.ofpport())
+                    pb = switches.Port(peer.id, ofp, peer.ports[peer_port].ofpport())
+                    self.to_controller(event.EventLinkDelete(switches.Link(pa, pb)))
+                    self.to_controller(event.EventLinkDelete(switches.Link(pb, pa)))
+                return
+
+
+##########################################################################################
+#Main function:
+def main(*args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--app', action="store", default='Chap5-Student-pkg/Chap5-Student-pkg/ryu/NetworkX.py')
+    parser.add_argument('--NumOFS',  type=int, action="store", default=4)
+    parser.add_argument('--NumHost', type=int, action="store", default=2)
+    parser.add_argument('--pings', type=int, action="store", default=100)
+    parser.add_argument('--interval', type=float, action="store", default=0.001)
+    parser.add_argument('--seed', type=int, action="store", default=None)
+    parser.add_argument('--verbose', action="store_true")
+    topolib.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.topo == 'ring' and not args.load and not args.save:
+        topo = MyTopo(args.NumOFS, args.NumHost)
+    else:
+        topo = topolib.from_args(args).build(EmuTopo(), args.NumHost)
+    wall = time.time()
+    net = EmuNet(topo, args.app, seed=args.seed, verbose=args.verbose)
+    net.start()
+    setup = time.time() - wall
+
+    hosts = list(net.hosts.values())
+    for n in range(args.pings):
+        src, dst = net.rnd.sample(hosts, 2)
+        net.schedule(n * args.interval, src.ping, dst.ip, n)
+    wall = time.time()
+    net.run(until=net.now + args.pings * args.interval + 10)
+    elapsed = time.time() - wall
+
+    rtts = sorted(r for h in hosts for r in h.rtts)
+    print("-- (NumOFS, NumHost) = ({}, {}), topo = {}, app = {}".format(
+        len(net.switches), args.NumHost, args.load or args.topo, args.app))
+    print("   setup = {:.2f}s, run = {:.2f}s wall for {:.3f}s simulated, {} events".format(
+        setup, elapsed, net.now, net.counters['events']))
+    print("   pings answered = {}/{}".format(len(rtts), args.pings))
+    if rtts:
+        print("   rtt (ms): p50 = {:.2f}, p99 = {:.2f}".format(rtts[len(rtts) // 2] * 1e3,
+                                                               rtts[int(len(rtts) * 0.99)] * 1e3))
+    for name, count in sorted(net.counters.items()):
+        print("   {} = {}".format(name, count))
+    print("   flow entries = {}".format(sum(len(sw.flows) for sw in net.switches.values())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+# Placement of k aggregation points on the (reduced) server graph: every
+# data sender ships its data to the closest aggregator, and we pick the k
+# aggregators among the servers so that either the total (k-median) or the
+# largest (k-center) sender-to-aggregator distance is small. This is the
+# k-point version of find_center_node() in assign1.py/assign4.py.
+#
+#   import placement
+#   D = placement.distance_matrix(G, senders, servers)
+#   aggs, rep = placement.k_median(D, 10)        # rep['total'], rep['max']
+#   aggs, rep = placement.k_center(D, 10)
+#   servers[aggs] ...                            # columns -> graph nodes
+#
+#   python placement.py [M] [k]                  # benchmark, default 10000 100
+import sys
+import time
+
+import numpy as np
+
+UNREACHABLE = np.iinfo(np.uint16).max
+
+
+def adjacency(G):
+    ''' G's nodes ordered by degree (high first), their positions, and the
+    neighbor columns bfs_block() walks: column j holds the position of the
+    j-th neighbor of every node that has one, i.e. of a prefix of nodes. '''
+    nodes = sorted(G, key = lambda n: len(G[n]) - (n in G[n]), reverse = True)
+    index = {n: i for i, n in enumerate(nodes)}
+    nbrs = [[index[m] for m in G[n] if m != n] for n in nodes]
+    columns = []
+    while nbrs and len(nbrs[0]) > len(columns):
+        j = len(columns)
+        columns.append(np.array([l[j] for l in nbrs if len(l) > j], dtype = np.int64))
+    return nodes, index, columns
+
+
+def bfs_block(columns, order, src, tgt, words = 16):
+    ''' Hop counts (uint16, UNREACHABLE when there is no path) from up to
+    64 * words sources to the targets, src/tgt being positions from
+    adjacency() over order nodes. This is a bit-parallel BFS: one bit per
+    source in each node's visited/frontier words, so a BFS level is one
+    gather + OR over the edges for all of them. The distances are kept
+    bit-sliced too (bit j of the level a target was reached at goes to
+    plane j) and unpacked once at the end, a plane at a time. '''
+    b = np.arange(len(src))
+    frontier = np.zeros((order, words), dtype = np.uint64)
+    np.bitwise_or.at(frontier, (src, b // 64),
+                     np.left_shift(np.uint64(1), (b % 64).astype(np.uint64)))
+    visited = frontier.copy()
+    planes = np.zeros((16, len(tgt), words), dtype = np.uint64)
+    level = 0
+    while True:
+        reached = np.zeros_like(frontier)
+        for col in columns:
+            reached[:len(col)] |= np.take(frontier, col, axis = 0)
+        frontier = reached & ~visited
+        if not frontier.any(): break
+        visited |= frontier
+        level += 1
+        assert level < UNREACHABLE, "<FATAL> bfs_block(): graph too deep for uint16"
+        fresh = np.take(frontier, tgt, axis = 0)
+        for j in range(level.bit_length()):
+            if level >> j & 1: planes[j] |= fresh
+    planes |= ~np.take(visited, tgt, axis = 0)     # never reached -> UNREACHABLE
+    d = np.zeros((len(tgt), len(src)), dtype = np.uint16)
+    for j in range(16):
+        bits = np.unpackbits(planes[j].view(np.uint8), axis = 1, bitorder = 'little')
+        d |= bits[:, :len(src)].astype(np.uint16) << np.uint16(j)
+    return d.T
+
+
+def distance_matrix(G, sources, targets = None, words = 16):
+    ''' Hop counts from sources (rows) to targets (columns) in G, as a
+    uint16 matrix (UNREACHABLE when there is no path), 64 * words sources
+    per bfs_block(). Nodes are ordered by degree so that the neighbor
+    gathers are plain fancy indexing. For matrices bigger than memory see
+    diststore.py. '''
+    if targets is None: targets = sources
+    nodes, index, columns = adjacency(G)
+    src = np.array([index[n] for n in sources], dtype = np.int64)
+    tgt = np.array([index[n] for n in targets], dtype = np.int64)
+    dist = np.empty((len(src), len(tgt)), dtype = np.uint16)
+    step = 64 * words
+    for start in range(0, len(src), step):
+        dist[start:start + step] = bfs_block(columns, len(nodes), src[start:start + step], tgt, words)
+    return dist
+
+
+def nearest_two(D, open_cols):
+    ''' Distance to the closest and second closest open column per row, and
+    the position in open_cols of the closest. '''
+    Dk = D[:, open_cols].astype(np.float32)
+    if len(open_cols) == 1:
+        return Dk[:, 0], np.full(len(D), np.inf, dtype = np.float32), np.zeros(len(D), dtype = np.int64)
+    part = np.argpartition(Dk, 1, axis = 1)[:, :2]
+    rows = np.arange(len(D))
+    a, b = Dk[rows, part[:, 0]], Dk[rows, part[:, 1]]
+    first = np.where(a <= b, part[:, 0], part[:, 1])
+    return np.minimum(a, b), np.maximum(a, b), first
+
+
+def group_reduce(ufunc, X, assign, k, empty):
+    ''' Rows of X reduced per open column they are assigned to: k x cols,
+    with empty for open columns nothing is assigned to. '''
+    order = np.argsort(assign, kind = 'stable')
+    groups, starts = np.unique(assign[order], return_index = True)
+    out = np.full((k, X.shape[1]), empty, dtype = X.dtype)
+    out[groups] = ufunc.reduceat(X[order], starts, axis = 0)
+    return out
+
+
+def report(D, open_cols, weights = None):
+    ''' total (weighted) and max distance from the rows of D, the data
+    senders, to their closest open column, an aggregator '''
+    d = D[:, open_cols].min(axis = 1).astype(np.float64)
+    w = np.ones(len(D)) if weights is None else np.asarray(weights, dtype = np.float64)
+    return {'total': float(w @ d), 'max': float(d.max()), 'mean': float(w @ d / w.sum())}
+
+
+def greedy_median(D, k, weights, block = 256):
+    ''' greedy seeding: repeatedly open the column that lowers the total
+    distance most '''
+    best = np.full(len(D), np.inf, dtype = np.float32)
+    open_cols = []
+    for _ in range(k):
+        cost = np.empty(D.shape[1], dtype = np.float64)
+        for c in range(0, D.shape[1], block):
+            cost[c:c + block] = weights @ np.minimum(best[:, None], D[:, c:c + block])
+        cost[open_cols] = np.inf
+        col = int(np.argmin(cost))
+        open_cols.append(col)
+        best = np.minimum(best, D[:, col])
+    return open_cols
+
+
+def gonzalez_center(D, k):
+    ''' Gonzalez seeding (farthest first, a 2-approximation): start from
+    the best single center, then keep opening the column closest to the
+    sender furthest from all open ones '''
+    open_cols = [int(np.argmin(D.max(axis = 0)))]
+    best = D[:, open_cols[0]].astype(np.float32)
+    while len(open_cols) < k:
+        row = D[int(np.argmax(best))].astype(np.float32)
+        row[open_cols] = np.inf
+        col = int(np.argmin(row))
+        open_cols.append(col)
+        best = np.minimum(best, D[:, col])
+    return open_cols
+
+
+def k_median(D, k, weights = None, max_swaps = 1000, block = 256):
+    ''' k-median over distance matrix D (senders x candidate aggregators):
+    greedy seeding, then swap local search. For a block of candidates c
+    the total after swapping open column f out for c is, over all senders,
+    min(d1, D[:, c]), except that senders served by f get min(d2, D[:, c])
+    (d1/d2 = distance to the closest/second closest open column), so every
+    (f, c) swap of the block comes out of a few array passes and one
+    per-f grouped sum. The best improving swap of each block is applied
+    right away. Returns (open columns, report()). '''
+    k = min(k, D.shape[1])
+    w = np.ones(len(D), dtype = np.float32) if weights is None else np.asarray(weights, dtype = np.float32)
+    open_cols = greedy_median(D, k, w, block)
+    cost = float(w @ nearest_two(D, open_cols)[0])
+    swaps, improved = 0, True
+    while improved and swaps < max_swaps:
+        improved = False
+        for c in range(0, D.shape[1], block):
+            d1, d2, assign = nearest_two(D, open_cols)
+            Db = D[:, c:c + block]
+            X1 = np.minimum(d1[:, None], Db)
+            gain = group_reduce(np.add, w[:, None] * (np.minimum(d2[:, None], Db) - X1), assign, k, 0)
+            total = (w @ X1)[None, :] + gain         # k x block
+            total[:, np.isin(np.arange(c, c + Db.shape[1]), open_cols)] = np.inf
+            f, b = np.unravel_index(np.argmin(total), total.shape)
+            if total[f, b] < cost - 1e-6 * max(cost, 1):
+                open_cols[f] = c + int(b)
+                cost = float(total[f, b])
+                swaps += 1
+                improved = True
+                if swaps >= max_swaps: break
+    return open_cols, dict(report(D, open_cols, weights), swaps = swaps)
+
+
+def k_center(D, k, max_swaps = 1000, block = 256):
+    ''' k-center over distance matrix D: Gonzalez seeding, then swap local
+    search on the max distance. Swapping f out for c leaves each sender at
+    min(d1, D[:, c]), or min(d2, D[:, c]) if f served it; the max over the
+    senders f did not serve is the largest per-f group max of the first,
+    other than f's own, so it comes from the top two group maxima. The max
+    alone is flat over most swaps, so a swap that keeps it but leaves fewer
+    senders at that distance is taken too (same grouped sums on X >= max);
+    one that raises it never is, whatever the counts. Returns (open columns, report()). '''
+    k = min(k, D.shape[1])
+    n = len(D) + 1
+    open_cols = gonzalez_center(D, k)
+    d1 = nearest_two(D, open_cols)[0]
+    cost = float(d1.max())
+    score = cost * n + np.count_nonzero(d1 >= cost)
+    swaps, improved = 0, True
+    while improved and swaps < max_swaps:
+        improved = False
+        for c in range(0, D.shape[1], block):
+            d1, d2, assign = nearest_two(D, open_cols)
+            Db = D[:, c:c + block]
+            X1 = np.minimum(d1[:, None], Db)
+            X2 = np.minimum(d2[:, None], Db)
+            G1 = group_reduce(np.maximum, X1, assign, k, -np.inf)
+            G2 = group_reduce(np.maximum, X2, assign, k, -np.inf)
+            C1 = group_reduce(np.add, (X1 >= cost).astype(np.int32), assign, k, 0)
+            C2 = group_reduce(np.add, (X2 >= cost).astype(np.int32), assign, k, 0)
+            if k > 1:
+                top = np.argmax(G1, axis = 0)
+                top2 = np.partition(G1, k - 2, axis = 0)[k - 2]
+                others = np.where(np.arange(k)[:, None] == top[None, :], top2[None, :], G1.max(axis = 0)[None, :])
+            else:
+                others = np.full_like(G1, -np.inf)
+            worst = np.maximum(others, G2)           # k x block
+            # the counts are on X >= cost, so they only rank swaps with worst == cost
+            scores = np.where(worst < cost, worst * n,
+                              np.where(worst > cost, np.inf,
+                                       cost * n + C1.sum(axis = 0)[None, :] - C1 + C2))
+            scores[:, np.isin(np.arange(c, c + Db.shape[1]), open_cols)] = np.inf
+            f, b = np.unravel_index(np.argmin(scores), scores.shape)
+            if scores[f, b] < score:
+                open_cols[f] = c + int(b)
+                cost = float(worst[f, b])
+                d1 = nearest_two(D, open_cols)[0]
+                score = cost * n + np.count_nonzero(d1 >= cost)
+                swaps += 1
+                improved = True
+                if swaps >= max_swaps: break
+    return open_cols, dict(report(D, open_cols), swaps = swaps)
+
+
+def benchmark(M, k, d_M = None, seed = 1):
+    ''' M servers among 2M nodes of assign1's RGG, d_M of them sending
+    (all by default); prints total and max transfer distance of k-median
+    and k-center placements and how long each step took '''
+    import assign1  # here, not on top: assign1 imports diststore, which imports us
+    rng = np.random.default_rng(seed)
+    N = 2 * M
+    radius = 1.5 * np.sqrt(np.log(N) / (np.pi * N))
+    G = assign1.random_geometric_graph(N, radius, seed)
+    servers = rng.choice(list(G), size = min(M, G.order()), replace = False)
+    senders = servers if d_M is None else rng.choice(servers, size = d_M, replace = False)
+    print("-- placement, servers =", len(servers), "senders =", len(senders), "k =", k,
+          "graph =", G.order(), "nodes", G.size(), "edges")
+    start = time.time()
+    D = distance_matrix(G, senders, servers)
+    print("   distance matrix %.2fs" % (time.time() - start))
+    for name, solve in (('k-median', k_median), ('k-center', k_center)):
+        start = time.time()
+        aggs, rep = solve(D, k)
+        print("   %s total = %d max = %d swaps = %d time = %.2fs"
+              % (name, rep['total'], rep['max'], rep['swaps'], time.time() - start))
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    benchmark(*(args + [10000, 100][len(args):]))
@@ -0,0 +1,319 @@
+# Offline controller replay harness: runs a Ryu app in-process against stub
+# datapaths, no Mininet/OVS/root needed.
+#
+#   python replay_harness.py --app assign3/switch_ofp1_3.py --NumOFS 8 --NumHost 2 --events 20000
+#   python replay_harness.py --app Chap5-Student-pkg/Chap5-Student-pkg/ryu/NetworkX.py --pcap trace.pcap
+import argparse
+import contextlib
+import importlib
+import inspect
+import io
+import os
+import random as rnd
+import sys
+import time
+
+from ryu.lib import hub
+from ryu.lib.packet import packet, ethernet, arp, ipv4
+from ryu.lib import pcaplib
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser, ofproto_parser
+from ryu.controller import ofp_event
+from ryu.controller.handler import MAIN_DISPATCHER
+from ryu.topology import event, switches
+
+# OpenFlow 1.3 message type -> name, e.g. 14 -> 'FLOW_MOD'
+MSG_NAMES = dict((value, name[len('OFPT_'):]) for name, value in vars(ofproto_v1_3).items()
+                 if name.startswith('OFPT_'))
+
+
+def load_app(path):
+    ''' Import a Ryu app file the way ryu-manager does (its directory goes on
+    sys.path so it can import its helper modules), instantiate the RyuApp
+    and return (module, app, {event class: [handlers]}). '''
+    from ryu.base import app_manager
+    path = os.path.abspath(path)
+    sys.path.insert(0, os.path.dirname(path))
+    module = importlib.import_module(os.path.splitext(os.path.basename(path))[0])
+    for _, cls in inspect.getmembers(module, inspect.isclass):
+        if issubclass(cls, app_manager.RyuApp) and cls.__module__ == module.__name__:
+            app = cls()
+            break
+    else:
+        raise ValueError('no RyuApp in {}'.format(module.__name__))
+    handlers = {}
+    for _, method in inspect.getmembers(app, inspect.ismethod):
+        for ev_cls in getattr(method, 'callers', {}):
+            handlers.setdefault(ev_cls, []).append(method)
+    return module, app, handlers
+
+
+def patch_topology_api(module, get_datapath, get_switch, get_link):
+    ''' The apps call these through their own module namespace '''
+    for name, func in (('get_datapath', get_datapath),
+                       ('get_switch', get_switch),
+                       ('get_link', get_link)):
+        if hasattr(module, name):
+            setattr(module, name, func)
+
+
+class StubDatapath(object):
+    ''' Stands in for ryu.controller.controller.Datapath: same ofproto and
+    parser, but every message is recorded instead of written to a socket. '''
+
+    def __init__(self, dpid):
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.is_active = True
+        self.address = ('127.0.0.1', 6653)
+        self.xid = 0
+        self.sent = {}       # message type name -> count
+
+    def set_xid(self, msg):
+        self.xid += 1
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send_msg(self, msg):
+        self.set_xid(msg)
+        msg.serialize()
+        self.send(msg.buf)
+
+    def send(self, buf):
+        # a buffer can hold several messages (batched writes)
+        offset = 0
+        while offset < len(buf):
+            version, msg_type, msg_len, xid = ofproto_parser.header(buf[offset:])
+            name = MSG_NAMES.get(msg_type, str(msg_type))
+            self.sent[name] = self.sent.get(name, 0) + 1
+            offset += msg_len
+
+    def send_packet_out(self, buffer_id=0xffffffff, in_port=None, actions=None, data=None):
+        parser = self.ofproto_parser
+        if in_port is None:
+            in_port = self.ofproto.OFPP_CONTROLLER
+        self.send_msg(parser.OFPPacketOut(self, buffer_id, in_port, actions or [], data))
+
+
+class Harness(object):
+    ''' Builds the same ring as MyTopo in customtopo.py (NumHost hosts per
+    switch on ports 1..NumHost, ring links on the next two ports), loads the
+    app and feeds it events. '''
+
+    def __init__(self, app_path, num_ofs=4, num_host=2, verbose=False):
+        self.verbose = verbose
+        self.module, self.app, self.handlers = load_app(app_path)
+
+        self.datapaths = {}
+        self.switches = {}
+        self.links = []
+        self.hosts = []      # (MAC, dpid, port)
+        self.build_ring(num_ofs, num_host)
+
+        patch_topology_api(self.module, self.get_datapath, self.get_switch, self.get_link)
+
+    def build_ring(self, num_ofs, num_host):
+        parser = ofproto_v1_3_parser
+        for i in range(num_ofs):
+            dpid = i + 1
+            dp = StubDatapath(dpid)
+            self.datapaths[dpid] = dp
+            sw = switches.Switch(dp)
+            for port_no in range(1, num_host + 3):
+                sw.add_port(parser.OFPPort(port_no, '00:00:00:00:{:02x}:{:02x}'.format(dpid % 256, port_no),
+                                           's{}-eth{}'.format(dpid, port_no), 0, 0, 0, 0, 0, 0, 0, 0))
+            self.switches[dpid] = sw
+            for j in range(num_host):
+                h = i * num_host + j + 1
+                self.hosts.append(('00:00:00:{:02x}:{:02x}:{:02x}'.format(
+                    (h >> 16) & 0xff, (h >> 8) & 0xff, h & 0xff), dpid, j + 1))
+        if num_ofs > 1:
+            for i in range(num_ofs):
+                a = i + 1
+                b = (i + 1) % num_ofs + 1
+                if num_ofs == 2 and a == 2:
+                    break
+                pa = self.switches[a].ports[num_host]        # port num_host + 1
+                pb = self.switches[b].ports[num_host + 1]    # port num_host + 2
+                self.links.append(switches.Link(pa, pb))
+                self.links.append(switches.Link(pb, pa))
+
+    # topology API replacements
+    def get_datapath(self, app, dpid=None):
+        if dpid is None:
+            return list(self.datapaths.values())
+        return self.datapaths.get(dpid)
+
+    def get_switch(self, app, dpid=None):
+        if dpid is None:
+            return list(self.switches.values())
+        return [self.switches[dpid]] if dpid in self.switches else []
+
+    def get_link(self, app, dpid=None):
+        if dpid is None:
+            return list(self.links)
+        return [l for l in self.links if l.src.dpid == dpid]
+
+    def dispatch(self, ev):
+        with self.quiet():
+            for handler in self.handlers.get(type(ev), []):
+                handler(ev)
+
+    @contextlib.contextmanager
+    def quiet(self):
+        if self.verbose:
+            yield
+        else:
+            with contextlib.redirect_stdout(io.StringIO()):
+                yield
+
+    def connect(self):
+        ''' switch handshake + topology discovery '''
+        parser = ofproto_v1_3_parser
+        for dp in self.datapaths.values():
+            ev = ofp_event.EventOFPStateChange(dp)
+            ev.state = MAIN_DISPATCHER
+            self.dispatch(ev)
+            self.dispatch(ofp_event.EventOFPSwitchFeatures(
+                parser.OFPSwitchFeatures(dp, dp.id, 0, 254, 0, 0)))
+        for sw in self.switches.values():
+            self.dispatch(event.EventSwitchEnter(sw))
+        for link in self.links:
+            self.dispatch(event.EventLinkAdd(link))
+        self.settle()
+
+    def settle(self, seconds=0.05):
+        # let spawned green threads (batch flushes, table rebuilds) run
+        with self.quiet():
+            hub.sleep(seconds)
+
+    # events
+    def packet_in_event(self, dpid, port, data):
+        parser = ofproto_v1_3_parser
+        msg = parser.OFPPacketIn(self.datapaths[dpid], buffer_id=ofproto_v1_3.OFP_NO_BUFFER,
+                                 total_len=len(data), reason=ofproto_v1_3.OFPR_NO_MATCH,
+                                 table_id=0, match=parser.OFPMatch(in_port=port), data=data)
+        return ofp_event.EventOFPPacketIn(msg)
+
+    def port_status_event(self, dpid, port, down=True):
+        ofp = ofproto_v1_3
+        parser = ofproto_v1_3_parser
+        state = ofp.OFPPS_LINK_DOWN if down else ofp.OFPPS_LIVE
+        desc = parser.OFPPort(port, '00:00:00:00:00:00', 's{}-eth{}'.format(dpid, port),
+                              0, state, 0, 0, 0, 0, 0, 0)
+        msg = parser.OFPPortStatus(self.datapaths[dpid], ofp.OFPPR_MODIFY, desc)
+        return ofp_event.EventOFPPortStatus(msg)
+
+    def frame(self, src, dst, src_ip, dst_ip, is_arp=False):
+        pkt = packet.Packet()
+        if is_arp:
+            pkt.add_protocol(ethernet.ethernet(dst='ff:ff:ff:ff:ff:ff', src=src, ethertype=0x0806))
+            pkt.add_protocol(arp.arp(src_mac=src, src_ip=src_ip, dst_mac='00:00:00:00:00:00', dst_ip=dst_ip))
+        else:
+            pkt.add_protocol(ethernet.ethernet(dst=dst, src=src, ethertype=0x0800))
+            pkt.add_protocol(ipv4.ipv4(src=src_ip, dst=dst_ip, proto=17))
+        pkt.serialize()
+        return bytes(pkt.data)
+
+    def host_ip(self, index):
+        return '10.0.{}.{}'.format((index + 1) // 256, (index + 1) % 256)
+
+    def synthetic_events(self, count, port_down_every=0):
+        ''' warm-up ARPs from every host, then unicast between random hosts '''
+        for i, (mac, dpid, port) in enumerate(self.hosts):
+            yield self.packet_in_event(dpid, port, self.frame(mac, None, self.host_ip(i),
+                                                              self.host_ip((i + 1) % len(self.hosts)), True))
+        for n in range(count):
+            i, j = rnd.sample(range(len(self.hosts)), 2)
+            smac, dpid, port = self.hosts[i]
+            yield self.packet_in_event(dpid, port, self.frame(smac, self.hosts[j][0],
+                                                              self.host_ip(i), self.host_ip(j)))
+            if port_down_every and n % port_down_every == port_down_every - 1:
+                mac, dpid, port = rnd.choice(self.hosts)
+                yield self.port_status_event(dpid, port)
+
+    def pcap_events(self, path):
+        ''' frames from a pcap; each enters at the edge port of its source MAC '''
+        where = dict((mac, (dpid, port)) for mac, dpid, port in self.hosts)
+        with open(path, 'rb') as f:
+            for ts, buf in pcaplib.Reader(f):
+                src = packet.Packet(buf).get_protocol(ethernet.ethernet)
+                if src is None:
+                    continue
+                if src.src not in where:
+                    mac, dpid, port = rnd.choice(self.hosts)
+                    where[src.src] = (dpid, port)
+                dpid, port = where[src.src]
+                yield self.packet_in_event(dpid, port, buf)
+
+    def replay(self, events, rate=0):
+        ''' rate = events per second, 0 = as fast as possible '''
+        latencies = []
+        start = time.perf_counter()
+        for n, ev in enumerate(events):
+            if rate:
+                due = start + n / float(rate)
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    self.settle(delay)
+            t0 = time.perf_counter()
+            self.dispatch(ev)
+            latencies.append(time.perf_counter() - t0)
+            if n % 256 == 255:
+                self.settle(0)
+        elapsed = time.perf_counter() - start
+        self.settle()
+        return self.report(latencies, elapsed)
+
+    def report(self, latencies, elapsed):
+        latencies.sort()
+
+        def pct(q):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1e6
+
+        sent = {}
+        for dp in self.datapaths.values():
+            for name, count in dp.sent.items():
+                sent[name] = sent.get(name, 0) + count
+        return {'events': len(latencies),
+                'elapsed_s': elapsed,
+                'events_per_s': len(latencies) / elapsed if elapsed else 0.0,
+                'latency_us': {'p50': pct(0.50), 'p90': pct(0.90), 'p99': pct(0.99), 'max': pct(1.0)},
+                'messages': sent}
+
+
+def main(*args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--app', action="store", default='assign3/switch_ofp1_3.py')
+    parser.add_argument('--NumOFS', type=int, action="store", default=4)
+    parser.add_argument('--NumHost', type=int, action="store", default=2)
+    parser.add_argument('--events', type=int, action="store", default=10000)
+    parser.add_argument('--rate', type=float, action="store", default=0)
+    parser.add_argument('--port-down-every', type=int, action="store", default=0)
+    parser.add_argument('--pcap', action="store", default=None)
+    parser.add_argument('--seed', type=int, action="store", default=None)
+    parser.add_argument('--verbose', action="store_true")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        rnd.seed(args.seed)
+    harness = Harness(args.app, args.NumOFS, args.NumHost, args.verbose)
+    harness.connect()
+    if args.pcap:
+        events = harness.pcap_events(args.pcap)
+    else:
+        events = harness.synthetic_events(args.events, args.port_down_every)
+    result = harness.replay(events, args.rate)
+
+    print("-- app = {}, (NumOFS, NumHost) = ({}, {})".format(args.app, args.NumOFS, args.NumHost))
+    print("   events = {}, {:.0f} events/s".format(result['events'], result['events_per_s']))
+    print("   latency (us): p50 = {p50:.1f}, p90 = {p90:.1f}, p99 = {p99:.1f}, max = {max:.1f}".format(
+        **result['latency_us']))
+    for name, count in sorted(result['messages'].items()):
+        print("   {} = {}".format(name, count))
+
+
+if __name__ == "__main__":
+    main()